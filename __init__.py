@@ -3,7 +3,28 @@ Chess Game Package
 
 This package contains modules for running a chess_game_module. It includes:
 
-- game.py: Main game logic and setup.
+- game.py: Main game loop and setup of the pygame window.
+- position.py: Headless game state and move checking rules, usable without pygame.
+- attack_tables.py: Precomputed knight, king and pawn attacks and magic bitboard tables, cached on disk.
+- bitboard.py: Bitboard move generator, selectable as the backend of a position.
+- zobrist.py: Zobrist keys identifying positions, updated incrementally by every move.
+- selfplay.py: Headless batch runner playing random, engine or scripted games over all cores.
+- incremental.py: Updating the stored valid moves of only the pieces a move affects.
+- legality.py: Legal move filtering with attack maps, check masks and pin rays; checkmate and stalemate detection.
+- engine.py: Alpha-beta search engine that can play either side in the game window.
+- analysis.py: Background analysis process showing the engine's score and line under the board, cancelled on every move.
+- parallel.py: Lazy SMP search with worker processes sharing a transposition table in shared memory.
+- fen.py: Reading and writing Forsyth-Edwards Notation, and streaming positions from FEN files.
+- pgn.py: Streaming PGN reader that replays archives through the move rules and reports rejected moves.
+- records.py: Compact binary game records, memory-mapped for constant-time access to any game or move.
+- book.py: Opening book built from game records, memory-mapped and searched by Zobrist key.
+- mailbox_board.py: Compact 64-byte mailbox boards and a packed position store for keeping millions of positions.
+- batch.py: NumPy batch generation of pseudo-legal moves and attack maps for many positions at once.
+- tablebase.py: Retrograde generation and probing of KQK, KRK and KPK endgame tables.
+- server.py: Asyncio TCP server hosting many networked games, each in its own session, with spectators.
+- loadtest.py: Load test of the game server reporting move validation latency and memory per idle game.
+- instrumentation.py: Opt-in timing of move generation, rendering stages and frames, with JSON/CSV dumps.
+- perft.py: Command-line move generation test and benchmark with published node counts.
 - board_drawing.py: Functions for drawing the chess board and pieces.
 - tests.py: Unit and smoke tests for the chess_game_module functionality.
 
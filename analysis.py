@@ -0,0 +1,185 @@
+"""
+Background analysis of the position shown in the game window.
+
+An Analysis starts one worker process with its own small engine. The window sends it every
+new position and it searches that position deeper and deeper, putting the score and the
+expected line of every finished depth into a queue that the window reads without waiting.
+The search runs in a process and not in a thread so it never holds the interpreter lock the
+window needs for drawing, and with a lower priority so it only gets the processor time the
+window leaves.
+
+Every request carries a generation number and the window publishes the newest one in shared
+memory. The engine polls it together with its time budget (see Engine.search), so sending a
+new position or cancelling abandons the running search within about a thousand nodes, and
+results of older generations still in the queue are thrown away when they are read.
+
+The window also searches the engine's own moves with a second Analysis when the analysis is
+shown, and plays the move of the finished result, so the engine never blocks the drawing.
+
+    python -m package.chess_game_module.game --analysis
+"""
+import multiprocessing
+import os
+import queue
+from typing import Dict, List, Optional
+
+from package.chess_game_module.engine import MATE_SCORE, Engine
+from package.chess_game_module.position import Position
+
+# Seconds the worker may spend on one position, it then waits for the next one
+ANALYSIS_TIME = 60.0
+ANALYSIS_TABLE_SIZE = 1 << 16
+# Moves of the expected line shown in the status area
+SHOWN_MOVES = 8
+# Added to the worker's niceness, so on a busy or single-core machine the window is scheduled first
+WORKER_NICENESS = 10
+
+
+def _analyse(requests: multiprocessing.Queue, results: multiprocessing.Queue, latest, think_time: float,
+             table_size: int) -> None:
+    """
+    Worker process: searches the requested positions until it receives None.
+
+    Args:
+    requests (multiprocessing.Queue): (generation, position, history) tuples, or None to stop.
+    results (multiprocessing.Queue): (generation, result, finished) tuples are put here, one per
+    finished depth and a last one with finished set when the search ends without being cancelled.
+    latest: Shared integer with the newest generation; a search of an older one is abandoned.
+    think_time (float): Seconds one position may be searched.
+    table_size (int): Number of transposition table slots of the engine.
+    """
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+    engine = Engine(table_size)
+    while True:
+        request = requests.get()
+        # Only the newest request matters, the ones before it were cancelled while waiting
+        while request is not None:
+            try:
+                request = requests.get_nowait()
+            except queue.Empty:
+                break
+        if request is None:
+            return
+        generation, position, history = request
+        if latest.value != generation:
+            continue
+
+        def cancelled() -> bool:
+            return latest.value != generation
+
+        def report(result: Dict[str, object]) -> None:
+            results.put((generation, _summary(result), False))
+
+        result = engine.search(position, think_time, history=history, stop=cancelled, report=report)
+        if not cancelled():
+            results.put((generation, _summary(result), True))
+
+
+def _summary(result: Dict[str, object]) -> Dict[str, object]:
+    """
+    Keeps the parts of a search result the window shows.
+    """
+    return {key: result[key] for key in ('move', 'score', 'depth', 'line', 'nodes', 'seconds')}
+
+
+def format_analysis(result: Dict[str, object], turn: str) -> str:
+    """
+    Describes an analysis result in one line for the status area.
+
+    Args:
+    result (Dict[str, object]): A result read by Analysis.poll.
+    turn (str): The side to move in the analysed position, 'white' or 'black'.
+
+    Returns:
+    str: The depth, the score in pawns from white's point of view (or the moves until mate)
+    and the start of the expected line, e.g. 'depth 6  +0.35  e2e4 e7e5 g1f3'.
+    """
+    score = result['score'] if turn == 'white' else -result['score']
+    if abs(score) > MATE_SCORE - 1000:
+        plies = MATE_SCORE - abs(score)
+        value = f"{'+' if score > 0 else '-'}M{(plies + 1) // 2}"
+    else:
+        value = f'{score / 100:+.2f}'
+    return f"depth {result['depth']}  {value}  {' '.join(result['line'][:SHOWN_MOVES])}"
+
+
+class Analysis:
+    """
+    A worker process analysing the positions it is sent, one at a time.
+
+    Attributes:
+    result (Optional[Dict[str, object]]): Deepest result of the current position so far, with the
+    best 'move', the 'score' for the side to move, 'depth', 'line', 'nodes' and 'seconds'; None
+    before the first depth is finished and after a cancel.
+    running (bool): Whether the worker is still searching the current position.
+    """
+
+    def __init__(self, think_time: float = ANALYSIS_TIME, table_size: int = ANALYSIS_TABLE_SIZE) -> None:
+        """
+        Starts the worker process.
+
+        Args:
+        think_time (float): Seconds the worker may spend on one position.
+        table_size (int): Number of transposition table slots of the worker's engine.
+        """
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.latest = context.Value('q', 0, lock=False)
+        self.generation = 0
+        self.result: Optional[Dict[str, object]] = None
+        self.running = False
+        self.process = context.Process(target=_analyse, daemon=True,
+                                       args=(self.requests, self.results, self.latest, think_time, table_size))
+        self.process.start()
+
+    def analyse(self, position: Position, history: Optional[List[int]] = None) -> None:
+        """
+        Cancels the current analysis and starts analysing a position.
+
+        Args:
+        position (Position): The position, copied so it can be changed right after the call.
+        history (Optional[List[int]]): Zobrist keys of the earlier positions of the game.
+        """
+        self.cancel()
+        self.requests.put((self.generation, position.copy(), list(history or [])))
+        self.running = True
+
+    def cancel(self) -> None:
+        """
+        Stops the current analysis and forgets its result, without waiting for the worker.
+        """
+        self.generation += 1
+        self.latest.value = self.generation
+        self.result = None
+        self.running = False
+
+    def poll(self) -> bool:
+        """
+        Reads the results that arrived, without waiting.
+
+        Returns:
+        bool: Whether the result of the current position changed.
+        """
+        changed = False
+        while True:
+            try:
+                generation, result, finished = self.results.get_nowait()
+            except queue.Empty:
+                return changed
+            if generation != self.generation:
+                continue
+            self.result = result
+            self.running = not finished
+            changed = True
+
+    def close(self) -> None:
+        """
+        Stops the worker process.
+        """
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,402 @@
+"""
+Precomputed attack tables.
+
+Knight, king and pawn attacks are stored for all 64 squares. Rook and bishop attacks are
+looked up with magic bitboards: the occupied squares on the lines of a piece are multiplied
+by a magic number and the top bits of the product index a table holding the attacks for
+exactly that occupancy, so every sliding piece needs a single table lookup. The move
+helpers of Position and the bitboard generator both take their moves from here.
+
+Building the sliding tables takes a noticeable part of a second in Python, so all tables are
+written to a compact binary cache file the first time and loaded from it on later startups. The magic numbers
+were found once with find_magic and are kept below; run this module with --find-magics to
+search for new ones.
+"""
+import array
+import os
+import random
+import struct
+import sys
+from typing import Dict, List, Tuple
+
+# (dx, dy) steps of the pieces, re-exported by position.py; this module does not import the rules
+KNIGHT_DIRECTIONS = [(-2, -1), (-1, -2), (-1, 2), (-2, 1), (1, -2), (2, -1), (2, 1), (1, 2)]
+KING_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+ROOK_DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+BISHOP_DIRECTIONS = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+FULL_BOARD = 0xFFFFFFFFFFFFFFFF
+# SQUARE_LOCATIONS[y * 8 + x] is (x, y)
+SQUARE_LOCATIONS = [(index & 7, index >> 3) for index in range(64)]
+CACHE_FILE = os.environ.get('CHESS_ATTACK_TABLES',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attack_tables.bin'))
+CACHE_HEADER = struct.Struct('<4sII')  # file tag, format version, number of 64-bit words that follow
+CACHE_TAG = b'CATB'
+CACHE_VERSION = 1
+
+ROOK_MAGICS = [
+    0x2080001440022581, 0x1080200040001080, 0x4080100008200080, 0x0280080080100254,
+    0x4D8004000A180080, 0x0100080400020100, 0x1080010040800200, 0x0200004402002081,
+    0x0068800024884004, 0x1000804000802002, 0x000200208A001040, 0x3008801000800800,
+    0x2006001060440A00, 0x1000800200800400, 0x0004000441024810, 0xA001000082004100,
+    0x0040808000204014, 0x0000424002201000, 0x0010110041002000, 0x0000090021041000,
+    0x0204008004800800, 0x0000808004000200, 0x6006040021485042, 0x0000020002409924,
+    0x2000401980028020, 0x4000400100308100, 0x0000820200201041, 0xB100100080800800,
+    0x3004080080040080, 0x0802000200041009, 0x01A0580400021110, 0x00020042000408A1,
+    0x4218884000800023, 0x0480201000400045, 0x0010200080801000, 0x1200200901001000,
+    0x0000100801000500, 0x0080020080800400, 0x004A000100404080, 0x0480005402001081,
+    0x258000402000C000, 0xA010004820084002, 0x0480200010008080, 0x244100100021000C,
+    0x2040080005010010, 0x0012000810020004, 0x0011000200B9000C, 0x1121000080410002,
+    0x00082080410A0600, 0x4002008100402600, 0x0A0300E008544100, 0x7B00080010008080,
+    0x0300080100100500, 0x0002020080040080, 0x0042521810214400, 0x8A00004089140200,
+    0x00001280010A2041, 0x0400401102042086, 0x41902000100C4101, 0x0043020420900009,
+    0x00E2000410082002, 0x4402000108041002, 0x2100101A00814804, 0x0400010400218246,
+]
+BISHOP_MAGICS = [
+    0x0102040418220020, 0x0108024802002028, 0x8010044040400001, 0x0022209200044800,
+    0x4004504005040114, 0x0022010420A80800, 0x0008441008090002, 0x0000420801480200,
+    0x1100220244011C00, 0x00883004081AB020, 0x4400100152002000, 0x4019080841004000,
+    0x2861021210000000, 0x400EA10108400020, 0x4800208208A24000, 0x0020A500A0842085,
+    0x3410000802504400, 0x0010E0200C010060, 0x0014182042408200, 0x4094006840112109,
+    0x2014200202010000, 0x000100020080C400, 0x800400420D2C0200, 0x0002200182251000,
+    0x0010F10304C41000, 0x001024A008281084, 0x0088110002040100, 0x0820080001004008,
+    0x0104040020410050, 0x0110002027040500, 0x418C008009182100, 0x2C00A9040C80480B,
+    0x008110C8005020A4, 0x4004210802041000, 0x0004020108208100, 0x0000080800120A00,
+    0x430C008400820102, 0x1400808100020108, 0x005006020010A8A0, 0x000801868004A220,
+    0x00420105C00C2000, 0x1010921032019040, 0x0300222028103000, 0x0008004208001080,
+    0x5410202248811400, 0x0008010800800808, 0x3C02C20404000900, 0x0408022282040032,
+    0x0000941002100000, 0x0112209A10100804, 0x080C020111210000, 0x442002A442022008,
+    0x00084A181B040000, 0x00115021021C2080, 0x4010051000A20000, 0x0404688085060000,
+    0x0000220110011000, 0x140000220734200C, 0x0440010424020800, 0x2204828883460800,
+    0x0020000004050410, 0x4060004A20082080, 0x00489034B002C201, 0x0444049010410300,
+]
+
+
+def bit_locations(bitboard: int) -> List[Tuple[int, int]]:
+    """
+    Lists the squares of all bits set in a bitboard.
+
+    Args:
+    bitboard (int): The set of squares.
+
+    Returns:
+    List[Tuple[int, int]]: The (x, y) locations of the set bits, lowest bit first.
+    """
+    locations = []
+    while bitboard:
+        lowest = bitboard & -bitboard
+        locations.append(SQUARE_LOCATIONS[lowest.bit_length() - 1])
+        bitboard ^= lowest
+    return locations
+
+
+def step_attacks(index: int, directions: List[Tuple[int, int]]) -> int:
+    """
+    Calculates the squares reached by a single step in each of the directions.
+
+    Args:
+    index (int): Bit index y * 8 + x of the starting square.
+    directions (List[Tuple[int, int]]): List of (dx, dy) steps, e.g. knight or king moves.
+
+    Returns:
+    int: The set of reached squares.
+    """
+    x, y = index & 7, index >> 3
+    attacks = 0
+    for dx, dy in directions:
+        if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+            attacks |= 1 << ((y + dy) * 8 + x + dx)
+    return attacks
+
+
+def ray_attacks(index: int, occupied: int, directions: List[Tuple[int, int]]) -> int:
+    """
+    Calculates the squares reached by a sliding piece by walking its rays square by square.
+
+    Each ray stops at the first occupied square, which is included in the result. This is
+    the slow reference the magic tables are built from.
+
+    Args:
+    index (int): Bit index of the starting square.
+    occupied (int): All squares taken by any piece.
+    directions (List[Tuple[int, int]]): List of (dx, dy) directions of movement.
+
+    Returns:
+    int: The set of reached squares.
+    """
+    x, y = index & 7, index >> 3
+    attacks = 0
+    for dx, dy in directions:
+        new_x, new_y = x + dx, y + dy
+        while 0 <= new_x < 8 and 0 <= new_y < 8:
+            attacks |= 1 << (new_y * 8 + new_x)
+            if occupied >> (new_y * 8 + new_x) & 1:
+                break
+            new_x, new_y = new_x + dx, new_y + dy
+    return attacks
+
+
+def line_mask(index: int, directions: List[Tuple[int, int]]) -> int:
+    """
+    Calculates the squares whose occupancy can change the attacks of a sliding piece.
+
+    The last square of every ray is left out, since a ray ends there anyway.
+
+    Args:
+    index (int): Bit index of the square of the piece.
+    directions (List[Tuple[int, int]]): List of (dx, dy) directions of movement.
+
+    Returns:
+    int: The relevant occupancy mask.
+    """
+    x, y = index & 7, index >> 3
+    mask = 0
+    for dx, dy in directions:
+        new_x, new_y = x + dx, y + dy
+        while 0 <= new_x + dx < 8 and 0 <= new_y + dy < 8:
+            mask |= 1 << (new_y * 8 + new_x)
+            new_x, new_y = new_x + dx, new_y + dy
+    return mask
+
+
+def occupancy_subsets(mask: int) -> List[int]:
+    """
+    Lists every subset of the squares of a mask.
+
+    Args:
+    mask (int): The set of squares.
+
+    Returns:
+    List[int]: All 2 ** popcount(mask) subsets, starting with the empty one.
+    """
+    subsets, subset = [], 0
+    while True:
+        subsets.append(subset)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return subsets
+
+
+def find_magic(index: int, directions: List[Tuple[int, int]], rng: random.Random) -> int:
+    """
+    Searches for a magic number that maps every occupancy of a square's lines to a table
+    index without two different attack sets sharing an index.
+
+    Args:
+    index (int): Bit index of the square of the piece.
+    directions (List[Tuple[int, int]]): ROOK_DIRECTIONS or BISHOP_DIRECTIONS.
+    rng (random.Random): Source of candidate numbers.
+
+    Returns:
+    int: A working magic number.
+    """
+    mask = line_mask(index, directions)
+    shift = 64 - bin(mask).count('1')
+    occupancies = occupancy_subsets(mask)
+    attacks = [ray_attacks(index, occupied, directions) for occupied in occupancies]
+    while True:
+        # Numbers with few bits set work far more often
+        magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        if bin((mask * magic) & 0xFF00000000000000).count('1') < 6:
+            continue
+        table: Dict[int, int] = {}
+        for occupied, attack in zip(occupancies, attacks):
+            key = ((occupied * magic) & FULL_BOARD) >> shift
+            if table.setdefault(key, attack) != attack:
+                break
+        else:
+            return magic
+
+
+def _build_sliding_table(index: int, directions: List[Tuple[int, int]], magic: int) -> List[int]:
+    """
+    Fills the magic lookup table of one square.
+
+    Args:
+    index (int): Bit index of the square of the piece.
+    directions (List[Tuple[int, int]]): ROOK_DIRECTIONS or BISHOP_DIRECTIONS.
+    magic (int): The magic number of the square.
+
+    Returns:
+    List[int]: Attack sets indexed by ((occupied & mask) * magic) >> shift.
+    """
+    mask = line_mask(index, directions)
+    bits = bin(mask).count('1')
+    table = [0] * (1 << bits)
+    for occupied in occupancy_subsets(mask):
+        table[((occupied * magic) & FULL_BOARD) >> (64 - bits)] = ray_attacks(index, occupied, directions)
+    return table
+
+
+def build_tables() -> List[int]:
+    """
+    Builds all attack tables from scratch.
+
+    Returns:
+    List[int]: The tables flattened in cache file order: knight, king, white pawn and black
+    pawn attacks, rook and bishop magics, then the rook and bishop lookup tables square by square.
+    """
+    words = [step_attacks(index, KNIGHT_DIRECTIONS) for index in range(64)]
+    words += [step_attacks(index, KING_DIRECTIONS) for index in range(64)]
+    words += [step_attacks(index, [(-1, -1), (1, -1)]) for index in range(64)]
+    words += [step_attacks(index, [(-1, 1), (1, 1)]) for index in range(64)]
+    words += ROOK_MAGICS + BISHOP_MAGICS
+    for directions, magics in [(ROOK_DIRECTIONS, ROOK_MAGICS), (BISHOP_DIRECTIONS, BISHOP_MAGICS)]:
+        for index in range(64):
+            words += _build_sliding_table(index, directions, magics[index])
+    return words
+
+
+def _read_cache(path: str) -> List[int]:
+    """
+    Reads the tables from the cache file.
+
+    Args:
+    path (str): Location of the cache file.
+
+    Returns:
+    List[int]: The flattened tables, or an empty list when the file is missing, damaged or
+    was written for other magic numbers.
+    """
+    try:
+        with open(path, 'rb') as file:
+            tag, version, count = CACHE_HEADER.unpack(file.read(CACHE_HEADER.size))
+            if tag != CACHE_TAG or version != CACHE_VERSION:
+                return []
+            words = array.array('Q')
+            words.fromfile(file, count)
+    except (OSError, EOFError, struct.error):
+        return []
+    if sys.byteorder == 'big':
+        words.byteswap()
+    words = words.tolist()
+    if words[256:384] != ROOK_MAGICS + BISHOP_MAGICS:
+        return []
+    return words
+
+
+def _write_cache(path: str, words: List[int]) -> None:
+    """
+    Writes the tables to the cache file. A read-only location is silently skipped.
+
+    Args:
+    path (str): Location of the cache file.
+    words (List[int]): The flattened tables.
+    """
+    data = array.array('Q', words)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(CACHE_HEADER.pack(CACHE_TAG, CACHE_VERSION, len(data)))
+            data.tofile(file)
+        os.replace(temporary, path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def load_tables(path: str = CACHE_FILE) -> List[int]:
+    """
+    Loads the tables from the cache file, building and caching them first if needed.
+
+    Args:
+    path (str): Location of the cache file.
+
+    Returns:
+    List[int]: The flattened tables, see build_tables.
+    """
+    words = _read_cache(path)
+    if not words:
+        words = build_tables()
+        _write_cache(path, words)
+    return words
+
+
+def _split_sliding_tables(words: List[int], offset: int,
+                          directions: List[Tuple[int, int]]) -> Tuple[List[int], List[int], List[List[int]], int]:
+    """
+    Cuts the flattened lookup tables of one piece type into per square tables.
+
+    Args:
+    words (List[int]): The flattened tables.
+    offset (int): Where the tables of this piece type start.
+    directions (List[Tuple[int, int]]): ROOK_DIRECTIONS or BISHOP_DIRECTIONS.
+
+    Returns:
+    Tuple[List[int], List[int], List[List[int]], int]: Masks, shifts and tables of all
+    squares, and the offset right after the last table.
+    """
+    masks, shifts, tables = [], [], []
+    for index in range(64):
+        mask = line_mask(index, directions)
+        bits = bin(mask).count('1')
+        masks.append(mask)
+        shifts.append(64 - bits)
+        tables.append(words[offset:offset + (1 << bits)])
+        offset += 1 << bits
+    return masks, shifts, tables, offset
+
+
+_words = load_tables()
+KNIGHT_ATTACKS = _words[0:64]
+KING_ATTACKS = _words[64:128]
+PAWN_ATTACKS = {'white': _words[128:192], 'black': _words[192:256]}
+ROOK_MASKS, ROOK_SHIFTS, ROOK_TABLES, _offset = _split_sliding_tables(_words, 384, ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_SHIFTS, BISHOP_TABLES, _offset = _split_sliding_tables(_words, _offset, BISHOP_DIRECTIONS)
+del _words, _offset
+
+
+def rook_attacks(index: int, occupied: int) -> int:
+    """
+    Looks up the squares attacked by a rook.
+
+    Args:
+    index (int): Bit index of the square of the rook.
+    occupied (int): All squares taken by any piece.
+
+    Returns:
+    int: The set of attacked squares, including the first piece on every line.
+    """
+    return ROOK_TABLES[index][(((occupied & ROOK_MASKS[index]) * ROOK_MAGICS[index]) & FULL_BOARD) >>
+                              ROOK_SHIFTS[index]]
+
+
+def bishop_attacks(index: int, occupied: int) -> int:
+    """
+    Looks up the squares attacked by a bishop.
+
+    Args:
+    index (int): Bit index of the square of the bishop.
+    occupied (int): All squares taken by any piece.
+
+    Returns:
+    int: The set of attacked squares, including the first piece on every diagonal.
+    """
+    return BISHOP_TABLES[index][(((occupied & BISHOP_MASKS[index]) * BISHOP_MAGICS[index]) & FULL_BOARD) >>
+                                BISHOP_SHIFTS[index]]
+
+
+def queen_attacks(index: int, occupied: int) -> int:
+    """
+    Looks up the squares attacked by a queen.
+
+    Args:
+    index (int): Bit index of the square of the queen.
+    occupied (int): All squares taken by any piece.
+
+    Returns:
+    int: The set of attacked squares.
+    """
+    return rook_attacks(index, occupied) | bishop_attacks(index, occupied)
+
+
+if __name__ == '__main__' and '--find-magics' in sys.argv:
+    generator = random.Random(2024)
+    for name, directions in [('ROOK_MAGICS', ROOK_DIRECTIONS), ('BISHOP_MAGICS', BISHOP_DIRECTIONS)]:
+        magics = [find_magic(index, directions, generator) for index in range(64)]
+        print(f'{name} = [')
+        for row in range(0, 64, 4):
+            print('    ' + ' '.join(f'0x{magic:016X},' for magic in magics[row:row + 4]))
+        print(']')
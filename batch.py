@@ -0,0 +1,319 @@
+"""
+NumPy batch move generation over many positions at once.
+
+For dataset generation the pseudo-legal moves and attack maps of millions of positions are
+needed, and calling check_all_moves one position at a time spends nearly all of its time in
+the interpreter. Here a batch of N positions is a BatchBoards: an N x 12 array of 64-bit
+bitboards, one per color and piece type in the order of bitboard.PIECE_TYPES (white first),
+and one array per field of the rest of the state. Every step of the generation is a shift
+and mask applied to whole columns of that array, so the interpreter runs a few hundred NumPy
+operations per batch instead of thousands of Python operations per position.
+
+Sliding pieces are flooded one direction at a time, seven steps at most, stopping on occupied
+squares. Along a single direction the rays of different pieces never share a square (a piece
+behind another stops where the other stands), and the same holds for every single knight,
+king or pawn step, so summing the population counts of all directions and steps gives the
+exact number of moves check_all_moves returns, without looking at the pieces one by one.
+
+Moves follow the rules of Position: en-passant captures, castling through unattacked
+squares, and a promotion counted once, as check_all_moves lists it.
+
+Usage:
+    python -m package.chess_game_module.batch 20000
+"""
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from package.chess_game_module.bitboard import PIECE_TYPES, SOURCE_MASKS, random_positions
+from package.chess_game_module.mailbox_board import BLACK, PACKED_SIZE, Mailbox, PositionStore
+from package.chess_game_module.position import (BISHOP_DIRECTIONS, KING_DIRECTIONS, KNIGHT_DIRECTIONS,
+                                                ROOK_DIRECTIONS, Position)
+
+PAWN, ROOK, KNIGHT, BISHOP, KING, QUEEN = range(6)  # plane of every white piece type, black ones follow
+_SOURCE_MASKS = {dx: np.uint64(mask) for dx, mask in SOURCE_MASKS.items()}
+_ROWS = [np.uint64(0xFF << (8 * y)) for y in range(8)]
+
+
+def _square(x: int, y: int) -> np.uint64:
+    return np.uint64(1 << (y * 8 + x))
+
+
+def _popcount(bitboards: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of every bitboard.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bitboards)
+    # NumPy before 2.0: count the bits of every byte
+    return np.unpackbits(bitboards.view(np.uint8).reshape(*bitboards.shape, 8), axis=-1).sum(axis=-1)
+
+
+class BatchBoards:
+    """
+    The positions of a batch as NumPy arrays.
+
+    Attributes:
+    planes (np.ndarray): N x 12 uint64 bitboards: white pawns, rooks, knights, bishops, king
+    and queens, then the black ones.
+    black_to_move (np.ndarray): N booleans.
+    castling (np.ndarray): N uint8 castling rights as in zobrist.castling_rights.
+    en_passant (np.ndarray): N int8 columns of a pawn that can be taken en passant, -1 for none.
+    """
+
+    def __init__(self, planes: np.ndarray, black_to_move: np.ndarray, castling: np.ndarray,
+                 en_passant: np.ndarray) -> None:
+        self.planes = planes
+        self.black_to_move = black_to_move
+        self.castling = castling
+        self.en_passant = en_passant
+
+    def __len__(self) -> int:
+        return len(self.planes)
+
+    @classmethod
+    def from_boards(cls, boards: np.ndarray, black_to_move: np.ndarray, castling: np.ndarray,
+                    en_passant: np.ndarray) -> 'BatchBoards':
+        """
+        Builds the bitboard planes from N x 64 piece codes.
+
+        Args:
+        boards (np.ndarray): N x 64 piece codes of mailbox_board, indexed y * 8 + x.
+        black_to_move (np.ndarray): N booleans.
+        castling (np.ndarray): N castling rights.
+        en_passant (np.ndarray): N en-passant columns, -1 for none.
+
+        Returns:
+        BatchBoards: The batch.
+        """
+        planes = np.empty((len(boards), 12), dtype=np.uint64)
+        for plane in range(12):
+            code = 1 + plane + (BLACK - 6 if plane >= 6 else 0)
+            # Bit i of the packed bytes is square i, so the 8 bytes read as one little-endian word
+            planes[:, plane] = np.packbits(boards == code, axis=1, bitorder='little').view('<u8')[:, 0]
+        return cls(planes, np.asarray(black_to_move, dtype=bool), np.asarray(castling, dtype=np.uint8),
+                   np.asarray(en_passant, dtype=np.int8))
+
+    @classmethod
+    def from_positions(cls, positions: List[Position]) -> 'BatchBoards':
+        """
+        Args:
+        positions (List[Position]): The positions.
+
+        Returns:
+        BatchBoards: The batch.
+        """
+        mailboxes = [Mailbox.from_position(position) for position in positions]
+        boards = np.frombuffer(b''.join(mailbox.squares for mailbox in mailboxes), dtype=np.uint8)
+        return cls.from_boards(boards.reshape(len(mailboxes), 64), [mailbox.black_to_move for mailbox in mailboxes],
+                               [mailbox.castling for mailbox in mailboxes],
+                               [-1 if mailbox.en_passant is None else mailbox.en_passant for mailbox in mailboxes])
+
+    @classmethod
+    def from_store(cls, store: PositionStore) -> 'BatchBoards':
+        """
+        Unpacks all positions of a store at once, without creating an object per position.
+
+        Args:
+        store (PositionStore): The store.
+
+        Returns:
+        BatchBoards: The batch.
+        """
+        packed = np.frombuffer(store.data, dtype=np.uint8).reshape(len(store), PACKED_SIZE)
+        boards = np.empty((len(store), 64), dtype=np.uint8)
+        boards[:, 0::2] = packed[:, :32] & 15
+        boards[:, 1::2] = packed[:, :32] >> 4
+        flags = packed[:, 32]
+        return cls.from_boards(boards, (flags & 1).astype(bool), flags >> 1 & 15,
+                               packed[:, 33].astype(np.int8) - 1)
+
+
+def shift(bitboards: np.ndarray, dx: int, dy: int) -> np.ndarray:
+    """
+    Moves every square of every bitboard by (dx, dy), dropping squares that leave the board.
+
+    Args:
+    bitboards (np.ndarray): uint64 bitboards.
+    dx (int): Delta x.
+    dy (int): Delta y.
+
+    Returns:
+    np.ndarray: The shifted bitboards.
+    """
+    bitboards = bitboards & _SOURCE_MASKS[dx]
+    offset = dx + 8 * dy
+    if offset > 0:
+        return bitboards << np.uint64(offset)
+    return bitboards >> np.uint64(-offset)
+
+
+def _rays(sliders: np.ndarray, empty: np.ndarray, dx: int, dy: int) -> np.ndarray:
+    """
+    Squares reached by sliding pieces in one direction, up to and including the first piece.
+    """
+    frontier, rays = sliders, np.zeros_like(sliders)
+    for _ in range(7):
+        frontier = shift(frontier, dx, dy)
+        rays |= frontier
+        frontier &= empty
+        if not frontier.any():
+            break
+    return rays
+
+
+def attack_maps(batch: BatchBoards) -> np.ndarray:
+    """
+    Calculates the squares attacked by each side, as bitboard.attacked_squares does.
+
+    Args:
+    batch (BatchBoards): The positions.
+
+    Returns:
+    np.ndarray: N x 2 uint64, the squares attacked by white and by black.
+    """
+    planes = batch.planes
+    empty = ~np.bitwise_or.reduce(planes, axis=1)
+    attacks = np.zeros((len(batch), 2), dtype=np.uint64)
+    for side, base, step in [(0, 0, -1), (1, 6, 1)]:
+        pieces = planes[:, base:base + 6]
+        attacked = shift(pieces[:, PAWN], -1, step) | shift(pieces[:, PAWN], 1, step)
+        for dx, dy in KNIGHT_DIRECTIONS:
+            attacked |= shift(pieces[:, KNIGHT], dx, dy)
+        for dx, dy in KING_DIRECTIONS:
+            attacked |= shift(pieces[:, KING], dx, dy)
+        for directions, sliders in [(ROOK_DIRECTIONS, pieces[:, ROOK] | pieces[:, QUEEN]),
+                                    (BISHOP_DIRECTIONS, pieces[:, BISHOP] | pieces[:, QUEEN])]:
+            for dx, dy in directions:
+                attacked |= _rays(sliders, empty, dx, dy)
+        attacks[:, side] = attacked
+    return attacks
+
+
+def pseudo_legal_moves(batch: BatchBoards) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Calculates the pseudo-legal moves of the side to move in every position.
+
+    Args:
+    batch (BatchBoards): The positions.
+
+    Returns:
+    Tuple[Dict[str, np.ndarray], np.ndarray]: For every piece type the N bitboards of squares
+    its pieces can move to, and the N numbers of moves, equal to the total length of the lists
+    of check_all_moves.
+    """
+    planes, black = batch.planes, batch.black_to_move
+    own = np.where(black[:, None], planes[:, 6:], planes[:, :6])
+    enemy = np.where(black[:, None], planes[:, :6], planes[:, 6:])
+    own_occupied = np.bitwise_or.reduce(own, axis=1)
+    enemy_occupied = np.bitwise_or.reduce(enemy, axis=1)
+    empty = ~(own_occupied | enemy_occupied)
+    not_own = ~own_occupied
+    counts = np.zeros(len(batch), dtype=np.int64)
+    masks = {}
+
+    def add(piece: str, targets: np.ndarray) -> None:
+        # Every call holds at most one target per piece, so the bits count the moves
+        nonlocal counts
+        masks[piece] = masks.get(piece, 0) | targets
+        counts += _popcount(targets)
+
+    # Pawns step towards y - 1 for white and y + 1 for black; both are computed and the right one kept
+    pawns = own[:, PAWN]
+    en_passant = np.where(batch.en_passant >= 0,
+                          np.uint64(1) << (np.where(black, 5, 2) * 8 + batch.en_passant).astype(np.uint64),
+                          np.uint64(0))
+    for step, start_row, is_side in [(-1, 6, ~black), (1, 1, black)]:
+        side_pawns = np.where(is_side, pawns, np.uint64(0))
+        single = shift(side_pawns, 0, step) & empty
+        add('pawn', single)
+        add('pawn', shift(single & shift(_ROWS[start_row], 0, step), 0, step) & empty)
+        for dx in (-1, 1):
+            add('pawn', shift(side_pawns, dx, step) & (enemy_occupied | en_passant))
+
+    for piece, plane, directions in [('knight', KNIGHT, KNIGHT_DIRECTIONS), ('king', KING, KING_DIRECTIONS)]:
+        for dx, dy in directions:
+            add(piece, shift(own[:, plane], dx, dy) & not_own)
+    for piece, plane, directions in [('rook', ROOK, ROOK_DIRECTIONS), ('bishop', BISHOP, BISHOP_DIRECTIONS),
+                                     ('queen', QUEEN, ROOK_DIRECTIONS + BISHOP_DIRECTIONS)]:
+        for dx, dy in directions:
+            add(piece, _rays(own[:, plane], empty, dx, dy) & not_own)
+
+    # Castling, as check_king_move: rights, king and rook at home, empty and unattacked squares
+    attacked = attack_maps(batch)
+    enemy_attacks = np.where(black, attacked[:, 0], attacked[:, 1])
+    row = np.where(black, 0, 7).astype(np.uint64)
+    rights = batch.castling >> np.where(black, 2, 0).astype(np.uint8)
+
+    def on_row(*xs: int) -> np.ndarray:
+        return np.bitwise_or.reduce([_square(x, 0) for x in xs]) << (row * np.uint64(8))
+
+    home = (own[:, KING] & on_row(3)) != 0
+    home &= (enemy_attacks & on_row(3)) == 0
+    short = home & (rights & 1 != 0) & (own[:, ROOK] & on_row(0) != 0) & (~empty & on_row(1, 2) == 0) & \
+        (enemy_attacks & on_row(1, 2) == 0)
+    long = home & (rights & 2 != 0) & (own[:, ROOK] & on_row(7) != 0) & (~empty & on_row(4, 5, 6) == 0) & \
+        (enemy_attacks & on_row(4, 5) == 0)
+    add('king', np.where(short, on_row(1), np.uint64(0)) | np.where(long, on_row(5), np.uint64(0)))
+    return {piece: np.asarray(masks.get(piece, np.zeros(len(batch), dtype=np.uint64)), dtype=np.uint64)
+            for piece in PIECE_TYPES}, counts
+
+
+def scalar_moves(position: Position) -> Tuple[Dict[str, int], int]:
+    """
+    Calculates what pseudo_legal_moves returns for one position with check_all_moves.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    Tuple[Dict[str, int], int]: The target squares of every piece type as a bitboard, and the
+    number of moves.
+    """
+    color = 'black' if position.turn == 'black' or position.turn == 'white_won' else 'white'
+    pieces = position.pieces(color)[0]
+    masks, count = dict.fromkeys(PIECE_TYPES, 0), 0
+    for piece, targets in zip(pieces, position.check_all_moves(color)):
+        count += len(targets)
+        for x, y in targets:
+            masks[piece] |= 1 << (y * 8 + x)
+    return masks, count
+
+
+def benchmark(positions: List[Position]) -> Dict[str, float]:
+    """
+    Compares check_all_moves one position at a time with the batch generator.
+
+    Args:
+    positions (List[Position]): The positions.
+
+    Returns:
+    Dict[str, float]: Positions per second for 'scalar', for 'batch' including the conversion
+    from Position objects, and for 'batch_store' starting from a PositionStore.
+    """
+    results = {}
+    begin = time.perf_counter()
+    for position in positions:
+        scalar_moves(position)
+    results['scalar'] = len(positions) / (time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    pseudo_legal_moves(BatchBoards.from_positions(positions))
+    results['batch'] = len(positions) / (time.perf_counter() - begin)
+
+    store = PositionStore()
+    for position in positions:
+        store.append(position)
+    begin = time.perf_counter()
+    pseudo_legal_moves(BatchBoards.from_store(store))
+    results['batch_store'] = len(positions) / (time.perf_counter() - begin)
+    return results
+
+
+if __name__ == '__main__':
+    result = benchmark(random_positions(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
+    print(f"scalar check_all_moves: {result['scalar']:10.0f} positions/s")
+    print(f"batch from positions:   {result['batch']:10.0f} positions/s")
+    print(f"batch from a store:     {result['batch_store']:10.0f} positions/s")
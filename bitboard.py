@@ -0,0 +1,394 @@
+"""
+Bitboard move generation.
+
+Every set of squares is kept in a 64-bit integer in which bit y * 8 + x stands for the
+square (x, y). Occupancy masks are built per color and per piece type, so checking
+whether a square is taken is a single AND instead of a search through a location list.
+The attacks of every piece come from the precomputed tables of attack_tables. The
+generator returns the same moves as the list based rules of Position and is used by
+Position.check_all_moves when the position's backend is set to 'bitboard'.
+
+Since the list based rules take their attacks from the same tables, benchmark also times
+ray_moves, a reference generator that walks the rays square by square through the location
+lists, the way Position did before the tables existed.
+"""
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from package.chess_game_module.attack_tables import (BISHOP_DIRECTIONS, BISHOP_MAGICS, BISHOP_MASKS, BISHOP_SHIFTS,
+                                                     BISHOP_TABLES, KING_ATTACKS, KING_DIRECTIONS, KNIGHT_ATTACKS,
+                                                     KNIGHT_DIRECTIONS, PAWN_ATTACKS, ROOK_DIRECTIONS, ROOK_MAGICS,
+                                                     ROOK_MASKS, ROOK_SHIFTS, ROOK_TABLES, bishop_attacks,
+                                                     bit_locations, rook_attacks)
+from package.chess_game_module.position import Position, opponent
+
+PIECE_TYPES = ['pawn', 'rook', 'knight', 'bishop', 'king', 'queen']
+FULL_BOARD = 0xFFFFFFFFFFFFFFFF
+# COLUMN_MASKS[x] contains all squares of the column x
+COLUMN_MASKS = [0x0101010101010101 << x for x in range(8)]
+# SOURCE_MASKS[dx] contains the squares that stay on the board after moving dx columns
+SOURCE_MASKS = {dx: sum(COLUMN_MASKS[x] for x in range(8) if 0 <= x + dx < 8) for dx in range(-7, 8)}
+
+
+def square_index(location: Tuple[int, int]) -> int:
+    """
+    Converts an (x, y) location to the index of its bit.
+
+    Args:
+    location (Tuple[int, int]): The square as (x, y).
+
+    Returns:
+    int: The bit index y * 8 + x.
+    """
+    return location[1] * 8 + location[0]
+
+
+def square_location(index: int) -> Tuple[int, int]:
+    """
+    Converts the index of a bit to an (x, y) location.
+
+    Args:
+    index (int): The bit index of the square.
+
+    Returns:
+    Tuple[int, int]: The square as (x, y).
+    """
+    return index & 7, index >> 3
+
+
+def shift(bitboard: int, dx: int, dy: int) -> int:
+    """
+    Moves every square of a bitboard by (dx, dy), dropping squares that leave the board.
+
+    Args:
+    bitboard (int): The set of squares.
+    dx (int): Delta x, the horizontal direction of movement.
+    dy (int): Delta y, the vertical direction of movement.
+
+    Returns:
+    int: The shifted set of squares.
+    """
+    # Squares that would wrap around to the other side of the board are removed first
+    bitboard &= SOURCE_MASKS[dx]
+    offset = dx + 8 * dy
+    if offset > 0:
+        return (bitboard << offset) & FULL_BOARD
+    return bitboard >> -offset
+
+
+class Bitboards:
+    """
+    Occupancy masks of one position.
+
+    Attributes:
+    occupancy (Dict[str, int]): All squares taken by 'white' and by 'black'.
+    pieces (Dict[str, Dict[str, int]]): Squares taken by every piece type of every color.
+    occupied (int): All squares taken by any piece.
+    """
+
+    def __init__(self, position: Position) -> None:
+        self.occupancy: Dict[str, int] = {}
+        self.pieces: Dict[str, Dict[str, int]] = {}
+        for color in ['white', 'black']:
+            pieces, locations = position.pieces(color)
+            by_type = dict.fromkeys(PIECE_TYPES, 0)
+            for piece, (x, y) in zip(pieces, locations):
+                by_type[piece] |= 1 << (y * 8 + x)
+            self.pieces[color] = by_type
+            occupancy = 0
+            for bitboard in by_type.values():
+                occupancy |= bitboard
+            self.occupancy[color] = occupancy
+        self.occupied = self.occupancy['white'] | self.occupancy['black']
+
+
+def pawn_attacks(pawns: int, color: str) -> int:
+    """
+    Calculates the squares attacked diagonally by a set of pawns.
+
+    Args:
+    pawns (int): The squares taken by the pawns.
+    color (str): Color of the pawns ('white' or 'black').
+
+    Returns:
+    int: The set of attacked squares.
+    """
+    step = -1 if color == 'white' else 1
+    return shift(pawns, -1, step) | shift(pawns, 1, step)
+
+
+def attacked_squares(boards: Bitboards, color: str) -> int:
+    """
+    Calculates all squares attacked by the pieces of the specified color.
+
+    Args:
+    boards (Bitboards): Occupancy masks of the position.
+    color (str): Color of the attacking pieces ('white' or 'black').
+
+    Returns:
+    int: The set of attacked squares.
+    """
+    by_type = boards.pieces[color]
+    attacked = pawn_attacks(by_type['pawn'], color)
+    for index in _indexes(by_type['knight']):
+        attacked |= KNIGHT_ATTACKS[index]
+    for index in _indexes(by_type['king']):
+        attacked |= KING_ATTACKS[index]
+    for index in _indexes(by_type['rook'] | by_type['queen']):
+        attacked |= rook_attacks(index, boards.occupied)
+    for index in _indexes(by_type['bishop'] | by_type['queen']):
+        attacked |= bishop_attacks(index, boards.occupied)
+    return attacked
+
+
+def _indexes(bitboard: int) -> List[int]:
+    """
+    Lists the bit indexes of all squares in a bitboard.
+
+    Args:
+    bitboard (int): The set of squares.
+
+    Returns:
+    List[int]: Bit indexes, lowest first.
+    """
+    indexes = []
+    while bitboard:
+        lowest = bitboard & -bitboard
+        indexes.append(lowest.bit_length() - 1)
+        bitboard ^= lowest
+    return indexes
+
+
+def generate_all_moves(position: Position, color: str) -> List[List[Tuple[int, int]]]:
+    """
+    Calculates all valid moves for all pieces of the specified color using bitboards.
+
+    Args:
+    position (Position): The position to generate moves for.
+    color (str): Color of the pieces ('white' or 'black').
+
+    Returns:
+    List[List[Tuple[int, int]]]: Moves of every piece, in the order of the piece list, exactly
+    like Position.check_all_moves.
+    """
+    boards = Bitboards(position)
+    other = 'black' if color == 'white' else 'white'
+    own, enemy, occupied = boards.occupancy[color], boards.occupancy[other], boards.occupied
+    empty = ~occupied & FULL_BOARD
+    pieces, locations = position.pieces(color)
+
+    if color == 'white':
+        step, start_row, en_passant_row, opponent_start_row, king_row = -1, 6, 3, 1, 7
+        last_move, pre_last_move = position.black_last_move, position.black_pre_last_move
+    else:
+        step, start_row, en_passant_row, opponent_start_row, king_row = 1, 1, 4, 6, 0
+        last_move, pre_last_move = position.white_last_move, position.white_pre_last_move
+
+    # Square behind an opponent's pawn that has just made a double step
+    en_passant = 0
+    if last_move is not None and pre_last_move == opponent_start_row:
+        opponent_pieces, opponent_locations = position.pieces(other)
+        last_x, last_y = opponent_locations[last_move]
+        if opponent_pieces[last_move] == 'pawn' and last_y == en_passant_row:
+            en_passant = 1 << ((last_y + step) * 8 + last_x)
+
+    pawn_table = PAWN_ATTACKS[color]
+    all_move_list = []
+    for piece, (x, y) in zip(pieces, locations):
+        index = y * 8 + x
+        if piece == 'pawn':
+            single = shift(1 << index, 0, step) & empty
+            moves = single
+            if single and y == start_row:
+                moves |= shift(single, 0, step) & empty
+            moves |= pawn_table[index] & (enemy | en_passant)
+        elif piece == 'knight':
+            moves = KNIGHT_ATTACKS[index] & ~own
+        elif piece == 'rook':
+            moves = ROOK_TABLES[index][(((occupied & ROOK_MASKS[index]) * ROOK_MAGICS[index]) & FULL_BOARD) >>
+                                       ROOK_SHIFTS[index]] & ~own
+        elif piece == 'bishop':
+            moves = BISHOP_TABLES[index][(((occupied & BISHOP_MASKS[index]) * BISHOP_MAGICS[index]) & FULL_BOARD) >>
+                                         BISHOP_SHIFTS[index]] & ~own
+        elif piece == 'queen':
+            moves = (rook_attacks(index, occupied) | bishop_attacks(index, occupied)) & ~own
+        else:
+            moves = KING_ATTACKS[index] & ~own
+            moves |= _castling_moves(boards, position, color, index, king_row)
+        all_move_list.append(bit_locations(moves & FULL_BOARD))
+
+    return all_move_list
+
+
+def _castling_moves(boards: Bitboards, position: Position, color: str, index: int, row: int) -> int:
+    """
+    Calculates the castling destinations of a king, following Position.check_king_move.
+
+    Args:
+    boards (Bitboards): Occupancy masks of the position.
+    position (Position): The position, for the castling rights.
+    color (str): Color of the king ('white' or 'black').
+    index (int): Bit index of the king's square.
+    row (int): Starting row of the king.
+
+    Returns:
+    int: The set of squares the king can castle to.
+    """
+    side = 0 if color == 'white' else 1
+    if position.king_moved[side] or index != row * 8 + 3:
+        return 0
+    attacked = attacked_squares(boards, 'black' if color == 'white' else 'white')
+    if attacked & (1 << index):
+        return 0
+    rooks, occupied, rooks_moved = boards.pieces[color]['rook'], boards.occupied, position.rook_moved[side]
+    moves = 0
+    # Short castling needs (1, row) and (2, row) empty and safe
+    if not rooks_moved[0] and rooks & (1 << (row * 8)) and not (occupied | attacked) & (0b110 << (row * 8)):
+        moves |= 1 << (row * 8 + 1)
+    # Long castling needs (4, row) to (6, row) empty and (4, row), (5, row) safe
+    if not rooks_moved[1] and rooks & (1 << (row * 8 + 7)) and not occupied & (0b1110000 << (row * 8)) and \
+            not attacked & (0b110000 << (row * 8)):
+        moves |= 1 << (row * 8 + 5)
+    return moves
+
+
+def ray_moves(position: Position, color: str) -> List[List[Tuple[int, int]]]:
+    """
+    Generates the moves of every piece by walking the rays through the location lists.
+
+    This is the generator Position used before the attack tables, kept as the reference the
+    table based backends are measured against. It returns the same moves as check_all_moves.
+
+    Args:
+    position (Position): The position.
+    color (str): Color of the pieces ('white' or 'black').
+
+    Returns:
+    List[List[Tuple[int, int]]]: The moves of every piece, in the order of the piece list.
+    """
+    pieces, own_locations = position.pieces(color)
+    opponent_pieces, opponent_locations = position.pieces(opponent(color))
+    side = 0 if color == 'white' else 1
+    step, start_row, row = (-1, 6, 7) if color == 'white' else (1, 1, 0)
+    last_move, pre_last_move = (position.black_last_move, position.black_pre_last_move) if color == 'white' \
+        else (position.white_last_move, position.white_pre_last_move)
+    # A pawn that has just made a double step stands beside the capturing pawn on this row
+    en_passant = None
+    if last_move is not None and pre_last_move == 7 - start_row and opponent_pieces[last_move] == 'pawn' and \
+            opponent_locations[last_move][1] == 7 - start_row - 2 * step:
+        en_passant = opponent_locations[last_move]
+    moves = []
+    for piece, (x, y) in zip(pieces, own_locations):
+        if piece == 'pawn':
+            piece_moves = []
+            if (x, y + step) not in own_locations and (x, y + step) not in opponent_locations:
+                piece_moves.append((x, y + step))
+                if y == start_row and (x, y + 2 * step) not in own_locations and \
+                        (x, y + 2 * step) not in opponent_locations:
+                    piece_moves.append((x, y + 2 * step))
+            for dx in (-1, 1):
+                if (x + dx, y + step) in opponent_locations or en_passant == (x + dx, y):
+                    piece_moves.append((x + dx, y + step))
+        elif piece == 'knight' or piece == 'king':
+            directions = KNIGHT_DIRECTIONS if piece == 'knight' else KING_DIRECTIONS
+            piece_moves = [(x + dx, y + dy) for dx, dy in directions
+                           if 0 <= x + dx < 8 and 0 <= y + dy < 8 and (x + dx, y + dy) not in own_locations]
+        else:
+            directions = ROOK_DIRECTIONS if piece == 'rook' else BISHOP_DIRECTIONS if piece == 'bishop' \
+                else ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+            piece_moves = []
+            for dx, dy in directions:
+                target = (x + dx, y + dy)
+                while 0 <= target[0] < 8 and 0 <= target[1] < 8 and target not in own_locations:
+                    piece_moves.append(target)
+                    if target in opponent_locations:
+                        break
+                    target = (target[0] + dx, target[1] + dy)
+        if piece == 'king' and position.king_moved[side] == 0 and (x, y) == (3, row):
+            attacker = opponent(color)
+            occupied = set(own_locations) | set(opponent_locations)
+            rooks_moved = position.rook_moved[side]
+            short = rooks_moved[0] == 0 and (0, row) in own_locations and \
+                pieces[own_locations.index((0, row))] == 'rook' and (1, row) not in occupied and \
+                (2, row) not in occupied
+            long = rooks_moved[1] == 0 and (7, row) in own_locations and \
+                pieces[own_locations.index((7, row))] == 'rook' and (4, row) not in occupied and \
+                (5, row) not in occupied and (6, row) not in occupied
+            if (short or long) and not position.is_attacked((3, row), attacker):
+                if short and not position.is_attacked((2, row), attacker) and \
+                        not position.is_attacked((1, row), attacker):
+                    piece_moves.append((1, row))
+                if long and not position.is_attacked((4, row), attacker) and \
+                        not position.is_attacked((5, row), attacker):
+                    piece_moves.append((5, row))
+        moves.append(piece_moves)
+    return moves
+
+
+def benchmark(positions: List[Position], repeat: int = 3) -> Dict[str, float]:
+    """
+    Measures how many positions per second each generator can generate all moves for.
+
+    Args:
+    positions (List[Position]): The positions to generate moves for.
+    repeat (int): How many times every position is processed.
+
+    Returns:
+    Dict[str, float]: Generated positions per second for 'rays' (ray_moves, the reference),
+    and for the 'lists' and 'bitboard' backends of Position.check_all_moves, which both take
+    their attacks from the tables.
+    """
+    results = {}
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        for position in positions:
+            ray_moves(position, position.turn)
+    results['rays'] = len(positions) * repeat / (time.perf_counter() - begin)
+    for backend in ['lists', 'bitboard']:
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            for position in positions:
+                position.backend = backend
+                position.check_all_moves(position.turn)
+        results[backend] = len(positions) * repeat / (time.perf_counter() - begin)
+    return results
+
+
+def random_positions(count: int, seed: int = 0, max_plies: int = 80) -> List[Position]:
+    """
+    Collects positions from random games, to be used as benchmark input.
+
+    Args:
+    count (int): Number of positions to collect.
+    seed (int): Seed of the random generator, so the set is reproducible.
+    max_plies (int): Maximal length of a single random game.
+
+    Returns:
+    List[Position]: The collected positions.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position()
+        for _ in range(max_plies):
+            if position.turn not in ('white', 'black') or len(positions) >= count:
+                break
+            moves = [(i, move) for i, piece_moves in enumerate(position.check_all_moves(position.turn))
+                     for move in piece_moves]
+            if not moves:
+                break
+            i, target = rng.choice(moves)
+            position.make_move((i, target, None))
+            if position.turn in ('white', 'black'):
+                positions.append(position.copy())
+    return positions
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    speed = benchmark(random_positions(count))
+    print(f"rays:     {speed['rays']:10.0f} positions/s (reference)")
+    print(f"lists:    {speed['lists']:10.0f} positions/s, {speed['lists'] / speed['rays']:.2f}x")
+    print(f"bitboard: {speed['bitboard']:10.0f} positions/s, {speed['bitboard'] / speed['rays']:.2f}x")
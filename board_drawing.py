@@ -1,23 +1,23 @@
+import functools
+import os
+import sys
+import time
 import pygame
-from typing import List, Tuple
-
-pygame.init()
-
-# Set the title of the pygame window
-pygame.display.set_caption('CHESS')
+from package.chess_game_module.position import CODE_PIECES
+from typing import Callable, Dict, List, Optional, Tuple
 
 # Define background color for the game
 BACKGROUND_COLOR = 'light gray'
 
-# Define window dimensions and create the display surface
+# Define window dimensions, the window itself is opened by the first draw
 WIDTH = 800
 HEIGHT = 900
 window_size = (WIDTH, HEIGHT)
-screen = pygame.display.set_mode(window_size)
+screen = None
 
-# Define font for displaying text and colors
-font = pygame.font.Font('freesansbold.ttf', 50)
-winning_font = pygame.font.Font('freesansbold.ttf', 100)
+# Define font sizes for displaying text and colors
+FONT_SIZE = 50
+WINNING_FONT_SIZE = 100
 font_color = 'black'
 winning_font_color = 'red'
 
@@ -28,137 +28,245 @@ SEPARATING_LINE_COLOR = 'black'
 HIGHLIGHTING_USED_PIECE_COLOR = 'red'
 HIGHLIGHTING_LAST_MOVED_PIECE = 'yellow'
 HIGHLIGHTING_MOVE_SQUARE_COLOR = 'blue'
+OVERLAY_COLOR = 'white'
+OVERLAY_FONT_SIZE = 18
+ANALYSIS_FONT_SIZE = 20
 
 # Define size of squares on the chess board and pieces
 SQUARE_SIZE = 100
 PIECE_SIZE = 80
 
-# Load and scale chess piece images
-# Black pieces
-black_pawn = pygame.transform.scale(pygame.image.load('chess_pieces/black_pawn.png'), (PIECE_SIZE, PIECE_SIZE))
-black_rook = pygame.transform.scale(pygame.image.load('chess_pieces/black_rook.png'), (PIECE_SIZE, PIECE_SIZE))
-black_knight = pygame.transform.scale(pygame.image.load('chess_pieces/black_knight.png'), (PIECE_SIZE, PIECE_SIZE))
-black_bishop = pygame.transform.scale(pygame.image.load('chess_pieces/black_bishop.png'), (PIECE_SIZE, PIECE_SIZE))
-black_king = pygame.transform.scale(pygame.image.load('chess_pieces/black_king.png'), (PIECE_SIZE, PIECE_SIZE))
-black_queen = pygame.transform.scale(pygame.image.load('chess_pieces/black_queen.png'), (PIECE_SIZE, PIECE_SIZE))
-
-# White pieces
-white_pawn = pygame.transform.scale(pygame.image.load('chess_pieces/white_pawn.png'), (PIECE_SIZE, PIECE_SIZE))
-white_rook = pygame.transform.scale(pygame.image.load('chess_pieces/white_rook.png'), (PIECE_SIZE, PIECE_SIZE))
-white_knight = pygame.transform.scale(pygame.image.load('chess_pieces/white_knight.png'), (PIECE_SIZE, PIECE_SIZE))
-white_bishop = pygame.transform.scale(pygame.image.load('chess_pieces/white_bishop.png'), (PIECE_SIZE, PIECE_SIZE))
-white_king = pygame.transform.scale(pygame.image.load('chess_pieces/white_king.png'), (PIECE_SIZE, PIECE_SIZE))
-white_queen = pygame.transform.scale(pygame.image.load('chess_pieces/white_queen.png'), (PIECE_SIZE, PIECE_SIZE))
-
-# Create lists of images for easier access
-white_images = [white_pawn, white_rook, white_knight, white_bishop, white_king, white_queen]
-black_images = [black_pawn, black_rook, black_knight, black_bishop, black_king, black_queen]
+# Chess piece images are packed into one atlas next to this module: white pieces in the
+# first row, black pieces in the second, columns in the order of piece_list
+ASSET_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chess_pieces')
+ATLAS_FILE = os.path.join(ASSET_DIRECTORY, 'atlas.png')
+ATLAS_SPRITE_SIZE = 60
+# Number of rendered text surfaces kept, least recently used ones are dropped first
+TEXT_CACHE_SIZE = 64
 # Indexes: 0 - pawn, 1 - rook, 2 - knight, 3 - bishop, 4 - king, 5 - queen
 piece_list = ['pawn', 'rook', 'knight', 'bishop', 'king', 'queen']
 
+# Assets created on first use
+_fonts: Dict[int, pygame.font.Font] = {}
+_atlas = None
+# Scaled piece images by size, then by (color, piece type)
+_piece_images: Dict[int, Dict[Tuple[str, str], pygame.Surface]] = {}
 
-def draw_chess_board(turn: str) -> None:
+
+def get_screen() -> pygame.Surface:
     """
-    Draws the chess board on the screen.
+    Returns the display surface, opening the window on the first call.
 
-    This function draws the chess board with alternating light and dark squares.
-    It also displays the current turn or the winning message when the game ends.
+    Returns:
+    pygame.Surface: The surface of the window.
+    """
+    global screen
+
+    if screen is None:
+        # Set the title of the pygame window
+        pygame.display.set_caption('CHESS')
+        screen = pygame.display.set_mode(window_size)
+    return screen
+
+
+def get_font(size: int) -> pygame.font.Font:
+    """
+    Returns the font of the given size, loading it on the first request.
 
     Args:
-    turn (str): The current turn in the game or the game's outcome. It can be 'white',
-    'black', 'white_won', or 'black_won'.
+    size (int): Height of the font in pixels.
+
+    Returns:
+    pygame.font.Font: The font.
     """
-    global screen, BACKGROUND_COLOR, LIGHT_SQUARE_COLOR, DARK_SQUARE_COLOR, SEPARATING_LINE_COLOR, SQUARE_SIZE, font,\
-        winning_font, font_color, winning_font_color
+    if size not in _fonts:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        _fonts[size] = pygame.font.Font('freesansbold.ttf', size)
+    return _fonts[size]
 
-    # Fill the background
-    screen.fill(BACKGROUND_COLOR)
 
-    # Draw each square of the chess board
-    for row in range(8):
-        for column in range(8):
-            # Alternate colors for the squares
-            color = LIGHT_SQUARE_COLOR if (row + column) % 2 == 0 else DARK_SQUARE_COLOR
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(size: int, text: str, color: str, antialias: bool = True) -> pygame.Surface:
+    """
+    Renders a line of text, reusing the surface when the same text was rendered before.
+
+    Args:
+    size (int): Size of the font, as for get_font.
+    text (str): The text.
+    color (str): Color of the text.
+    antialias (bool): Whether the edges of the letters are smoothed.
+
+    Returns:
+    pygame.Surface: The rendered text, shared between callers and not to be drawn on.
+    """
+    surface = get_font(size).render(text, antialias, color)
+    # Surfaces in the format of the window are blitted faster, which pays off once cached
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha()
+    return surface
+
+
+def build_atlas(source_directory: str = ASSET_DIRECTORY, output: str = ATLAS_FILE) -> None:
+    """
+    Packs the separate piece images (white_pawn.png, ...) into the atlas image.
 
-            # Define the position and size of the square
-            rect = (column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    Args:
+    source_directory (str): Directory with the separate images.
+    output (str): Path of the atlas to write.
+    """
+    atlas = pygame.Surface((ATLAS_SPRITE_SIZE * len(piece_list), ATLAS_SPRITE_SIZE * 2), pygame.SRCALPHA)
+    for row, color in enumerate(['white', 'black']):
+        for column, piece in enumerate(piece_list):
+            image = pygame.image.load(os.path.join(source_directory, f'{color}_{piece}.png'))
+            atlas.blit(image, (column * ATLAS_SPRITE_SIZE, row * ATLAS_SPRITE_SIZE))
+    pygame.image.save(atlas, output)
 
-            # Draw the square
-            pygame.draw.rect(screen, color, rect)
 
-    # Draw separating line below the chess board
-    pygame.draw.rect(screen, SEPARATING_LINE_COLOR, [0, WIDTH, WIDTH, 100], 2)
+def piece_image(color: str, piece: str, size: int = PIECE_SIZE) -> pygame.Surface:
+    """
+    Returns the image of a piece scaled to the given size.
+
+    The atlas is decoded once, on the first call, and every scaled image is kept, so
+    later calls for the same size only look it up.
+
+    Args:
+    color (str): 'white' or 'black'.
+    piece (str): Type of the piece.
+    size (int): Width and height of the image in pixels.
+
+    Returns:
+    pygame.Surface: The scaled image.
+    """
+    global _atlas
+
+    images = _piece_images.setdefault(size, {})
+    image = images.get((color, piece))
+    if image is None:
+        if _atlas is None:
+            _atlas = pygame.image.load(ATLAS_FILE)
+            if pygame.display.get_surface() is not None:
+                _atlas = _atlas.convert_alpha()
+        sprite = _atlas.subsurface((piece_list.index(piece) * ATLAS_SPRITE_SIZE,
+                                    (color == 'black') * ATLAS_SPRITE_SIZE, ATLAS_SPRITE_SIZE, ATLAS_SPRITE_SIZE))
+        image = images[(color, piece)] = pygame.transform.scale(sprite, (size, size))
+    return image
+
+
+# Pre-rendered board without pieces and text, created on first use
+_background = None
+# What the incremental renderer last put on the screen: the turn and the contents of every square
+_drawn_turn = None
+_drawn_squares: Dict[Tuple[int, int], tuple] = {}
+STATUS_RECT = pygame.Rect(0, WIDTH, WIDTH, HEIGHT - WIDTH)
+# Strip at the bottom of the status area, below the turn text and inside the separating line
+ANALYSIS_RECT = pygame.Rect(4, HEIGHT - 26, WIDTH - 8, 22)
+
+
+def board_background() -> pygame.Surface:
+    """
+    Returns the empty board with the status area, rendered once and reused afterwards.
+
+    Returns:
+    pygame.Surface: A surface of the size of the window.
+    """
+    global _background
+
+    if _background is None:
+        _background = pygame.Surface(window_size)
+        _background.fill(BACKGROUND_COLOR)
+
+        # Draw each square of the chess board
+        for row in range(8):
+            for column in range(8):
+                # Alternate colors for the squares
+                color = LIGHT_SQUARE_COLOR if (row + column) % 2 == 0 else DARK_SQUARE_COLOR
+                pygame.draw.rect(_background, color,
+                                 (column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+
+        # Draw separating line below the chess board
+        pygame.draw.rect(_background, SEPARATING_LINE_COLOR, [0, WIDTH, WIDTH, 100], 2)
+    return _background
+
+
+def draw_status(turn: str, render: Optional[Callable[..., pygame.Surface]] = None) -> None:
+    """
+    Displays the current turn or the winning message when the game ends.
+
+    Args:
+    turn (str): The current turn in the game or the game's outcome. It can be 'white',
+    'black', 'white_won', 'black_won' or 'draw'.
+    render (Optional[Callable[..., pygame.Surface]]): Function rendering the texts, with the
+    arguments of render_text, which is used by default.
+    """
+    global font_color, winning_font_color
+
+    screen = get_screen()
+    render = render or render_text
 
     # Define text messages for different game states
-    turn_text = ['WHITE TO MOVE!', 'BLACK TO MOVE!', 'WHITE WON!', 'BLACK WON!']
+    turn_text = ['WHITE TO MOVE!', 'BLACK TO MOVE!', 'WHITE WON!', 'BLACK WON!', 'DRAW!']
 
     # Display the appropriate message based on the game state
     if turn == 'white':
-        screen.blit(font.render(turn_text[0], True, font_color), (175, 825))
+        screen.blit(render(FONT_SIZE, turn_text[0], font_color), (175, 825))
     elif turn == 'black':
-        screen.blit(font.render(turn_text[1], True, font_color), (175, 825))
+        screen.blit(render(FONT_SIZE, turn_text[1], font_color), (175, 825))
     elif turn == 'white_won':
-        screen.blit(winning_font.render(turn_text[2], True, winning_font_color), (75, 350))
-        screen.blit(font.render('ZAGRAJ PONOWNIE', True, font_color), (150, 825))
+        screen.blit(render(WINNING_FONT_SIZE, turn_text[2], winning_font_color), (75, 350))
+        screen.blit(render(FONT_SIZE, 'ZAGRAJ PONOWNIE', font_color), (150, 825))
     elif turn == 'black_won':
-        screen.blit(winning_font.render(turn_text[3], True, winning_font_color), (75, 350))
-        screen.blit(font.render('ZAGRAJ PONOWNIE', True, font_color), (150, 825))
+        screen.blit(render(WINNING_FONT_SIZE, turn_text[3], winning_font_color), (75, 350))
+        screen.blit(render(FONT_SIZE, 'ZAGRAJ PONOWNIE', font_color), (150, 825))
+    elif turn == 'draw':
+        screen.blit(render(WINNING_FONT_SIZE, turn_text[4], winning_font_color), (225, 350))
+        screen.blit(render(FONT_SIZE, 'ZAGRAJ PONOWNIE', font_color), (150, 825))
+
+
+def draw_chess_board(turn: str, render: Optional[Callable[..., pygame.Surface]] = None) -> None:
+    """
+    Draws the chess board on the screen.
+
+    This function draws the chess board with alternating light and dark squares.
+    It also displays the current turn or the winning message when the game ends.
+
+    Args:
+    turn (str): The current turn in the game or the game's outcome. It can be 'white',
+    'black', 'white_won', or 'black_won'.
+    render (Optional[Callable[..., pygame.Surface]]): Function rendering the texts, see draw_status.
+    """
+    get_screen().blit(board_background(), (0, 0))
+    draw_status(turn, render)
 
 
-def draw_pieces(white_pieces: List[str], white_pieces_locations: List[Tuple[int, int]],
-                black_pieces: List[str], black_pieces_locations: List[Tuple[int, int]],
-                turn: str, white_last_move: int, black_last_move: int, selection: int) -> None:
+def draw_pieces(board: bytearray, turn: str, last_moved: Optional[Tuple[int, int]],
+                selected: Optional[Tuple[int, int]]) -> None:
     """
     Draws chess pieces on the board based on their current locations.
 
-    This function iterates through all pieces of both colors and places them on the
-    board. It also highlights the last moved piece and the currently selected piece.
+    This function goes through the squares of the board and places every piece found there.
+    It also highlights the last moved piece and the currently selected piece.
 
     Args:
-    white_pieces (List[str]): A list of white piece types.
-    white_pieces_locations (List[Tuple[int, int]]): A list of tuples representing the locations of white pieces.
-    black_pieces (List[str]): A list of black piece types.
-    black_pieces_locations (List[Tuple[int, int]]): A list of tuples representing the locations of black pieces.
+    board (bytearray): Piece code of every square, indexed y * 8 + x, as Position.board.
     turn (str): The current turn in the game.
-    white_last_move (int): Index of the last moved white piece.
-    black_last_move (int): Index of the last moved black piece.
-    selection (int): Index of the currently selected piece.
-    """
-    global screen, white_images, black_images, piece_list, HIGHLIGHTING_LAST_MOVED_PIECE, HIGHLIGHTING_USED_PIECE_COLOR
-
-    # Draw white pieces on the board
-    for i in range(len(white_pieces)):
-        index = piece_list.index(white_pieces[i])
-        screen.blit(white_images[index], (white_pieces_locations[i][0] * 100 + 10,
-                                          white_pieces_locations[i][1] * 100 + 10))
-
-        # Highlight the last moved piece and the selected piece for white
-        if turn == 'white':
-            if black_last_move == i:
-                pygame.draw.rect(screen, HIGHLIGHTING_LAST_MOVED_PIECE,
-                                 [black_pieces_locations[i][0] * 100 + 1,
-                                  black_pieces_locations[i][1] * 100 + 1, 98, 98], 2)
-            if selection == i:
-                pygame.draw.rect(screen, HIGHLIGHTING_USED_PIECE_COLOR,
-                                 [white_pieces_locations[i][0] * 100 + 1,
-                                  white_pieces_locations[i][1] * 100 + 1, 98, 98], 2)
-
-    # Draw black pieces on the board
-    for i in range(len(black_pieces)):
-        index = piece_list.index(black_pieces[i])
-        screen.blit(black_images[index], (black_pieces_locations[i][0] * 100 + 10,
-                                          black_pieces_locations[i][1] * 100 + 10))
-
-        # Highlight the last moved piece and the selected piece for black
-        if turn == 'black':
-            if white_last_move == i:
-                pygame.draw.rect(screen, HIGHLIGHTING_LAST_MOVED_PIECE,
-                                 [white_pieces_locations[i][0] * 100 + 1,
-                                  white_pieces_locations[i][1] * 100 + 1, 98, 98], 2)
-            if selection == i:
-                pygame.draw.rect(screen, HIGHLIGHTING_USED_PIECE_COLOR,
-                                 [black_pieces_locations[i][0] * 100 + 1,
-                                  black_pieces_locations[i][1] * 100 + 1, 98, 98], 2)
+    last_moved (Optional[Tuple[int, int]]): Square of the opponent's last moved piece, if it is highlighted.
+    selected (Optional[Tuple[int, int]]): Square of the currently selected piece, if any.
+    """
+    global HIGHLIGHTING_LAST_MOVED_PIECE, HIGHLIGHTING_USED_PIECE_COLOR
+
+    screen = get_screen()
+
+    # Draw the pieces of both colors on the board
+    for index in range(64):
+        if board[index]:
+            screen.blit(piece_image(*CODE_PIECES[board[index]]), ((index & 7) * 100 + 10, (index >> 3) * 100 + 10))
+
+    # Highlight the last moved piece and the selected piece for the side to move
+    if turn == 'white' or turn == 'black':
+        for square, color in [(last_moved, HIGHLIGHTING_LAST_MOVED_PIECE), (selected, HIGHLIGHTING_USED_PIECE_COLOR)]:
+            if square is not None:
+                pygame.draw.rect(screen, color, [square[0] * 100 + 1, square[1] * 100 + 1, 98, 98], 2)
 
 
 def draw_valid_moves(valid_moves: List[Tuple[int, int]]) -> None:
@@ -172,10 +280,218 @@ def draw_valid_moves(valid_moves: List[Tuple[int, int]]) -> None:
     valid_moves (List[Tuple[int, int]]): A list of tuples where each tuple represents the coordinates (x, y)
     of a valid move on the chess board.
     """
-    global screen, HIGHLIGHTING_MOVE_SQUARE_COLOR, SQUARE_SIZE
+    global HIGHLIGHTING_MOVE_SQUARE_COLOR, SQUARE_SIZE
+
+    screen = get_screen()
 
     # Iterate through the valid moves and draw a highlighting rectangle on each
     for move in valid_moves:
         pygame.draw.rect(screen, HIGHLIGHTING_MOVE_SQUARE_COLOR,
                          [move[0] * SQUARE_SIZE + 1, move[1] * SQUARE_SIZE + 1,
                           SQUARE_SIZE - 2, SQUARE_SIZE - 2], 2)
+
+
+def square_contents(board: bytearray, turn: str, last_moved: Optional[Tuple[int, int]],
+                    selected: Optional[Tuple[int, int]],
+                    valid_moves: List[Tuple[int, int]]) -> Dict[Tuple[int, int], tuple]:
+    """
+    Describes what has to be drawn on every non-empty square.
+
+    Args:
+    board (bytearray): Piece code of every square, indexed y * 8 + x, as Position.board.
+    turn (str): The current turn in the game.
+    last_moved (Optional[Tuple[int, int]]): Square of the opponent's last moved piece, if it is highlighted.
+    selected (Optional[Tuple[int, int]]): Square of the currently selected piece, if any.
+    valid_moves (List[Tuple[int, int]]): Squares the selected piece can move to.
+
+    Returns:
+    Dict[Tuple[int, int], tuple]: For every square with something on it, the piece as
+    (color, type) or None and the colors of the frames drawn around it, in drawing order.
+    """
+    pieces = {(index & 7, index >> 3): CODE_PIECES[board[index]] for index in range(64) if board[index]}
+
+    frames: Dict[Tuple[int, int], List[str]] = {}
+    # The side to move sees the last move of the opponent and its own selected piece
+    if turn == 'white' or turn == 'black':
+        if last_moved is not None:
+            frames.setdefault(last_moved, []).append(HIGHLIGHTING_LAST_MOVED_PIECE)
+        if selected is not None:
+            frames.setdefault(selected, []).append(HIGHLIGHTING_USED_PIECE_COLOR)
+    for move in valid_moves:
+        frames.setdefault(move, []).append(HIGHLIGHTING_MOVE_SQUARE_COLOR)
+
+    return {square: (pieces.get(square), tuple(frames.get(square, ()))) for square in set(pieces) | set(frames)}
+
+
+def _draw_square(square: Tuple[int, int], contents: Optional[tuple]) -> pygame.Rect:
+    """
+    Redraws one square from the background, with its piece and frames.
+
+    Args:
+    square (Tuple[int, int]): The square.
+    contents (Optional[tuple]): The square's value from square_contents, None for an empty square.
+
+    Returns:
+    pygame.Rect: The area of the screen that changed.
+    """
+    screen = get_screen()
+    rect = pygame.Rect(square[0] * SQUARE_SIZE, square[1] * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    screen.blit(board_background(), rect, rect)
+    if contents is not None:
+        piece, frames = contents
+        if piece is not None:
+            screen.blit(piece_image(*piece), (rect.x + 10, rect.y + 10))
+        for color in frames:
+            pygame.draw.rect(screen, color, [rect.x + 1, rect.y + 1, SQUARE_SIZE - 2, SQUARE_SIZE - 2], 2)
+    return rect
+
+
+def invalidate() -> None:
+    """
+    Makes the next draw_frame redraw the whole window, for example after it was uncovered.
+    """
+    global _drawn_turn, _drawn_squares
+
+    _drawn_turn = None
+    _drawn_squares = {}
+
+
+def draw_frame(board: bytearray, turn: str, last_moved: Optional[Tuple[int, int]],
+               selected: Optional[Tuple[int, int]], valid_moves: List[Tuple[int, int]]) -> List[pygame.Rect]:
+    """
+    Brings the screen up to date by redrawing only the squares whose contents changed.
+
+    Squares are restored from the pre-rendered background, so a frame in which nothing
+    changed draws nothing. The returned areas are meant for pygame.display.update.
+
+    Args:
+    board (bytearray): Piece code of every square, indexed y * 8 + x, as Position.board.
+    turn (str): The current turn in the game or the game's outcome.
+    last_moved (Optional[Tuple[int, int]]): Square of the opponent's last moved piece, if it is highlighted.
+    selected (Optional[Tuple[int, int]]): Square of the currently selected piece, if any.
+    valid_moves (List[Tuple[int, int]]): Squares the selected piece can move to.
+
+    Returns:
+    List[pygame.Rect]: The areas of the screen that were redrawn.
+    """
+    global _drawn_turn, _drawn_squares
+
+    screen = get_screen()
+    playing = turn == 'white' or turn == 'black'
+    rects = []
+    if turn != _drawn_turn:
+        if playing and (_drawn_turn == 'white' or _drawn_turn == 'black'):
+            # Only the status line changes
+            screen.blit(board_background(), STATUS_RECT, STATUS_RECT)
+            draw_status(turn)
+            rects.append(STATUS_RECT)
+        else:
+            # The game started or ended, the winning message covers the board
+            draw_chess_board(turn)
+            _drawn_turn, _drawn_squares = turn, {}
+            if not playing:
+                return [screen.get_rect()]
+            rects.append(screen.get_rect())
+        _drawn_turn = turn
+    if not playing:
+        return rects
+
+    contents = square_contents(board, turn, last_moved, selected, valid_moves)
+    for square in set(contents) | set(_drawn_squares):
+        if contents.get(square) != _drawn_squares.get(square):
+            rects.append(_draw_square(square, contents.get(square)))
+    _drawn_squares = contents
+    return rects
+
+
+def draw_overlay(lines: List[str]) -> pygame.Rect:
+    """
+    Draws lines of text in an opaque box in the top left corner of the window.
+
+    Meant for instrumentation numbers, drawn after draw_frame on every frame: the box always
+    has the same size, so it fully covers the one drawn before it. The text changes on every
+    frame and is not put in the text cache.
+
+    Args:
+    lines (List[str]): The lines.
+
+    Returns:
+    pygame.Rect: The area of the screen that changed.
+    """
+    screen = get_screen()
+    font = get_font(OVERLAY_FONT_SIZE)
+    rect = pygame.Rect(0, 0, WIDTH // 2, len(lines) * font.get_linesize() + 8)
+    pygame.draw.rect(screen, OVERLAY_COLOR, rect)
+    for row, line in enumerate(lines):
+        screen.blit(font.render(line, True, font_color), (4, 4 + row * font.get_linesize()))
+    return rect
+
+
+def draw_analysis(text: str) -> pygame.Rect:
+    """
+    Draws one line of engine analysis at the bottom of the status area.
+
+    The strip is cleared first, so the line replaces the one drawn before it; text that does
+    not fit is cut off at the separating line.
+
+    Args:
+    text (str): The line, see analysis.format_analysis.
+
+    Returns:
+    pygame.Rect: The area of the screen that changed.
+    """
+    screen = get_screen()
+    screen.blit(board_background(), ANALYSIS_RECT, ANALYSIS_RECT)
+    line = get_font(ANALYSIS_FONT_SIZE).render(text, True, font_color)
+    screen.blit(line, ANALYSIS_RECT, pygame.Rect(0, 0, ANALYSIS_RECT.width, ANALYSIS_RECT.height))
+    return ANALYSIS_RECT
+
+
+def benchmark_frames(frames: int = 1000) -> Dict[str, float]:
+    """
+    Measures the status and winning texts and whole frames, with and without the text cache.
+
+    Without the cache every frame renders its text again, as draw_status did before.
+
+    Args:
+    frames (int): Number of frames drawn in every measurement.
+
+    Returns:
+    Dict[str, float]: Milliseconds per frame spent on the text for 'cached' and 'uncached'
+    rendering, and whole frames (board, text, pieces and flip) as 'cached_frame' and
+    'uncached_frame'.
+    """
+    from package.chess_game_module.position import Position
+
+    position = Position()
+    arguments = (position.board, position.turn, None, None)
+
+    def render_uncached(size: int, text: str, color: str, antialias: bool = True) -> pygame.Surface:
+        return get_font(size).render(text, antialias, color)
+
+    results = {}
+    for name, render in [('uncached', render_uncached), ('cached', render_text)]:
+        begin = time.perf_counter()
+        for frame in range(frames):
+            draw_status(['white', 'black', 'white_won', 'black_won'][frame % 4], render)
+        results[name] = 1000 * (time.perf_counter() - begin) / frames
+
+        begin = time.perf_counter()
+        for _ in range(frames):
+            draw_chess_board(position.turn, render)
+            draw_pieces(*arguments)
+            pygame.display.flip()
+        results[name + '_frame'] = 1000 * (time.perf_counter() - begin) / frames
+    return results
+
+
+if __name__ == '__main__':
+    # Regenerate chess_pieces/atlas.png after changing one of the separate piece images
+    if sys.argv[1:] == ['--build-atlas']:
+        build_atlas()
+        print(f'wrote {ATLAS_FILE}')
+    # Compare frame times with and without the text cache
+    elif sys.argv[1:] == ['--benchmark']:
+        result = benchmark_frames()
+        for name in ['uncached', 'cached']:
+            print(f"{name + ':':<10} text {result[name]:6.3f} ms/frame, whole frame {result[name + '_frame']:6.3f} ms")
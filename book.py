@@ -0,0 +1,224 @@
+"""
+Opening book built from game records.
+
+build_book replays the first moves of every finished game in one or more record files (see
+records.py) and writes, for every position reached, the moves played from it: how many games
+played the move and how well they went for the side that played it. The book is a file of
+fixed-width entries sorted by Zobrist key, so OpeningBook can memory-map it and find the
+moves of a position by binary search. The file is never loaded into memory: every process
+using the book shares the same pages of the operating system's cache.
+
+Layout, all numbers little-endian, one 16 byte entry per (position, move):
+    key (uint64), move (uint16, packed as in records.py), weight (uint16), count (uint32)
+The entries of a position are ordered by decreasing weight. The weight is 2 points per win and
+1 per draw, scaled down for all moves of a position when the best of them does not fit 16 bits.
+
+Usage:
+    python -m package.chess_game_module.book games.cgr --output book.bin --plies 16
+    python -m package.chess_game_module.book --book book.bin --probe "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b"
+"""
+import argparse
+import bisect
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from package.chess_game_module.fen import STARTING_FEN, from_fen
+from package.chess_game_module.position import Move, Position, move_name
+from package.chess_game_module.records import GameRecords, decode_move, unpack_move
+
+ENTRY = struct.Struct('<QHHI')  # key, move, weight, count
+MAX_WEIGHT = 0xFFFF
+MAX_COUNT = 0xFFFFFFFF
+
+
+def build_book(record_paths: Iterable[str], output: str, plies: int = 16, min_games: int = 1) -> Dict[str, float]:
+    """
+    Writes an opening book from the finished games of record files.
+
+    Args:
+    record_paths (Iterable[str]): Paths of the record files.
+    output (str): Path of the book.
+    plies (int): Number of moves of every game that go into the book.
+    min_games (int): Moves played in fewer games are left out.
+
+    Returns:
+    Dict[str, float]: 'games' read, 'positions' and 'entries' written and 'seconds' taken.
+    """
+    begin = time.perf_counter()
+    # (key, packed move) -> [games, points for the side that played the move]
+    statistics: Dict[Tuple[int, int], List[int]] = {}
+    games = 0
+    for path in record_paths:
+        with GameRecords(path) as records:
+            for game in range(len(records)):
+                result = records.header(game)['result']
+                if result == '*':
+                    continue  # an unfinished game says nothing about its moves
+                games += 1
+                white_points = {'1-0': 2, '0-1': 0, '1/2-1/2': 1}[result]
+                position = Position()
+                for code in records.moves(game)[:plies]:
+                    move = statistics.setdefault((position.key, code), [0, 0])
+                    move[0] += 1
+                    move[1] += white_points if position.turn == 'white' else 2 - white_points
+                    position.make_move(unpack_move(position, code))
+
+    entries = sorted((key, code, count, points) for (key, code), (count, points) in statistics.items()
+                     if count >= min_games)
+    positions = 0
+    with open(output, 'wb') as file:
+        first = 0
+        while first < len(entries):
+            key = entries[first][0]
+            last = first
+            while last < len(entries) and entries[last][0] == key:
+                last += 1
+            moves = entries[first:last]
+            scale = max(1.0, max(points for _, _, _, points in moves) / MAX_WEIGHT)
+            moves.sort(key=lambda entry: -entry[3])
+            file.write(b''.join(ENTRY.pack(key, code, int(points / scale), min(count, MAX_COUNT))
+                                for key, code, count, points in moves))
+            positions += 1
+            first = last
+    return {'games': float(games), 'positions': float(positions), 'entries': float(len(entries)),
+            'seconds': time.perf_counter() - begin}
+
+
+class OpeningBook:
+    """
+    Read-only, memory-mapped opening book.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Maps a book written by build_book.
+
+        Args:
+        path (str): Path of the book.
+
+        Raises:
+        ValueError: If the size of the file is not a whole number of entries.
+        """
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size % ENTRY.size:
+                raise ValueError(f'{path} is not an opening book')
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._bytes = memoryview(self._data) if self._data is not None else memoryview(b'')
+        if sys.byteorder == 'little':
+            # Every other 8 byte word of the file is a key, so the keys are searched in place
+            self._keys = self._bytes.cast('Q')[::2]
+        else:
+            self._keys = array('Q', (ENTRY.unpack_from(self._bytes, offset)[0]
+                                     for offset in range(0, size, ENTRY.size)))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def entries(self, key: int) -> List[Dict[str, object]]:
+        """
+        Finds the moves of a position.
+
+        Args:
+        key (int): Zobrist key of the position.
+
+        Returns:
+        List[Dict[str, object]]: For every move its 'move' in coordinate notation, its packed 'code',
+        its 'weight' and the number of games ('count') it was played in, best first; empty when the
+        position is not in the book.
+        """
+        first = bisect.bisect_left(self._keys, key)
+        last = bisect.bisect_right(self._keys, key, first)
+        return [{'move': move_name(*decode_move(code)), 'code': code, 'weight': weight, 'count': count}
+                for _, code, weight, count in ENTRY.iter_unpack(self._bytes[first * ENTRY.size:last * ENTRY.size])]
+
+    def choose(self, position: Position, rng: Optional[random.Random] = None) -> Optional[Move]:
+        """
+        Picks a book move for a position, at random in proportion to the weights.
+
+        Moves that are not legal in the position, which happens only when two positions share
+        a Zobrist key, are never returned.
+
+        Args:
+        position (Position): The position.
+        rng (Optional[random.Random]): Source of randomness, the random module by default.
+
+        Returns:
+        Optional[Move]: The move, None when the book has no move for the position.
+        """
+        legal = set(position.legal_moves())
+        moves, weights = [], []
+        for entry in self.entries(position.key):
+            start, target, promotion = decode_move(entry['code'])
+            index = position.piece_index(start, position.turn)
+            if index is not None:
+                move = (index, target, promotion)
+                if move in legal or (move[0], target, 'queen') in legal and promotion is None:
+                    moves.append(move)
+                    weights.append(entry['weight'] + 1)
+        if not moves:
+            return None
+        return (rng or random).choices(moves, weights)[0]
+
+    def close(self) -> None:
+        """
+        Unmaps the book.
+        """
+        if isinstance(self._keys, memoryview):
+            self._keys.release()
+        self._bytes.release()
+        if self._data is not None:
+            self._data.close()
+
+    def __enter__(self) -> 'OpeningBook':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: builds a book from record files, or looks a position up in one.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Build or probe an opening book.')
+    parser.add_argument('records', nargs='*', help='record files the book is built from')
+    parser.add_argument('--output', default='book.bin', help='book written from the record files')
+    parser.add_argument('--plies', type=int, default=16, help='moves of every game that go into the book')
+    parser.add_argument('--min-games', type=int, default=1, help='games a move has to be played in')
+    parser.add_argument('--book', default=None, help='book to look a position up in')
+    parser.add_argument('--probe', default=None, help='FEN of the position to look up')
+    args = parser.parse_args(argv)
+
+    if args.book:
+        position = from_fen(args.probe or STARTING_FEN)
+        with OpeningBook(args.book) as book:
+            begin = time.perf_counter()
+            moves = book.entries(position.key)
+            microseconds = (time.perf_counter() - begin) * 1e6
+            for entry in moves:
+                print(f"{entry['move']:6} weight {entry['weight']:6} games {entry['count']}")
+            print(f'{len(moves)} moves among {len(book)} entries, found in {microseconds:.1f} us')
+        return 0
+    if not args.records:
+        parser.error('give record files to build a book from, or --book to probe one')
+    result = build_book(args.records, args.output, args.plies, args.min_games)
+    print(f"{result['games']:.0f} games, {result['positions']:.0f} positions, {result['entries']:.0f} entries "
+          f"written to {args.output} in {result['seconds']:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
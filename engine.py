@@ -0,0 +1,546 @@
+"""
+Computer opponent.
+
+The engine searches the moves produced by Position.check_all_moves with negamax alpha-beta
+inside iterative deepening: depth 1, 2, 3, ... is searched until the time budget runs out,
+and the best move of the last finished depth is played. Captures are followed further by
+a quiescence search, so the evaluation is never taken in the middle of an exchange, and a
+fixed-size transposition table keyed by Zobrist keys remembers results and best moves
+between iterations and moves.
+
+Usage:
+    python -m package.chess_game_module.engine --time 2
+    python -m package.chess_game_module.engine --fen "..." --time 5
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from package.chess_game_module.position import CODE_PIECES, Move, Position, move_name
+
+PIECE_VALUES = {'pawn': 100, 'knight': 320, 'bishop': 330, 'rook': 500, 'queen': 900, 'king': 20000}
+MATE_SCORE = 100000
+INFINITY = 1000000
+TABLE_SIZE = 1 << 18  # transposition table slots of an engine playing the game
+
+# Piece-square tables from white's point of view, index y * 8 + x with the 8th rank first
+PIECE_SQUARE_TABLES = {
+    'pawn': [0, 0, 0, 0, 0, 0, 0, 0,
+             50, 50, 50, 50, 50, 50, 50, 50,
+             10, 10, 20, 30, 30, 20, 10, 10,
+             5, 5, 10, 25, 25, 10, 5, 5,
+             0, 0, 0, 20, 20, 0, 0, 0,
+             5, -5, -10, 0, 0, -10, -5, 5,
+             5, 10, 10, -20, -20, 10, 10, 5,
+             0, 0, 0, 0, 0, 0, 0, 0],
+    'knight': [-50, -40, -30, -30, -30, -30, -40, -50,
+               -40, -20, 0, 0, 0, 0, -20, -40,
+               -30, 0, 10, 15, 15, 10, 0, -30,
+               -30, 5, 15, 20, 20, 15, 5, -30,
+               -30, 0, 15, 20, 20, 15, 0, -30,
+               -30, 5, 10, 15, 15, 10, 5, -30,
+               -40, -20, 0, 5, 5, 0, -20, -40,
+               -50, -40, -30, -30, -30, -30, -40, -50],
+    'bishop': [-20, -10, -10, -10, -10, -10, -10, -20,
+               -10, 0, 0, 0, 0, 0, 0, -10,
+               -10, 0, 5, 10, 10, 5, 0, -10,
+               -10, 5, 5, 10, 10, 5, 5, -10,
+               -10, 0, 10, 10, 10, 10, 0, -10,
+               -10, 10, 10, 10, 10, 10, 10, -10,
+               -10, 5, 0, 0, 0, 0, 5, -10,
+               -20, -10, -10, -10, -10, -10, -10, -20],
+    'rook': [0, 0, 0, 0, 0, 0, 0, 0,
+             5, 10, 10, 10, 10, 10, 10, 5,
+             -5, 0, 0, 0, 0, 0, 0, -5,
+             -5, 0, 0, 0, 0, 0, 0, -5,
+             -5, 0, 0, 0, 0, 0, 0, -5,
+             -5, 0, 0, 0, 0, 0, 0, -5,
+             -5, 0, 0, 0, 0, 0, 0, -5,
+             0, 0, 0, 5, 5, 0, 0, 0],
+    'queen': [-20, -10, -10, -5, -5, -10, -10, -20,
+              -10, 0, 0, 0, 0, 0, 0, -10,
+              -10, 0, 5, 5, 5, 5, 0, -10,
+              -5, 0, 5, 5, 5, 5, 0, -5,
+              -5, 0, 5, 5, 5, 5, 0, -5,
+              -10, 0, 5, 5, 5, 5, 0, -10,
+              -10, 0, 0, 0, 0, 0, 0, -10,
+              -20, -10, -10, -5, -5, -10, -10, -20],
+    'king': [-30, -40, -40, -50, -50, -40, -40, -30,
+             -30, -40, -40, -50, -50, -40, -40, -30,
+             -30, -40, -40, -50, -50, -40, -40, -30,
+             -30, -40, -40, -50, -50, -40, -40, -30,
+             -20, -30, -30, -40, -40, -30, -30, -20,
+             -10, -20, -20, -20, -20, -20, -20, -10,
+             20, 20, 0, 0, 0, 0, 20, 20,
+             20, 30, 10, 0, 0, 10, 30, 20],
+}
+# Material and position value of every piece on every square, for both colors
+SQUARE_VALUES = {
+    'white': {piece: [PIECE_VALUES[piece] + table[index] for index in range(64)]
+              for piece, table in PIECE_SQUARE_TABLES.items()},
+    'black': {piece: [PIECE_VALUES[piece] + table[(7 - (index >> 3)) * 8 + (index & 7)] for index in range(64)]
+              for piece, table in PIECE_SQUARE_TABLES.items()},
+}
+
+# Transposition table entry flags
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget is used up.
+    """
+
+
+def evaluate(position: Position) -> int:
+    """
+    Scores a position by material and piece placement.
+
+    Args:
+    position (Position): The position to score.
+
+    Returns:
+    int: The score in centipawns from the point of view of the side to move.
+    """
+    score = 0
+    for color, sign in [('white', 1), ('black', -1)]:
+        values = SQUARE_VALUES[color]
+        pieces, locations = position.pieces(color)
+        for piece, (x, y) in zip(pieces, locations):
+            score += sign * values[piece][y * 8 + x]
+    return score if position.turn == 'white' else -score
+
+
+class Engine:
+    """
+    Alpha-beta searcher with iterative deepening, quiescence search and a transposition table.
+
+    The transposition table has a fixed number of slots indexed by the low bits of the
+    Zobrist key. A slot is overwritten when it belongs to the same position, to an earlier
+    search, or when the new result was searched at least as deep (depth-preferred
+    replacement with aging).
+    """
+
+    def __init__(self, table_size: int = TABLE_SIZE) -> None:
+        """
+        Args:
+        table_size (int): Number of transposition table slots, rounded down to a power of two.
+        """
+        size = 1 << (table_size.bit_length() - 1)
+        self.table: List[Optional[tuple]] = [None] * size
+        self.table_mask = size - 1
+        self.age = 0
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stop: Optional[Callable[[], bool]] = None
+        self.killers: List[List[Optional[Move]]] = []
+        self.path: List[int] = []
+
+    def clear(self) -> None:
+        """
+        Forgets everything stored in the transposition table.
+        """
+        self.table = [None] * len(self.table)
+
+    def search(self, position: Position, time_limit: float = 1.0, max_depth: int = 64,
+               history: Optional[List[int]] = None, stop: Optional[Callable[[], bool]] = None,
+               report: Optional[Callable[[Dict[str, object]], None]] = None) -> Dict[str, object]:
+        """
+        Finds the best move of the side to move within the time budget.
+
+        The position itself is not changed, the search runs on a copy.
+
+        Args:
+        position (Position): The position to search.
+        time_limit (float): Seconds the search may take; depth 1 is always finished.
+        max_depth (int): Deepest iteration to search.
+        history (Optional[List[int]]): Zobrist keys of the earlier positions of the game,
+        so repeating one of them is scored as a draw.
+        stop (Optional[Callable[[], bool]]): Polled together with the time budget; returning True
+        abandons the search like a timeout, for cancelling it from another thread or process.
+        report (Optional[Callable[[Dict[str, object]], None]]): Called with the result after every
+        finished depth, for showing the search as it deepens.
+
+        Returns:
+        Dict[str, object]: 'move' (None when there is no legal move), 'score' in centipawns for
+        the side to move, 'depth' reached, 'nodes' searched, 'seconds', 'nodes_per_second' and
+        'line' with the expected moves in coordinate notation.
+        """
+        root = position.copy()
+        begin = time.perf_counter()
+        self.deadline = begin + time_limit
+        self.nodes = 0
+        self.age = (self.age + 1) & 0xFF
+        self.killers = [[None, None] for _ in range(max_depth + 64)]
+        self.path = list(history or [])
+        self.stop = stop
+
+        result: Dict[str, object] = {'move': None, 'score': 0, 'depth': 0, 'line': []}
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self._search_root(root, depth)
+            except SearchTimeout:
+                break
+            result.update(move=move, score=score, depth=depth, line=self._principal_line(root, depth))
+            if report is not None:
+                report(dict(result, nodes=self.nodes, seconds=time.perf_counter() - begin))
+            # A found mate cannot be improved and the next depth would not finish in time anyway
+            elapsed = time.perf_counter() - begin
+            if move is None or abs(score) > MATE_SCORE - 1000 or elapsed > time_limit / 2:
+                break
+
+        seconds = time.perf_counter() - begin
+        result.update(nodes=self.nodes, seconds=seconds,
+                      nodes_per_second=self.nodes / seconds if seconds else 0.0)
+        return result
+
+    def _search_root(self, position: Position, depth: int) -> Tuple[int, Optional[Move]]:
+        """
+        Searches all moves of the root position to the given depth.
+
+        Args:
+        position (Position): The root position.
+        depth (int): Remaining depth in plies.
+
+        Returns:
+        Tuple[int, Optional[Move]]: The best score and move, or no move when there is no legal one.
+        """
+        color = position.turn
+        alpha, best_move = -INFINITY, None
+        self.path.append(position.key)
+        for move in self._ordered_moves(position, self._table_move(position), 0, captures_only=False):
+            undo = position.make_move(move)
+            if position.in_check(color):
+                position.unmake_move(undo)
+                continue
+            try:
+                score = -self._negamax(position, depth - 1, -INFINITY, -alpha, 1, depth > 1)
+            finally:
+                position.unmake_move(undo)
+            if score > alpha:
+                alpha, best_move = score, move
+        self.path.pop()
+
+        if best_move is None:
+            return (-MATE_SCORE if position.in_check(color) else 0), None
+        self._store(position.key, depth, alpha, EXACT, best_move, position, 0)
+        return alpha, best_move
+
+    def _negamax(self, position: Position, depth: int, alpha: int, beta: int, ply: int, timed: bool) -> int:
+        """
+        Alpha-beta search of one node.
+
+        Args:
+        position (Position): The position of the node, changed and restored during the search.
+        depth (int): Remaining depth in plies.
+        alpha (int): Score the side to move is already guaranteed.
+        beta (int): Score above which the opponent avoids this node.
+        ply (int): Distance from the root.
+        timed (bool): Whether the node may be interrupted by the time budget.
+
+        Returns:
+        int: The score of the node for the side to move.
+        """
+        self.nodes += 1
+        if timed and self.nodes & 1023 == 0 and (time.perf_counter() > self.deadline
+                                                 or self.stop is not None and self.stop()):
+            raise SearchTimeout()
+        key = position.key
+        if key in self.path:
+            return 0
+
+        entry = self.table[key & self.table_mask]
+        table_move = None
+        if entry is not None and entry[0] == key:
+            table_move = entry[4]
+            if entry[1] >= depth:
+                score = _score_from_table(entry[2], ply)
+                if entry[3] == EXACT:
+                    return score
+                if entry[3] == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        color = position.turn
+        in_check = position.in_check(color)
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self._quiescence(position, alpha, beta, ply, timed)
+
+        original_alpha, best_score, best_move = alpha, -INFINITY, None
+        self.path.append(key)
+        for move in self._ordered_moves(position, table_move, ply, captures_only=False):
+            undo = position.make_move(move)
+            if position.in_check(color):
+                position.unmake_move(undo)
+                continue
+            try:
+                score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1, timed)
+            finally:
+                position.unmake_move(undo)
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not self._is_capture(position, move):
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1], killers[0] = killers[0], move
+                        break
+        self.path.pop()
+
+        if best_move is None:
+            return -MATE_SCORE + ply if in_check else 0
+        flag = UPPER_BOUND if best_score <= original_alpha else (LOWER_BOUND if best_score >= beta else EXACT)
+        self._store(key, depth, best_score, flag, best_move, position, ply)
+        return best_score
+
+    def _quiescence(self, position: Position, alpha: int, beta: int, ply: int, timed: bool) -> int:
+        """
+        Searches captures only, until the position is quiet.
+
+        Args:
+        position (Position): The position of the node.
+        alpha (int): Score the side to move is already guaranteed.
+        beta (int): Score above which the opponent avoids this node.
+        ply (int): Distance from the root.
+        timed (bool): Whether the node may be interrupted by the time budget.
+
+        Returns:
+        int: The score of the node for the side to move.
+        """
+        self.nodes += 1
+        if timed and self.nodes & 1023 == 0 and (time.perf_counter() > self.deadline
+                                                 or self.stop is not None and self.stop()):
+            raise SearchTimeout()
+
+        # The side to move does not have to capture, so the static score is a lower bound
+        stand_pat = evaluate(position)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+
+        color = position.turn
+        for move in self._ordered_moves(position, None, ply, captures_only=True):
+            undo = position.make_move(move)
+            if position.in_check(color):
+                position.unmake_move(undo)
+                continue
+            try:
+                score = -self._quiescence(position, -beta, -alpha, ply + 1, timed)
+            finally:
+                position.unmake_move(undo)
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _ordered_moves(self, position: Position, table_move: Optional[tuple], ply: int,
+                       captures_only: bool) -> List[Move]:
+        """
+        Lists the pseudo-legal moves of the side to move, most promising first.
+
+        The transposition table move comes first, then captures by most valuable victim and
+        least valuable attacker, then promotions, killer moves and all remaining moves.
+
+        Args:
+        position (Position): The position.
+        table_move (Optional[tuple]): Best move stored for the position as (start, target, promotion).
+        ply (int): Distance from the root, to look up killer moves.
+        captures_only (bool): Whether to list only captures and promotions.
+
+        Returns:
+        List[Move]: The ordered moves.
+        """
+        color = position.turn
+        pieces, locations = position.pieces(color)
+        board = position.board
+        killers = self.killers[ply] if ply < len(self.killers) else [None, None]
+        last_row = 0 if color == 'white' else 7
+
+        scored = []
+        for i, targets in enumerate(position.check_all_moves(color)):
+            piece, start = pieces[i], locations[i]
+            for target in targets:
+                # A move never ends on a piece of its own side, so anything on the target is a victim
+                victim = CODE_PIECES[board[target[1] * 8 + target[0]]]
+                if victim is not None:
+                    victim = victim[1]
+                elif piece == 'pawn' and target[0] != start[0]:
+                    victim = 'pawn'  # en-passant
+                promotions = ['queen', 'knight', 'rook', 'bishop'] if piece == 'pawn' and target[1] == last_row \
+                    else [None]
+                for promotion in promotions:
+                    if captures_only and victim is None and promotion != 'queen':
+                        continue
+                    move = (i, target, promotion)
+                    if table_move is not None and (start, target, promotion) == table_move:
+                        order = 10 ** 7
+                    elif victim is not None:
+                        order = 10 ** 6 + PIECE_VALUES[victim] * 10 - PIECE_VALUES[piece] // 100
+                    elif promotion is not None:
+                        order = 10 ** 5 + PIECE_VALUES[promotion]
+                    elif move == killers[0] or move == killers[1]:
+                        order = 10 ** 4
+                    else:
+                        order = 0
+                    scored.append((order, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+    @staticmethod
+    def _is_capture(position: Position, move: Move) -> bool:
+        """
+        Checks whether a move, already taken back, captures a piece.
+
+        Args:
+        position (Position): The position before the move.
+        move (Move): The move.
+
+        Returns:
+        bool: True for captures, en passant included.
+        """
+        i, target, _ = move
+        if position.board[target[1] * 8 + target[0]]:
+            return True
+        # As in _ordered_moves, a pawn changing file captures even when its target square is empty
+        pieces, locations = position.pieces(position.turn)
+        return pieces[i] == 'pawn' and locations[i][0] != target[0]
+
+    def _table_move(self, position: Position) -> Optional[tuple]:
+        """
+        Looks up the best move stored for a position.
+
+        Args:
+        position (Position): The position.
+
+        Returns:
+        Optional[tuple]: The move as (start, target, promotion), or None.
+        """
+        entry = self.table[position.key & self.table_mask]
+        return entry[4] if entry is not None and entry[0] == position.key else None
+
+    def _store(self, key: int, depth: int, score: int, flag: int, move: Move, position: Position,
+               ply: int) -> None:
+        """
+        Saves a search result in the transposition table, following the replacement policy.
+
+        The move is stored by its squares, since piece indexes differ between move orders
+        leading to the same position.
+
+        Args:
+        key (int): Zobrist key of the position.
+        depth (int): Depth the position was searched to.
+        score (int): The score found.
+        flag (int): EXACT, LOWER_BOUND or UPPER_BOUND.
+        move (Move): The best move found.
+        position (Position): The position, to translate the move to squares.
+        ply (int): Distance from the root, to store mate scores relative to the position.
+        """
+        index = key & self.table_mask
+        entry = self.table[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            start = position.pieces(position.turn)[1][move[0]]
+            self.table[index] = (key, depth, _score_to_table(score, ply), flag, (start, move[1], move[2]), self.age)
+
+    def _principal_line(self, position: Position, depth: int) -> List[str]:
+        """
+        Follows the best moves stored in the transposition table from the root.
+
+        Args:
+        position (Position): The root position, left unchanged.
+        depth (int): Maximal length of the line.
+
+        Returns:
+        List[str]: The expected moves in coordinate notation.
+        """
+        line, undos, seen = [], [], set()
+        while len(line) < depth and position.key not in seen:
+            seen.add(position.key)
+            table_move = self._table_move(position)
+            if table_move is None:
+                break
+            start, target, promotion = table_move
+            index = position.piece_index(start, position.turn)
+            if index is None:
+                break
+            move = (index, target, promotion)
+            if move not in position.legal_moves():
+                break
+            line.append(move_name(start, target, promotion))
+            undos.append(position.make_move(move))
+        while undos:
+            position.unmake_move(undos.pop())
+        return line
+
+
+def _score_to_table(score: int, ply: int) -> int:
+    """
+    Converts a mate score counted from the root to one counted from the stored position.
+
+    Args:
+    score (int): The score from the search.
+    ply (int): Distance of the position from the root.
+
+    Returns:
+    int: The score to store.
+    """
+    if score > MATE_SCORE - 1000:
+        return score + ply
+    if score < -MATE_SCORE + 1000:
+        return score - ply
+    return score
+
+
+def _score_from_table(score: int, ply: int) -> int:
+    """
+    Converts a stored mate score back to one counted from the root.
+
+    Args:
+    score (int): The stored score.
+    ply (int): Distance of the position from the root.
+
+    Returns:
+    int: The score for the search.
+    """
+    if score > MATE_SCORE - 1000:
+        return score - ply
+    if score < -MATE_SCORE + 1000:
+        return score + ply
+    return score
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: searches one position and prints what the engine found.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    from package.chess_game_module.fen import STARTING_FEN, from_fen
+
+    parser = argparse.ArgumentParser(description='Search a position for the best move.')
+    parser.add_argument('--fen', default=STARTING_FEN, help='position in Forsyth-Edwards Notation')
+    parser.add_argument('--time', type=float, default=1.0, help='seconds to think')
+    args = parser.parse_args(argv)
+
+    position = from_fen(args.fen)
+    result = Engine().search(position, args.time)
+    move = result['move']
+    best = 'none' if move is None else move_name(position.pieces(position.turn)[1][move[0]], move[1], move[2])
+    print(f"best {best}  score {result['score']}  depth {result['depth']}  nodes {result['nodes']}  "
+          f"{result['nodes_per_second']:.0f} nodes/s  line {' '.join(result['line'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
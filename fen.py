@@ -0,0 +1,343 @@
+"""
+Forsyth-Edwards Notation (FEN) support.
+
+A FEN string describes a position in one line: the pieces rank by rank from the 8th,
+the side to move, castling rights and the en-passant square. Squares are mapped to the
+board of Position with the same convention as position.square_name.
+
+Files with one FEN per line are read lazily by read_fens, so test suites and analysis
+jobs can stream millions of positions without holding the file in memory. Parsed ranks
+are remembered, since the same rank strings ('8', 'pppppppp', ...) recur in nearly every
+position, which makes from_fen several times faster than placing the pieces one by one.
+
+Most of the time from_fen takes goes into allocating the lists of a Position. Jobs that only
+need the pieces read the file with packed=True: pack_fen then turns every line straight into
+the PACKED_SIZE bytes of a mailbox_board.PositionStore entry, built from packed ranks that are
+remembered the same way, and no Position is created at all.
+
+Usage:
+    python -m package.chess_game_module.fen positions.fen [--packed]
+"""
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from package.chess_game_module.position import PIECE_CODES, Position, parse_square, square_name
+from package.chess_game_module.zobrist import (BLACK_TO_MOVE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS, PIECE_INDEX,
+                                               PIECE_KEYS, castling_rights, en_passant_column)
+
+PIECE_LETTERS = {'p': 'pawn', 'r': 'rook', 'n': 'knight', 'b': 'bishop', 'k': 'king', 'q': 'queen'}
+LETTERS = {piece: letter for letter, piece in PIECE_LETTERS.items()}
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# One cache per row: rank string -> (white pieces, white locations, black pieces, black locations, key,
+# white occupancy, black occupancy, piece codes of the row, the codes packed two per byte)
+_rank_caches: List[Dict[str, tuple]] = [{} for _ in range(8)]
+RANK_CACHE_SIZE = 20000  # entries per row, the row's cache is emptied when it is full
+# castling field -> (king_moved, rook_moved, key of the rights, rights as in zobrist.castling_rights)
+_castling_cache: Dict[str, Tuple[List[int], List[List[int]], int, int]] = {}
+
+
+def _parse_rank(y: int, rank: str) -> tuple:
+    """
+    Places the pieces of one rank of a FEN string.
+
+    Args:
+    y (int): Row of the rank on the board, 0 for the 8th rank.
+    rank (str): The rank, for example 'rnbqkbnr' or '3p4'.
+
+    Returns:
+    tuple: The white pieces and their locations, the black pieces and their locations, the
+    Zobrist key of all of them, the occupancy bitboards of the white and the black ones, the
+    8 piece codes of the row for Position.board, indexed by x, and the same codes packed two
+    per byte as in mailbox_board.
+
+    Raises:
+    ValueError: If the rank does not describe exactly 8 squares.
+    """
+    white_pieces, white_locations, black_pieces, black_locations, key = [], [], [], [], 0
+    white_occupancy = black_occupancy = 0
+    codes = bytearray(8)
+    # Files go from 'a' (x = 7) to 'h' (x = 0)
+    x = 7
+    for letter in rank:
+        if letter.isdigit():
+            x -= int(letter)
+            continue
+        piece = PIECE_LETTERS.get(letter.lower())
+        if piece is None or x < 0:
+            raise ValueError(f'invalid FEN rank {rank!r}')
+        if letter.isupper():
+            white_pieces.append(piece)
+            white_locations.append((x, y))
+            key ^= PIECE_KEYS[0][PIECE_INDEX[piece]][y * 8 + x]
+            white_occupancy |= 1 << (y * 8 + x)
+            codes[x] = PIECE_CODES['white', piece]
+        else:
+            black_pieces.append(piece)
+            black_locations.append((x, y))
+            key ^= PIECE_KEYS[1][PIECE_INDEX[piece]][y * 8 + x]
+            black_occupancy |= 1 << (y * 8 + x)
+            codes[x] = PIECE_CODES['black', piece]
+        x -= 1
+    if x != -1:
+        raise ValueError(f'invalid FEN rank {rank!r}')
+    return (white_pieces, white_locations, black_pieces, black_locations, key, white_occupancy, black_occupancy,
+            bytes(codes), bytes(codes[x] | codes[x + 1] << 4 for x in range(0, 8, 2)))
+
+
+def _parse_castling(castling: str) -> Tuple[List[int], List[List[int]], int, int]:
+    """
+    Turns the castling field of a FEN string into the castling state of a position.
+
+    Args:
+    castling (str): The field, for example 'KQkq', 'Kq' or '-'.
+
+    Returns:
+    Tuple[List[int], List[List[int]], int, int]: The king_moved and rook_moved values, the
+    Zobrist key of the rights and the rights as bits, see zobrist.castling_rights.
+    """
+    king_moved = [int('K' not in castling and 'Q' not in castling),
+                  int('k' not in castling and 'q' not in castling)]
+    rook_moved = [[int('K' not in castling), int('Q' not in castling)],
+                  [int('k' not in castling), int('q' not in castling)]]
+    rights = 0
+    for bit, letter in enumerate('KQkq'):
+        if letter in castling:
+            rights |= 1 << bit
+    return king_moved, rook_moved, CASTLING_KEYS[rights], rights
+
+
+def _split_fen(fen: str) -> Tuple[List[tuple], str, tuple, str]:
+    """
+    Checks the fields of a FEN string and parses its ranks and castling field.
+
+    Args:
+    fen (str): The position in Forsyth-Edwards Notation.
+
+    Returns:
+    Tuple[List[tuple], str, tuple, str]: The ranks from the 8th as returned by _parse_rank,
+    the side to move ('w' or 'b'), the castling field as returned by _parse_castling and the
+    en-passant field.
+
+    Raises:
+    ValueError: If the string is not a valid FEN.
+    """
+    fields = fen.split()
+    if len(fields) < 2 or fields[1] not in ('w', 'b'):
+        raise ValueError(f'invalid FEN {fen!r}')
+    ranks = fields[0].split('/')
+    if len(ranks) != 8:
+        raise ValueError(f'invalid FEN {fen!r}')
+    castling = fields[2] if len(fields) > 2 else '-'
+    en_passant = fields[3] if len(fields) > 3 else '-'
+    # Only a square on the 3rd or 6th rank can be behind a pawn that has made a double step
+    if en_passant != '-' and (len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' or en_passant[1] not in '36'):
+        raise ValueError(f'invalid en-passant square in {fen!r}')
+
+    parsed = list(map(dict.get, _rank_caches, ranks))
+    if None in parsed:
+        for y, rank in enumerate(ranks):
+            if parsed[y] is None:
+                cache = _rank_caches[y]
+                if len(cache) >= RANK_CACHE_SIZE:
+                    cache.clear()
+                parsed[y] = cache[rank] = _parse_rank(y, rank)
+    rights = _castling_cache.get(castling)
+    if rights is None:
+        rights = _castling_cache[castling] = _parse_castling(castling)
+    return parsed, fields[1], rights, en_passant
+
+
+def from_fen(fen: str) -> Position:
+    """
+    Creates a position described by a FEN string.
+
+    Args:
+    fen (str): The position in Forsyth-Edwards Notation. The move counters are optional.
+
+    Returns:
+    Position: A new position with the pieces, side to move, castling rights and
+    en-passant state taken from the string.
+
+    Raises:
+    ValueError: If the string is not a valid FEN.
+    """
+    parsed, side_to_move, rights, en_passant = _split_fen(fen)
+
+    # The position is filled in directly, without placing the starting pieces first
+    position = Position.__new__(Position)
+    r0, r1, r2, r3, r4, r5, r6, r7 = parsed
+    white_locations = [*r0[1], *r1[1], *r2[1], *r3[1], *r4[1], *r5[1], *r6[1], *r7[1]]
+    black_locations = [*r0[3], *r1[3], *r2[3], *r3[3], *r4[3], *r5[3], *r6[3], *r7[3]]
+    position.white_pieces = [*r0[0], *r1[0], *r2[0], *r3[0], *r4[0], *r5[0], *r6[0], *r7[0]]
+    position.white_pieces_locations = white_locations
+    position.black_pieces = [*r0[2], *r1[2], *r2[2], *r3[2], *r4[2], *r5[2], *r6[2], *r7[2]]
+    position.black_pieces_locations = black_locations
+    key = r0[4] ^ r1[4] ^ r2[4] ^ r3[4] ^ r4[4] ^ r5[4] ^ r6[4] ^ r7[4]
+    position.occupancy = [r0[5] | r1[5] | r2[5] | r3[5] | r4[5] | r5[5] | r6[5] | r7[5],
+                          r0[6] | r1[6] | r2[6] | r3[6] | r4[6] | r5[6] | r6[6] | r7[6]]
+    position.board = bytearray(r0[7] + r1[7] + r2[7] + r3[7] + r4[7] + r5[7] + r6[7] + r7[7])
+    position.indices = indices = bytearray(64)
+    for locations in (white_locations, black_locations):
+        for i, (x, y) in enumerate(locations):
+            indices[y * 8 + x] = i
+
+    position.turn = 'white' if side_to_move == 'w' else 'black'
+    position.king_moved = rights[0][:]
+    position.rook_moved = [rights[1][0][:], rights[1][1][:]]
+    key ^= rights[2]
+    position.white_last_move = position.white_pre_last_move = None
+    position.black_last_move = position.black_pre_last_move = None
+    position.white_valid_moves, position.black_valid_moves = [], []
+    position.backend = 'lists'
+
+    # The en-passant square lies behind the pawn that has just made a double step
+    if en_passant != '-':
+        x, y = parse_square(en_passant)
+        color, row = ('white', 4) if y == 5 else ('black', 3)
+        if position.board[row * 8 + x] != PIECE_CODES[color, 'pawn']:
+            raise ValueError(f'no pawn in front of the en-passant square in {fen!r}')
+        if y == 5:
+            position.white_last_move = indices[4 * 8 + x]
+            position.white_pre_last_move = 6
+        else:
+            position.black_last_move = indices[3 * 8 + x]
+            position.black_pre_last_move = 1
+        column = en_passant_column(position)
+        if column is not None:
+            key ^= EN_PASSANT_KEYS[column]
+
+    if position.turn == 'black':
+        key ^= BLACK_TO_MOVE_KEY
+    position.key = key
+    return position
+
+
+def pack_fen(fen: str) -> bytes:
+    """
+    Packs the position described by a FEN string, without creating a Position.
+
+    Args:
+    fen (str): The position in Forsyth-Edwards Notation. The move counters are optional.
+
+    Returns:
+    bytes: The position in the packed layout of mailbox_board, the same bytes as
+    Mailbox.from_position(from_fen(fen)).pack().
+
+    Raises:
+    ValueError: If the string is not a valid FEN, exactly when from_fen raises it.
+    """
+    parsed, side_to_move, rights, en_passant = _split_fen(fen)
+    r0, r1, r2, r3, r4, r5, r6, r7 = parsed
+    black_to_move = side_to_move == 'b'
+    en_passant_byte = 0
+    if en_passant != '-':
+        x, y = parse_square(en_passant)
+        # In front of the square stands the pawn that made the double step, and it can only be
+        # taken en passant when the other side is to move
+        white = y == 5
+        if parsed[4 if white else 3][7][x] != PIECE_CODES['white' if white else 'black', 'pawn']:
+            raise ValueError(f'no pawn in front of the en-passant square in {fen!r}')
+        if black_to_move == white:
+            en_passant_byte = x + 1
+    return r0[8] + r1[8] + r2[8] + r3[8] + r4[8] + r5[8] + r6[8] + r7[8] + \
+        bytes((black_to_move | rights[3] << 1, en_passant_byte))
+
+
+def to_fen(position: Position) -> str:
+    """
+    Describes a position as a FEN string.
+
+    Positions do not count moves, so the halfmove clock is always 0 and the move number 1.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    str: The position in Forsyth-Edwards Notation.
+    """
+    board = {}
+    for pieces, locations, upper in [(position.white_pieces, position.white_pieces_locations, True),
+                                     (position.black_pieces, position.black_pieces_locations, False)]:
+        for piece, location in zip(pieces, locations):
+            board[location] = LETTERS[piece].upper() if upper else LETTERS[piece]
+
+    ranks = []
+    for y in range(8):
+        rank, empty = '', 0
+        for x in range(7, -1, -1):
+            letter = board.get((x, y))
+            if letter is None:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += letter
+        ranks.append(rank + (str(empty) if empty else ''))
+
+    # After a king capture the loser is the side to move, as in zobrist.compute_key
+    side_to_move = 'b' if position.turn == 'black' or position.turn == 'white_won' else 'w'
+    rights = castling_rights(position)
+    castling = ''.join(letter for bit, letter in enumerate('KQkq') if rights >> bit & 1) or '-'
+    column = en_passant_column(position)
+    en_passant = '-' if column is None else square_name((column, 2 if side_to_move == 'w' else 5))
+    return f"{'/'.join(ranks)} {side_to_move} {castling} {en_passant} 0 1"
+
+
+def read_fens(path: str, packed: bool = False) -> Iterator[Union[Position, bytes]]:
+    """
+    Reads a file with one FEN per line, one position at a time.
+
+    Empty lines and lines starting with '#' are skipped. Anything after the FEN fields
+    (EPD operations such as 'bm e4;') is ignored.
+
+    Args:
+    path (str): Path of the file.
+    packed (bool): Whether to yield the positions packed by pack_fen, ready for
+    mailbox_board.PositionStore or Mailbox.unpack, instead of as Position objects.
+
+    Returns:
+    Iterator[Union[Position, bytes]]: The positions, in the order of the file.
+
+    Raises:
+    ValueError: If a line is not a valid FEN; the message gives the line number.
+    """
+    parse = pack_fen if packed else from_fen
+    with open(path, buffering=1 << 20) as file:
+        for number, line in enumerate(file, 1):
+            if line.isspace() or line[0] == '#':
+                continue
+            try:
+                yield parse(line)
+            except ValueError as error:
+                raise ValueError(f'{path}:{number}: {error}') from None
+
+
+def benchmark(path: str, limit: Optional[int] = None, packed: bool = False) -> Dict[str, float]:
+    """
+    Measures how fast read_fens streams the positions of a file.
+
+    Args:
+    path (str): Path of the file.
+    limit (Optional[int]): Number of positions to read, the whole file by default.
+    packed (bool): Whether to measure the packed positions instead of Position objects.
+
+    Returns:
+    Dict[str, float]: 'positions' read, 'seconds' and 'positions_per_second'.
+    """
+    begin = time.perf_counter()
+    count = 0
+    for _ in read_fens(path, packed):
+        count += 1
+        if count == limit:
+            break
+    seconds = time.perf_counter() - begin
+    return {'positions': float(count), 'seconds': seconds, 'positions_per_second': count / seconds if seconds else 0.0}
+
+
+if __name__ == '__main__':
+    result = benchmark(sys.argv[1], packed='--packed' in sys.argv[2:])
+    print(f"{result['positions']:.0f} positions in {result['seconds']:.2f}s: "
+          f"{result['positions_per_second']:.0f} positions/s")
@@ -1,561 +1,351 @@
+import argparse
+import heapq
+import sys
+import time
 import pygame
-from package.chess_game_module.board_drawing import draw_chess_board, draw_pieces, draw_valid_moves
-from typing import List, Tuple
+from package.chess_game_module.analysis import Analysis, format_analysis
+from package.chess_game_module.board_drawing import draw_analysis, draw_frame, draw_overlay, invalidate
+from package.chess_game_module.book import OpeningBook
+from package.chess_game_module.engine import TABLE_SIZE, Engine
+from package.chess_game_module.instrumentation import Instrumentation
+from package.chess_game_module.legality import AttackMap, game_status
+from package.chess_game_module.position import Position, move_name, opponent
+from package.chess_game_module.records import RecordWriter
+from package.chess_game_module.tablebase import Tablebase
+from package.chess_game_module.zobrist import compute_key
+from typing import List, Optional, Sequence, Tuple
 
 pygame.init()
 
-# list of all starting pieces and their locations
-white_pieces = ['rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook',
-                'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn']
-white_pieces_locations = [(0, 7), (1, 7), (2, 7), (3, 7), (4, 7), (5, 7), (6, 7), (7, 7),
-                          (0, 6), (1, 6), (2, 6), (3, 6), (4, 6), (5, 6), (6, 6), (7, 6)]
-
-black_pieces = ['rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook',
-                'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn']
-black_pieces_locations = [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0),
-                          (0, 1), (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1)]
-
-turn = 'white'  # black's or white's turn
+position = Position()  # state of the game shown in the window
 selection = None
-white_pre_last_move = None  # for checking en-passant, will contain only number of a row
-white_last_move = None
-black_pre_last_move = None
-black_last_move = None
 valid_moves = []  # valid moves of a selected piece
-black_valid_moves = []  # list of all black valid moves
-white_valid_moves = []  # list of all white valid moves
-king_moved = [0, 0]
+moves = []  # moves of the game in coordinate notation, kept until the game is saved
 
-TIMER = pygame.time.Clock()
-FPS = 60
+# Events that wake the main loop, everything else (mouse motion, key presses...) is dropped
+WAKING_EVENTS = [pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED]
+redraws = []  # heap of perf_counter times at which the window has to be redrawn without input
+ANALYSIS_POLL = 0.1  # seconds between two reads of the analysis results while the worker searches
 
 
-# CHECKING MOVES:
-def check_pawn_move(i: int, color: str) -> List[Tuple[int, int]]:
+def schedule_redraw(delay: float) -> None:
     """
-    Calculates valid moves for a pawn at a given position.
-
-    This function considers normal pawn moves (single and double steps),
-    capturing moves, and special moves like en-passant.
+    Wakes the main loop for a redraw after a delay, for animations and clocks.
 
     Args:
-    i (int): Index of the pawn in the piece list.
-    color (str): Color of the pawn ('white' or 'black').
-
-    Returns:
-    list: A list of tuples representing valid moves for the pawn.
+    delay (float): Seconds from now.
     """
-    piece_move_list = []
-
-    # Process moves for white pawns
-    if color == 'white':
-        # Check normal pawn moves and double step from starting position
-        if ((white_pieces_locations[i][0], white_pieces_locations[i][1] - 1) not in white_pieces_locations and
-                (white_pieces_locations[i][0], white_pieces_locations[i][1] - 1) not in black_pieces_locations):
-            piece_move_list.append((white_pieces_locations[i][0], white_pieces_locations[i][1] - 1))
-            if white_pieces_locations[i][1] == 6 and (white_pieces_locations[i][0], white_pieces_locations[i][1] - 2) \
-                    not in white_pieces_locations and (white_pieces_locations[i][0], white_pieces_locations[i][1] - 2) \
-                    not in black_pieces_locations:
-                piece_move_list.append((white_pieces_locations[i][0], white_pieces_locations[i][1] - 2))
-        # Check capturing moves and en-passant for white pawns
-        if (white_pieces_locations[i][0] - 1, white_pieces_locations[i][1] - 1) in black_pieces_locations:
-            piece_move_list.append((white_pieces_locations[i][0] - 1, white_pieces_locations[i][1] - 1))
-        if (white_pieces_locations[i][0] + 1, white_pieces_locations[i][1] - 1) in black_pieces_locations:
-            piece_move_list.append((white_pieces_locations[i][0] + 1, white_pieces_locations[i][1] - 1))
-        # en-passant mechanics
-        if black_last_move is not None:
-            if (white_pieces_locations[i][1] == 3 and black_pieces_locations[black_last_move][0] ==
-                    white_pieces_locations[i][0] - 1 and black_pieces_locations[black_last_move][1] == 3 and
-                    black_pieces[black_last_move] == 'pawn' and black_pre_last_move == 1):
-                piece_move_list.append((white_pieces_locations[i][0] - 1, white_pieces_locations[i][1] - 1))
-            if (white_pieces_locations[i][1] == 3 and black_pieces_locations[black_last_move][0] ==
-                    white_pieces_locations[i][0] + 1 and black_pieces_locations[black_last_move][1] == 3 and
-                    black_pieces[black_last_move] == 'pawn' and black_pre_last_move == 1):
-                piece_move_list.append((white_pieces_locations[i][0] + 1, white_pieces_locations[i][1] - 1))
-
-    # Process moves for black pawns
-    if color == 'black':
-        # Check normal pawn moves and double step from starting position
-        if ((black_pieces_locations[i][0], black_pieces_locations[i][1] + 1) not in black_pieces_locations and
-                (black_pieces_locations[i][0], black_pieces_locations[i][1] + 1) not in white_pieces_locations):
-            piece_move_list.append((black_pieces_locations[i][0], black_pieces_locations[i][1] + 1))
-            if (black_pieces_locations[i][1] == 1 and (black_pieces_locations[i][0], black_pieces_locations[i][1] + 2)
-                    not in black_pieces_locations and (black_pieces_locations[i][0], black_pieces_locations[i][1] + 2)
-                    not in white_pieces_locations):
-                piece_move_list.append((black_pieces_locations[i][0], black_pieces_locations[i][1] + 2))
-        # Check capturing moves and en-passant for black pawns
-        if (black_pieces_locations[i][0] - 1, black_pieces_locations[i][1] + 1) in white_pieces_locations:
-            piece_move_list.append((black_pieces_locations[i][0] - 1, black_pieces_locations[i][1] + 1))
-        if (black_pieces_locations[i][0] + 1, black_pieces_locations[i][1] + 1) in white_pieces_locations:
-            piece_move_list.append((black_pieces_locations[i][0] + 1, black_pieces_locations[i][1] + 1))
-        # en-passant mechanics
-        if white_last_move is not None:
-            if (black_pieces_locations[i][1] == 4 and white_pieces_locations[white_last_move][0] ==
-                    black_pieces_locations[i][0] - 1 and white_pieces_locations[white_last_move][1] == 4 and
-                    white_pieces[white_last_move] == 'pawn' and white_pre_last_move == 6):
-                piece_move_list.append((black_pieces_locations[i][0] - 1, black_pieces_locations[i][1] + 1))
-            if (black_pieces_locations[i][1] == 4 and white_pieces_locations[white_last_move][0] ==
-                    black_pieces_locations[i][0] + 1 and white_pieces_locations[white_last_move][1] == 4 and
-                    white_pieces[white_last_move] == 'pawn' and white_pre_last_move == 6):
-                piece_move_list.append((black_pieces_locations[i][0] + 1, black_pieces_locations[i][1] + 1))
-
-    return piece_move_list
-
-
-def check_rook_move(i: int, color: str) -> List[Tuple[int, int]]:
-    """
-    Calculates valid moves for a rook at a given position.
+    heapq.heappush(redraws, time.perf_counter() + delay)
 
-    This function considers all possible straight-line moves for the rook,
-    stopping at the first piece encountered in each direction. It includes
-    moves where the rook captures an opponent's piece.
 
-    Args:
-    i (int): Index of the rook in the piece list.
-    color (str): Color of the rook ('white' or 'black').
+def wait_for_events() -> List[pygame.event.Event]:
+    """
+    Sleeps until input arrives or the next scheduled redraw is due.
 
     Returns:
-    List[Tuple[int, int]]: A list of tuples representing valid moves for the rook.
+    List[pygame.event.Event]: The events that arrived, empty when woken by a scheduled redraw.
     """
+    # pygame.event.wait blocks without a limit when the timeout is 0
+    timeout = 0
+    if redraws:
+        timeout = max(1, int((redraws[0] - time.perf_counter()) * 1000) + 1)
+    events = [pygame.event.wait(timeout)] + pygame.event.get()
+    # SDL counts the timeout in whole milliseconds and may wake slightly early
+    now = time.perf_counter() + 0.002
+    while redraws and redraws[0] <= now:
+        heapq.heappop(redraws)
+    return [event for event in events if event.type != pygame.NOEVENT]
 
-    def add_rook_moves(piece_locations: List[Tuple[int, int]], opponent_locations: List[Tuple[int, int]], dx: int,
-                       dy: int) -> List[Tuple[int, int]]:
-        """
-        Helper function to add valid rook moves in a given direction.
-
-        Args:
-        piece_locations (List[Tuple[int, int]]): Locations of the player's pieces.
-        opponent_locations (List[Tuple[int, int]]): Locations of the opponent's pieces.
-        dx (int): Delta x, the horizontal direction of movement.
-        dy (int): Delta y, the vertical direction of movement.
-
-        Returns:
-        List[Tuple[int, int]]: Valid moves in the specified direction.
-        """
-        moves = []
-        for index in range(1, 8):
-            new_x, new_y = piece_locations[i][0] + dx * index, piece_locations[i][1] + dy * index
-            if (new_x, new_y) in piece_locations or not 0 <= new_y < 8:
-                break
-            moves.append((new_x, new_y))
-            if (new_x, new_y) in opponent_locations:
-                break
-        return moves
-
-    if color == 'white':
-        own_pieces, opponent_pieces = white_pieces_locations, black_pieces_locations
-    else:
-        own_pieces, opponent_pieces = black_pieces_locations, white_pieces_locations
 
-    # list 'directions' stores tuples representing the four directions a rook can move: up, down, left, and right
-    directions = [(0, -1), (0, 1), (-1, 0), (1, 0)]
-    piece_move_list = [move for dx, dy in directions for move in add_rook_moves(own_pieces, opponent_pieces, dx, dy)]
-
-    return piece_move_list
-
-
-def check_knight_move(i: int, color: str) -> List[Tuple[int, int]]:
+def check_valid_moves() -> List[Tuple[int, int]]:
     """
-    Calculates valid moves for a knight at a given position.
-
-    This function considers all possible L-shaped moves for the knight,
-    ensuring that it does not move onto a square occupied by a piece of the same color.
+    Retrieves valid moves for the currently selected piece based on the turn.
 
-    Args:
-    i (int): Index of the knight in the piece list.
-    color (str): Color of the knight ('white' or 'black').
+    This function checks which player's turn it is and takes the moves of the selected
+    piece from that player's valid moves list, leaving out those that would leave the
+    king in check.
 
     Returns:
-    List[Tuple[int, int]]: A list of tuples representing valid moves for the knight.
+    List[Tuple[int, int]]: A list of tuples representing valid moves for the selected piece.
     """
-    # list stores tuples representing all possible knight moves:
-    knight_moves = [(-2, -1), (-1, -2), (-1, 2), (-2, 1), (1, -2), (2, -1), (2, 1), (1, 2)]
-    # Determine the piece locations based on the color
-    if color == 'white':
-        own_pieces, board_limit = white_pieces_locations, 8
-    else:
-        own_pieces, board_limit = black_pieces_locations, 8
-
-    piece_move_list = [(own_pieces[i][0] + dx, own_pieces[i][1] + dy)
-                       for dx, dy in knight_moves
-                       if (own_pieces[i][0] + dx, own_pieces[i][1] + dy) not in own_pieces and
-                       0 <= own_pieces[i][1] + dy < board_limit]
+    global selection, position
 
-    return piece_move_list
+    if position.turn == 'white':
+        piece_moves = position.white_valid_moves[selection]
+    else:
+        piece_moves = position.black_valid_moves[selection]
+    return AttackMap(position).filter(selection, piece_moves)
 
 
-def check_bishop_move(i: int, color: str) -> List[Tuple[int, int]]:
+def highlighted_squares() -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
     """
-        Calculates valid moves for a bishop at a given position.
-
-        This function considers all possible diagonal moves for the bishop,
-        stopping at the first piece encountered in each direction. It includes
-        moves where the bishop captures an opponent's piece.
+    Finds the squares framed for the side to move: the opponent's last moved piece and the selected piece.
 
-        Args:
-        i (int): Index of the bishop in the piece list.
-        color (str): Color of the bishop ('white' or 'black').
-        Returns:
-        List[Tuple[int, int]]: A list of tuples representing valid moves for the bishop.
+    Returns:
+    Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]: The two squares, None for one that is not framed.
     """
-
-    def add_bishop_moves(own_locations: List[Tuple[int, int]], opponent_locations: List[Tuple[int, int]], dx: int,
-                         dy: int) -> List[Tuple[int, int]]:
-        """
-           Helper function to add valid bishop moves in a given diagonal direction.
-
-           Args:
-           own_locations (List[Tuple[int, int]]): Locations of the player's pieces.
-           opponent_locations (List[Tuple[int, int]]):
-            Locations of the opponent's pieces.
-            dx (int): Delta x, the horizontal direction of movement.
-            dy (int): Delta y, the vertical direction of movement.
-
-           Returns:
-           List[Tuple[int, int]]: Valid moves in the specified diagonal direction.
-           """
-        moves = []
-        for index in range(1, 8):
-            new_x, new_y = own_locations[i][0] + dx * index, own_locations[i][1] + dy * index
-            if (new_x, new_y) in own_locations or not 0 <= new_y < 8:
-                break
-            moves.append((new_x, new_y))
-            if (new_x, new_y) in opponent_locations:
-                break
-        return moves
-
-    if color == 'white':
-        own_pieces, opponent_pieces = white_pieces_locations, black_pieces_locations
+    global selection, position
+
+    if position.turn == 'white':
+        last_move, own_locations, opponent_locations = \
+            position.black_last_move, position.white_pieces_locations, position.black_pieces_locations
+    elif position.turn == 'black':
+        last_move, own_locations, opponent_locations = \
+            position.white_last_move, position.black_pieces_locations, position.white_pieces_locations
     else:
-        own_pieces, opponent_pieces = black_pieces_locations, white_pieces_locations
-
-    directions = [(1, 1), (-1, 1), (1, -1), (-1, -1)]  # Diagonal directions
-    piece_move_list = [move for dx, dy in directions for move in add_bishop_moves(own_pieces, opponent_pieces, dx, dy)]
-
-    return piece_move_list
+        return None, None
+    return (opponent_locations[last_move] if last_move is not None and last_move < len(opponent_locations) else None,
+            own_locations[selection] if selection is not None and selection < len(own_locations) else None)
 
 
-def check_queen_move(i: int, color: str) -> List[Tuple[int, int]]:
+def end_game_if_over() -> None:
     """
-    Calculates valid moves for a queen at a given position.
+    Ends the game when the side to move is checkmated or stalemated.
+    """
+    global position
+    status = game_status(position)
+    if status == 'checkmate':
+        position.turn = opponent(position.turn) + '_won'
+    elif status == 'stalemate':
+        position.turn = 'draw'
+        # A drawn game has neither a side to move nor an en-passant column in its key
+        position.key = compute_key(position)
+
+
+def play_engine_move(engine: Engine, think_time: float, history: List[int],
+                     book: Optional[OpeningBook] = None, tablebase: Optional[Tablebase] = None,
+                     searcher: Optional[Analysis] = None) -> bool:
+    """
+    Lets the engine choose and play a move for the side to move.
 
-    This function combines the moves of a rook and a bishop, as the queen's movement
-    is a combination of both these pieces. It includes all possible straight-line and
-    diagonal moves, stopping at the first piece encountered in each direction and
-    including captures of opponent's pieces.
+    A side without a legal move resigns; the games shown in the window end by checkmate or
+    stalemate before that happens.
 
     Args:
-    i (int): Index of the queen in the piece list.
-    color (str): Color of the queen ('white' or 'black').
+    engine (Engine): The engine to search with.
+    think_time (float): Seconds the engine may think.
+    history (List[int]): Zobrist keys of the earlier positions of the game, the current one is added.
+    book (Optional[OpeningBook]): Opening book whose moves are played without searching.
+    tablebase (Optional[Tablebase]): Endgame tables whose best moves are played without searching.
+    searcher (Optional[Analysis]): Worker process that searches instead of engine. The first call
+    starts its search and returns at once; the move is played by the call that finds it finished.
 
     Returns:
-    List[Tuple[int, int]]: A list of tuples representing valid moves for the queen.
+    bool: Whether the move was played, False while the searcher is still searching.
     """
-
-    # Combine rook and bishop moves to get queen's moves
-    piece_move_list = check_rook_move(i, color) + check_bishop_move(i, color)
-
-    return piece_move_list
-
-
-def check_king_move(i: int, color: str) -> List[Tuple[int, int]]:
+    global position
+    move = book.choose(position) if book else None
+    if move is None and tablebase:
+        move = tablebase.best_move(position)
+    if move is None and searcher:
+        if not searcher.running and searcher.result is None:
+            searcher.analyse(position, history)
+        searcher.poll()
+        if searcher.running:
+            return False
+        move = searcher.result['move']
+        # Forget the result, so the next position starts a new search
+        searcher.cancel()
+    elif move is None:
+        move = engine.search(position, think_time, history=history)['move']
+    if move is None:
+        position.turn = opponent(position.turn) + '_won'
+        return True
+    history.append(position.key)
+    i, target, promotion = move
+    moves.append(move_name(position.pieces(position.turn)[1][i], target, promotion))
+    position.update_valid_moves(position.make_move(move))
+    end_game_if_over()
+    return True
+
+
+def record_game(writer: RecordWriter) -> None:
     """
-       Calculates valid moves for a king at a given position.
-
-       This function considers all possible one-square moves around the king in all directions.
-       It also includes castling moves if the conditions are met (king and rook have not moved,
-       there are no pieces between them and there is no valid enemy piece move in any of castling squares).
-
-       Args:
-       i (int): Index of the king in the piece list.
-       color (str): Color of the king ('white' or 'black').
+    Appends the game shown in the window to a record file and forgets its moves.
 
-       Returns:
-       List[Tuple[int, int]]: A list of tuples representing valid moves for the king.
+    Args:
+    writer (RecordWriter): The record file.
     """
-
-    def king_moves(piece_locations: List[Tuple[int, int]], dx_dy: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
-        """
-        Helper function to add valid king moves.
-
-        Args:
-        piece_locations (List[Tuple[int, int]]): Locations of the player's pieces.
-        dx_dy (List[Tuple[int, int]]): List of tuples representing move directions.
-
-        Returns:
-        List[Tuple[int, int]]: Valid moves for the king.
-        """
-        moves = []
-        for dx, dy in dx_dy:
-            new_x, new_y = piece_locations[i][0] + dx, piece_locations[i][1] + dy
-            if (new_x, new_y) not in piece_locations and 0 <= new_x < 8 and 0 <= new_y < 8:
-                moves.append((new_x, new_y))
-
-        # Castling logic here
-        if color == 'white':
-            if king_moved[0] == 0 and (white_pieces_locations[i][0], white_pieces_locations[i][1]) == (3, 7) and (
-                    3, 7) not in black_valid_moves:
-                if (0, 7) in white_pieces_locations:
-                    index1 = white_pieces_locations.index((0, 7))
-                if (7, 7) in white_pieces_locations:
-                    index2 = white_pieces_locations.index((7, 7))
-                if (0, 7) in white_pieces_locations and white_pieces[index1] == 'rook':
-                    if (1, 7) not in white_pieces_locations and (1, 7) not in black_valid_moves and (
-                            1, 7) not in black_pieces_locations and (2, 7) not in white_pieces_locations and (
-                            2, 7) not in black_valid_moves and (2, 7) not in black_pieces_locations:
-                        moves.append((1, 7))
-                if (7, 7) in white_pieces_locations and white_pieces[index2] == 'rook':
-                    if (4, 7) not in white_pieces_locations and (4, 7) not in black_valid_moves and (
-                            4, 7) not in black_pieces_locations and (5, 7) not in white_pieces_locations and (
-                            5, 7) not in black_valid_moves and (5, 7) not in black_pieces_locations and (
-                            6, 7) not in white_pieces_locations and (6, 7) not in black_valid_moves and (
-                            6, 7) not in black_pieces_locations:
-                        moves.append((6, 7))
+    if position.turn == 'white_won' or position.turn == 'black_won':
+        loser = 'black' if position.turn == 'white_won' else 'white'
+        result = '1-0' if loser == 'black' else '0-1'
+        if 'king' not in position.pieces(loser)[0]:
+            termination = 'king_capture'
         else:
-            if king_moved[1] == 0 and (black_pieces_locations[i][0], black_pieces_locations[i][1]) == (3, 0) and (
-                    3, 0) not in white_valid_moves:
-                if (0, 0) in black_pieces_locations:
-                    index1 = black_pieces_locations.index((0, 0))
-                if (7, 0) in black_pieces_locations:
-                    index2 = black_pieces_locations.index((7, 0))
-                if (0, 0) in black_pieces_locations and black_pieces[index1] == 'rook':
-                    if (1, 0) not in black_pieces_locations and (1, 0) not in white_valid_moves and (
-                            1, 0) not in white_pieces_locations and (2, 0) not in black_pieces_locations and (
-                            2, 0) not in white_valid_moves and (2, 0) not in white_pieces_locations:
-                        moves.append((1, 0))
-                if (7, 0) in black_pieces_locations and black_pieces[index2] == 'rook':
-                    if (4, 0) not in black_pieces_locations and (4, 0) not in white_valid_moves and (
-                            4, 0) not in white_pieces_locations and (5, 0) not in black_pieces_locations and (
-                            5, 0) not in white_valid_moves and (5, 0) not in white_pieces_locations and (
-                            6, 0) not in black_pieces_locations and (6, 0) not in white_valid_moves and (
-                            6, 0) not in white_pieces_locations:
-                        moves.append((6, 0))
-
-        return moves
-
-    # All 8 directions around the king
-    directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-    if color == 'white':
-        return king_moves(white_pieces_locations, directions)
+            # The loser still has a king when mated, or when the engine gave up without a legal move
+            termination = 'checkmate' if position.in_check(loser) else 'resignation'
+    elif position.turn == 'draw':
+        result, termination = '1/2-1/2', 'stalemate'
     else:
-        return king_moves(black_pieces_locations, directions)
+        result, termination = '*', 'abandoned'
+    writer.write(moves, result, termination)
+    moves.clear()
 
 
-def check_all_moves(color: str) -> List[List[Tuple[int, int]]]:
+def start(engine_colors: Sequence[str] = (), think_time: float = 1.0, record_path: Optional[str] = None,
+          book_path: Optional[str] = None, tablebase_directory: Optional[str] = None,
+          profile_path: Optional[str] = None, profile_interval: float = 10.0, overlay: bool = False,
+          analysis: bool = False):
     """
-    Calculates all valid moves for all pieces of the specified color.
-
-    This function iterates through each piece of the given color and
-    accumulates a list of valid moves for each piece, considering the type
-    of each piece (pawn, rook, knight, bishop, king, queen).
+    Runs the game window until it is closed.
 
     Args:
-    color (str): Color of the pieces ('white' or 'black').
-
-    Returns:
-    List[List[Tuple[int, int]]]: A list containing lists of tuples, where each inner list
-    represents valid moves for a single piece and each tuple represents a move's coordinates.
+    engine_colors (Sequence[str]): Colors played by the engine, empty for a two-player game.
+    think_time (float): Seconds the engine may think about every move.
+    record_path (Optional[str]): Binary record file (see records.py) every game is appended to when
+    it ends, or when the window is closed during it.
+    book_path (Optional[str]): Opening book (see book.py) the engine plays from while it knows the position.
+    tablebase_directory (Optional[str]): Directory of endgame tables (see tablebase.py) the engine plays from.
+    profile_path (Optional[str]): JSON or CSV file the timings of move generation, rendering and frames
+    (see instrumentation.py) are written to every profile_interval seconds and when the window is closed.
+    profile_interval (float): Seconds between two writes of the timings.
+    overlay (bool): Show the timings in the window. Without it and without profile_path nothing is measured.
+    analysis (bool): Analyse every position in a background process (see analysis.py) and show the
+    score and the expected line under the turn. The engine's moves are then searched in a second
+    process, so the window keeps drawing while the engine thinks.
     """
-
-    piece_move_list = []  # List of moves for one chess piece
-    all_move_list = []  # List of moves for all pieces of one color
-
-    # Assign the correct piece set based on color
-    pieces = white_pieces if color == 'white' else black_pieces
-
-    # Iterate through each piece and accumulate their valid moves
-    for i in range(len(pieces)):
-        if pieces[i] == 'pawn':
-            piece_move_list = check_pawn_move(i, color)
-        elif pieces[i] == 'rook':
-            piece_move_list = check_rook_move(i, color)
-        elif pieces[i] == 'knight':
-            piece_move_list = check_knight_move(i, color)
-        elif pieces[i] == 'bishop':
-            piece_move_list = check_bishop_move(i, color)
-        elif pieces[i] == 'king':
-            piece_move_list = check_king_move(i, color)
-        elif pieces[i] == 'queen':
-            piece_move_list = check_queen_move(i, color)
-
-        all_move_list.append(piece_move_list)
-
-    return all_move_list
-
-
-def check_valid_moves() -> List[Tuple[int, int]]:
-    """
-    Retrieves valid moves for the currently selected piece based on the turn.
-
-    This function checks which player's turn it is and returns the valid moves for
-    the selected piece from that player's valid moves list.
-
-    Returns:
-    List[Tuple[int, int]]: A list of tuples representing valid moves for the selected piece.
-    """
-    global selection, white_valid_moves, black_valid_moves, turn
-
-    if turn == 'white':
-        return white_valid_moves[selection]
-    else:
-        return black_valid_moves[selection]
-
-
-def start():
-    global turn, white_pieces, white_pieces_locations, black_pieces, black_pieces_locations, white_last_move, black_last_move, selection, white_valid_moves, black_valid_moves, valid_moves, white_pre_last_move, black_pre_last_move
-    # Main game loop
+    global position, selection, valid_moves
+    engine = Engine()
+    writer = RecordWriter(record_path) if record_path else None
+    book = OpeningBook(book_path) if book_path else None
+    tablebase = Tablebase(tablebase_directory) if tablebase_directory else None
+    history = []  # keys of the positions before the current one, so the engine avoids repetitions
+    instruments = None
+    if profile_path or overlay:
+        instruments = Instrumentation().enable()
+        # The loop calls its own reference to draw_frame
+        instruments.wrap(sys.modules[__name__], 'draw_frame')
+        next_dump = time.perf_counter() + profile_interval
+    analyser = Analysis() if analysis else None
+    analysed = None  # the position the analysis was last started or cancelled for
+    searcher = Analysis(think_time, TABLE_SIZE) if analysis and engine_colors else None
+    frame_begin = None
+    position.update_valid_moves()
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(WAKING_EVENTS)
+    # Main game loop: draw what changed, then sleep until something happens
     run = True
     while run:
-        TIMER.tick(FPS)
-
-        # Draw the chess board and the pieces
-        draw_chess_board(turn)
-        draw_pieces(white_pieces, white_pieces_locations, black_pieces, black_pieces_locations, turn, white_last_move,
-                    black_last_move, selection)
-
-        # Handle piece selection and valid move display
-        if selection is not None:
-            valid_moves = check_valid_moves()
-            draw_valid_moves(valid_moves)
-
-        # Winning condition handling
-        if turn != 'white' and turn != 'black':
-            draw_chess_board(turn)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    run = False
-                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    y = event.pos[1] // 100
-                    if y == 8:
-                        # Restart the game logic here
-                        turn = 'white'
-                        white_pieces = ['rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook',
-                                        'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn']
-                        white_pieces_locations = [(0, 7), (1, 7), (2, 7), (3, 7), (4, 7), (5, 7), (6, 7), (7, 7),
-                                                  (0, 6), (1, 6), (2, 6), (3, 6), (4, 6), (5, 6), (6, 6), (7, 6)]
-
-                        black_pieces = ['rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook',
-                                        'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn']
-                        black_pieces_locations = [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0),
-                                                  (0, 1), (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1)]
-                        white_last_move = None
-                        black_last_move = None
-                        break
-
-        # Game event handling
-        for event in pygame.event.get():
+        if analyser:
+            # A new position cancels the analysis of the previous one, a finished game just cancels it
+            playing = position.turn == 'white' or position.turn == 'black'
+            if (position.key, position.turn, len(history)) != analysed:
+                analysed = (position.key, position.turn, len(history))
+                if playing:
+                    analyser.analyse(position, history)
+                else:
+                    analyser.cancel()
+            analyser.poll()
+        if (analyser and analyser.running or searcher and searcher.running) and \
+                (not redraws or redraws[0] > time.perf_counter() + ANALYSIS_POLL):
+            # Read the results again soon even when nothing happens in the window
+            schedule_redraw(ANALYSIS_POLL)
+
+        # Redraw only the squares that changed since the previous frame
+        rects = draw_frame(position.board, position.turn, *highlighted_squares(), valid_moves)
+        if analyser and playing:
+            rects.append(draw_analysis(format_analysis(analyser.result, position.turn) if analyser.result
+                                       else 'analysing...'))
+        if overlay:
+            rects.append(draw_overlay(instruments.overlay_lines()))
+        pygame.display.update(rects)
+        if instruments:
+            if frame_begin is not None:
+                instruments.record_frame(time.perf_counter() - frame_begin)
+            if profile_path and time.perf_counter() >= next_dump:
+                instruments.dump(profile_path)
+                next_dump = time.perf_counter() + profile_interval
+            if profile_path and (not redraws or redraws[0] > next_dump):
+                # Wake up for the next write even when nothing happens in the window
+                schedule_redraw(next_dump - time.perf_counter())
+
+        # Game event handling: sleep until input arrives unless the engine is about to move,
+        # or until the next poll while the searcher thinks about the engine's move
+        engine_to_move = position.turn in engine_colors
+        events = pygame.event.get() if engine_to_move and not (searcher and searcher.running) else wait_for_events()
+        # A frame lasts from the input to the updated screen, without the time spent waiting for input
+        frame_begin = time.perf_counter() if instruments else None
+        for event in events:
             # Quitting event handling
             if event.type == pygame.QUIT:
                 run = False
+            # The window was uncovered and has to be drawn again
+            if event.type == pygame.VIDEOEXPOSE or event.type == pygame.WINDOWEXPOSED:
+                invalidate()
             # Clicking on board event handling
             if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 x = event.pos[0] // 100
                 y = event.pos[1] // 100
                 click_position = (x, y)
 
-                # Update valid moves for each color
-                black_valid_moves = check_all_moves('black')
-                white_valid_moves = check_all_moves('white')
-
-                # Player turn handling and piece movement logic
-                if turn == 'white':
-                    # White player's turn logic
-                    # Includes selection, movement, special moves (e.g., en-passant, castling), and capture handling
-                    if click_position in white_pieces_locations:
-                        selection = white_pieces_locations.index(click_position)
-                        white_pre_last_move = y
-                    if click_position in valid_moves and selection is not None:
-                        white_pieces_locations[selection] = click_position
-                        white_last_move = selection
-                        # Promoting
-                        if white_pieces[white_last_move] == 'pawn' and white_pieces_locations[selection][1] == 0:
-                            white_pieces[white_last_move] = 'queen'
-                        # En-passant handling
-                        if (black_last_move is not None and white_pieces[white_last_move] == 'pawn' and
-                                white_pieces_locations[selection] ==
-                                (black_pieces_locations[black_last_move][0],
-                                 black_pieces_locations[black_last_move][1] - 1)):
-                            black_pieces.pop(black_last_move)
-                            black_pieces_locations.pop(black_last_move)
-                        # Castle handling
-                        if (white_pieces[white_last_move] == 'king' and white_pieces_locations[white_last_move] == (
-                                1, 7)
-                                and king_moved[0] == 0):
-                            white_pieces_locations[white_pieces_locations.index((0, 7))] = (2, 7)
-                        if (white_pieces[white_last_move] == 'king' and white_pieces_locations[white_last_move] == (
-                                6, 7)
-                                and king_moved[0] == 0):
-                            white_pieces_locations[white_pieces_locations.index((7, 7))] = (5, 7)
-                        if white_pieces[white_last_move] == 'king':
-                            king_moved[0] = 1
-
-                        # Capturing piece handling
-                        if click_position in black_pieces_locations:
-                            black_pieces.pop(black_pieces_locations.index(click_position))
-                            black_pieces_locations.pop(black_pieces_locations.index(click_position))
-                        black_valid_moves = check_all_moves('black')
-                        white_valid_moves = check_all_moves('white')
-
-                        if 'king' not in black_pieces:
-                            turn = 'white_won'
-                            break
-
-                        turn = 'black'
-                        selection = None
-                        valid_moves = []
-                        draw_chess_board(turn)
-                        draw_pieces(white_pieces, white_pieces_locations, black_pieces, black_pieces_locations, turn,
-                                    white_last_move,
-                                    black_last_move, selection)
-                else:
-                    # Black player's turn logic
-                    # Similar to white's logic with appropriate adjustments for black pieces
-                    if click_position in black_pieces_locations:
-                        selection = black_pieces_locations.index(click_position)
-                        black_pre_last_move = y
-                    if click_position in valid_moves and selection is not None:
-                        black_pieces_locations[selection] = click_position
-                        black_last_move = selection
-                        # Promoting
-                        if black_pieces[white_last_move] == 'pawn' and black_pieces_locations[selection][1] == 7:
-                            black_pieces[white_last_move] = 'queen'
-                        # En passant
-                        if (white_last_move is not None and black_pieces[black_last_move] == 'pawn' and
-                                black_pieces_locations[selection] ==
-                                (white_pieces_locations[white_last_move][0],
-                                 white_pieces_locations[white_last_move][1] + 1)):
-                            white_pieces.pop(white_last_move)
-                            white_pieces_locations.pop(white_last_move)
-                        # Castle
-                        if (black_pieces[black_last_move] == 'king' and black_pieces_locations[black_last_move] == (
-                                1, 0)
-                                and king_moved[1] == 0):
-                            black_pieces_locations[black_pieces_locations.index((0, 0))] = (2, 0)
-                        if (black_pieces[black_last_move] == 'king' and black_pieces_locations[black_last_move] == (
-                                6, 0)
-                                and king_moved[1] == 0):
-                            black_pieces_locations[black_pieces_locations.index((7, 0))] = (5, 0)
-                        if black_pieces[black_last_move] == 'king':
-                            king_moved[1] = 1
-                        # Capturing
-                        if click_position in white_pieces_locations:
-                            white_pieces.pop(white_pieces_locations.index(click_position))
-                            white_pieces_locations.pop(white_pieces_locations.index(click_position))
-                        black_valid_moves = check_all_moves('black')
-                        white_valid_moves = check_all_moves('white')
-
-                        if 'king' not in white_pieces:
-                            turn = 'black_won'
-                            break
-
-                        turn = 'white'
+                # Winning condition handling: a click below the board starts a new game
+                if position.turn != 'white' and position.turn != 'black':
+                    if y == 8:
+                        position.reset()
+                        position.update_valid_moves()
+                        history.clear()
+                        moves.clear()
                         selection = None
                         valid_moves = []
+                    continue
 
-        pygame.display.flip()
+                # Player turn handling and piece movement logic
+                # Includes selection, movement, special moves (e.g., en-passant, castling), and capture handling
+                if position.turn in engine_colors:
+                    continue
+                clicked = position.piece_index(click_position, position.turn) if y < 8 else None
+                if clicked is not None:
+                    selection = clicked
+                    valid_moves = check_valid_moves()
+                elif click_position in valid_moves and selection is not None:
+                    history.append(position.key)
+                    moves.append(move_name(position.pieces(position.turn)[1][selection], click_position))
+                    # Only the pieces affected by the move get their valid moves recalculated
+                    position.update_valid_moves(position.make_move((selection, click_position, None)))
+                    end_game_if_over()
+                    selection = None
+                    valid_moves = []
+
+        # The engine moves once the previous move is on the screen
+        if run and engine_to_move and position.turn in engine_colors:
+            if play_engine_move(engine, think_time, history, book, tablebase, searcher):
+                # The engine's thinking is measured by its own functions, not as part of the frame
+                frame_begin = time.perf_counter() if instruments else None
+
+        # A finished game is saved as soon as it ends
+        if writer and moves and position.turn != 'white' and position.turn != 'black':
+            record_game(writer)
+    if writer:
+        if moves:
+            record_game(writer)
+        writer.close()
+    if book:
+        book.close()
+    if tablebase:
+        tablebase.close()
+    if analyser:
+        analyser.close()
+    if searcher:
+        searcher.close()
+    if instruments:
+        instruments.disable()
+        if profile_path:
+            instruments.dump(profile_path)
     pygame.quit()
 
 
 if __name__ == '__main__':
-    start()
+    parser = argparse.ArgumentParser(description='Play chess in a window.')
+    parser.add_argument('--engine', action='append', choices=['white', 'black'], default=[],
+                        help='color played by the engine, may be given twice')
+    parser.add_argument('--time', type=float, default=1.0, help='seconds the engine thinks per move')
+    parser.add_argument('--record', default=None, help='binary record file the games are appended to')
+    parser.add_argument('--book', default=None, help='opening book the engine plays from')
+    parser.add_argument('--tablebases', default=None, help='directory of endgame tables the engine plays from')
+    parser.add_argument('--profile', default=None, help='JSON or CSV file the timings are written to')
+    parser.add_argument('--profile-interval', type=float, default=10.0, help='seconds between two writes')
+    parser.add_argument('--overlay', action='store_true', help='show the timings in the window')
+    parser.add_argument('--analysis', action='store_true', help='analyse the position in the background')
+    args = parser.parse_args()
+    start(args.engine, args.time, args.record, args.book, args.tablebases, args.profile, args.profile_interval,
+          args.overlay, args.analysis)
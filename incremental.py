@@ -0,0 +1,153 @@
+"""
+Incremental maintenance of the valid move lists stored in a Position.
+
+After a move only the pieces that can see one of the changed squares get different
+moves: the moved piece itself, sliding pieces whose rays reach a changed square,
+knights and pawns next to one, both kings (castling depends on the attacked squares)
+and pawns that may capture en-passant. Everything else keeps its stored moves, so a
+move costs a handful of check_*_move calls instead of two full check_all_moves.
+"""
+import random
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+from package.chess_game_module.position import Position, Undo, opponent
+
+
+def update_valid_moves(position: Position, undo: Undo) -> int:
+    """
+    Brings the stored valid moves of both sides up to date after a move.
+
+    The result is identical to a full Position.update_valid_moves. When the stored moves
+    were not up to date before the move, everything is recalculated.
+
+    Args:
+    position (Position): The position the move was just made in.
+    undo (Undo): The value returned by make_move for that move.
+
+    Returns:
+    int: The number of pieces whose moves were calculated.
+    """
+    i, start, _, captured, rook, state = undo
+    color = state[0]
+    own_pieces, own_locations = position.pieces(color)
+    opponent_pieces, opponent_locations = position.pieces(opponent(color))
+    own_valid, opponent_valid = (position.white_valid_moves, position.black_valid_moves) if color == 'white' \
+        else (position.black_valid_moves, position.white_valid_moves)
+
+    if len(own_valid) != len(own_pieces) or \
+            len(opponent_valid) != len(opponent_pieces) + (captured is not None):
+        return position.update_valid_moves()
+
+    # Squares whose occupancy changed and pieces that moved
+    changed = {start, own_locations[i]}
+    moved = {i}
+    if captured is not None:
+        changed.add(captured[2])
+        opponent_valid.pop(captured[0])
+    if rook is not None:
+        changed.update([rook[1], own_locations[rook[0]]])
+        moved.add(rook[0])
+
+    occupied = set(own_locations)
+    occupied.update(opponent_locations)
+    recalculated = 0
+    for side, pieces, locations, valid in [(color, own_pieces, own_locations, own_valid),
+                                           (opponent(color), opponent_pieces, opponent_locations, opponent_valid)]:
+        for index in range(len(pieces)):
+            if (side == color and index in moved) or _is_affected(pieces[index], locations[index], side,
+                                                                  changed, occupied):
+                valid[index] = position.check_piece_move(index, side)
+                recalculated += 1
+    return recalculated
+
+
+def _is_affected(piece: str, location: Tuple[int, int], color: str, changed: Set[Tuple[int, int]],
+                 occupied: Set[Tuple[int, int]]) -> bool:
+    """
+    Checks whether the moves of a piece that did not move may depend on the changed squares.
+
+    Args:
+    piece (str): Type of the piece.
+    location (Tuple[int, int]): Location of the piece.
+    color (str): Color of the piece ('white' or 'black').
+    changed (Set[Tuple[int, int]]): Squares whose occupancy changed.
+    occupied (Set[Tuple[int, int]]): All squares taken after the move.
+
+    Returns:
+    bool: True if the moves of the piece have to be recalculated.
+    """
+    if piece == 'king':
+        return True
+    x, y = location
+    if piece == 'pawn':
+        step, en_passant_row = (-1, 3) if color == 'white' else (1, 4)
+        if y == en_passant_row:
+            return True
+        return any(sy == y + step and -1 <= sx - x <= 1 or sx == x and sy == y + 2 * step for sx, sy in changed)
+    if piece == 'knight':
+        return any((sx - x) ** 2 + (sy - y) ** 2 == 5 for sx, sy in changed)
+
+    for sx, sy in changed:
+        dx, dy = sx - x, sy - y
+        if not ((dx == 0 or dy == 0) and piece != 'bishop' or dx * dx == dy * dy and piece != 'rook'):
+            continue
+        # The ray reaches the square unless an unchanged piece stands in between
+        step_x, step_y = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+        between = (x + step_x, y + step_y)
+        while between != (sx, sy) and (between not in occupied or between in changed):
+            between = (between[0] + step_x, between[1] + step_y)
+        if between == (sx, sy):
+            return True
+    return False
+
+
+def benchmark(games: int = 20, plies: int = 80, seed: int = 0) -> Dict[str, float]:
+    """
+    Compares full and incremental updates of the valid moves over random games.
+
+    Args:
+    games (int): Number of random games to play.
+    plies (int): Maximal length of every game.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    Dict[str, float]: Moves played, average number of pieces recalculated per move and
+    seconds spent updating, for both the 'full' and the 'incremental' method.
+    """
+    rng = random.Random(seed)
+    histories: List[List[Tuple[int, Tuple[int, int], None]]] = []
+    for _ in range(games):
+        position, history = Position(), []
+        for _ in range(plies):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            history.append(rng.choice(moves))
+            position.make_move(history[-1])
+        histories.append(history)
+
+    results = {'moves': float(sum(len(history) for history in histories))}
+    for method in ['full', 'incremental']:
+        pieces, seconds = 0, 0.0
+        for history in histories:
+            position = Position()
+            position.update_valid_moves()
+            for move in history:
+                undo = position.make_move(move)
+                begin = time.perf_counter()
+                pieces += position.update_valid_moves(undo if method == 'incremental' else None)
+                seconds += time.perf_counter() - begin
+        results[f'{method}_pieces_per_move'] = pieces / results['moves']
+        results[f'{method}_seconds'] = seconds
+    return results
+
+
+if __name__ == '__main__':
+    result = benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
+    print(f"moves played:          {result['moves']:.0f}")
+    for name in ['full', 'incremental']:
+        print(f"{name + ':':<12} {result[name + '_pieces_per_move']:6.1f} pieces/move "
+              f"{1e6 * result[name + '_seconds'] / result['moves']:8.1f} us/move")
+    print(f"speedup:     {result['full_seconds'] / result['incremental_seconds']:6.2f}x")
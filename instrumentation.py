@@ -0,0 +1,201 @@
+"""
+Opt-in timing of move generation, rendering and frames.
+
+Nothing here runs unless an Instrumentation is enabled: enabling it replaces the measured
+functions (the check_*_move methods of Position, the drawing stages of board_drawing and the
+pygame display updates) with timing wrappers, and disabling it puts the originals back, so a
+session without instrumentation calls exactly the same functions as before. For every function
+it keeps the number of calls and the cumulative and longest time; nested calls are included in
+their caller's time, so check_all_moves contains the check_*_move calls it makes. Frame times
+of the game loop go into a histogram.
+
+The numbers can be shown in the game window (see board_drawing.draw_overlay) and written as
+JSON or CSV, which game.py does periodically with --profile:
+    python -m package.chess_game_module.game --profile profile.json --profile-interval 10 --overlay
+"""
+import bisect
+import csv
+import functools
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds of the frame histogram buckets in milliseconds, the last bucket has no bound
+FRAME_BUCKETS = [1, 2, 4, 8, 16, 33, 66, 100, 250, 1000]
+MOVE_GENERATION_FUNCTIONS = ['check_all_moves', 'check_piece_move', 'check_pawn_move', 'check_rook_move',
+                             'check_knight_move', 'check_bishop_move', 'check_queen_move', 'check_king_move',
+                             'legal_moves', 'update_valid_moves', 'make_move']
+RENDERING_FUNCTIONS = ['draw_frame', 'draw_chess_board', 'draw_pieces', 'draw_status', 'square_contents',
+                       '_draw_square']
+DISPLAY_FUNCTIONS = ['update', 'flip']
+
+
+class TimingStats:
+    """
+    Calls and time of one measured function.
+    """
+    __slots__ = ('calls', 'total', 'maximum')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0  # seconds
+        self.maximum = 0.0
+
+    def add(self, seconds: float) -> None:
+        """
+        Counts one call that took the given number of seconds.
+        """
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+
+class Instrumentation:
+    """
+    Timing wrappers installed on demand, with the statistics they collect.
+
+    Attributes:
+    stats (Dict[str, TimingStats]): Statistics by function name.
+    frames (List[int]): Number of frames in every bucket of FRAME_BUCKETS, plus one for longer frames.
+    frame_time (TimingStats): Count, total and longest time of the frames.
+    """
+
+    def __init__(self) -> None:
+        self.stats: Dict[str, TimingStats] = {}
+        self.frames = [0] * (len(FRAME_BUCKETS) + 1)
+        self.frame_time = TimingStats()
+        self._patches: List[Tuple[object, str, Callable]] = []
+
+    def wrap(self, owner: object, name: str, label: Optional[str] = None) -> None:
+        """
+        Replaces a function of a class or module by a timing wrapper until disable is called.
+
+        Args:
+        owner (object): The class or module the function is looked up on.
+        name (str): Name of the function.
+        label (Optional[str]): Name of its statistics, the function name by default.
+        """
+        original = getattr(owner, name)
+        stats = self.stats.setdefault(label or name, TimingStats())
+        perf_counter = time.perf_counter
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            begin = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                stats.add(perf_counter() - begin)
+
+        setattr(owner, name, timed)
+        self._patches.append((owner, name, original))
+
+    def enable(self, rendering: bool = True) -> 'Instrumentation':
+        """
+        Wraps the move generation functions, and the rendering stages when asked to.
+
+        Args:
+        rendering (bool): Also measure board_drawing and the pygame display updates. Off for
+        headless programs, which then do not import pygame.
+
+        Returns:
+        Instrumentation: Itself, so it can be used in a with statement.
+        """
+        from package.chess_game_module.position import Position
+
+        for name in MOVE_GENERATION_FUNCTIONS:
+            self.wrap(Position, name)
+        if rendering:
+            import pygame
+            from package.chess_game_module import board_drawing
+
+            for name in RENDERING_FUNCTIONS:
+                self.wrap(board_drawing, name)
+            for name in DISPLAY_FUNCTIONS:
+                self.wrap(pygame.display, name, 'display.' + name)
+        return self
+
+    def disable(self) -> None:
+        """
+        Puts the original functions back. The statistics are kept.
+        """
+        while self._patches:
+            owner, name, original = self._patches.pop()
+            setattr(owner, name, original)
+
+    def __enter__(self) -> 'Instrumentation':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.disable()
+
+    def record_frame(self, seconds: float) -> None:
+        """
+        Counts one frame of the game loop.
+
+        Args:
+        seconds (float): How long the frame took.
+        """
+        self.frame_time.add(seconds)
+        self.frames[bisect.bisect_left(FRAME_BUCKETS, seconds * 1000)] += 1
+
+    def report(self) -> Dict[str, object]:
+        """
+        Summarises the statistics.
+
+        Returns:
+        Dict[str, object]: 'functions', by name the 'calls', 'total_ms', 'mean_us' and 'max_ms',
+        slowest in total first, and 'frames' with the 'count', 'mean_ms', 'max_ms' and the
+        'histogram' of frame times, by the bucket's upper bound ('<=16ms', ..., '>1000ms').
+        """
+        functions = {}
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total):
+            functions[name] = {'calls': stats.calls, 'total_ms': stats.total * 1e3,
+                               'mean_us': stats.total / stats.calls * 1e6 if stats.calls else 0.0,
+                               'max_ms': stats.maximum * 1e3}
+        labels = [f'<={bound}ms' for bound in FRAME_BUCKETS] + [f'>{FRAME_BUCKETS[-1]}ms']
+        frames = self.frame_time
+        return {'functions': functions,
+                'frames': {'count': frames.calls, 'mean_ms': frames.total / frames.calls * 1e3 if frames.calls else 0.0,
+                           'max_ms': frames.maximum * 1e3, 'histogram': dict(zip(labels, self.frames))}}
+
+    def dump(self, path: str) -> None:
+        """
+        Writes the report, as CSV when the path ends with '.csv' and as JSON otherwise.
+
+        The CSV has one row per function and one per histogram bucket:
+            kind,name,calls,total_ms,mean_us,max_ms
+
+        Args:
+        path (str): Path of the file, overwritten.
+        """
+        report = self.report()
+        with open(path, 'w', newline='') as file:
+            if not path.endswith('.csv'):
+                json.dump(report, file, indent=1)
+                return
+            writer = csv.writer(file)
+            writer.writerow(['kind', 'name', 'calls', 'total_ms', 'mean_us', 'max_ms'])
+            for name, stats in report['functions'].items():
+                writer.writerow(['function', name, stats['calls'], f"{stats['total_ms']:.3f}",
+                                 f"{stats['mean_us']:.1f}", f"{stats['max_ms']:.3f}"])
+            for bucket, count in report['frames']['histogram'].items():
+                writer.writerow(['frame', bucket, count, '', '', ''])
+
+    def overlay_lines(self, functions: int = 3) -> List[str]:
+        """
+        Describes the statistics in a few short lines for the game window.
+
+        Args:
+        functions (int): Number of functions shown, slowest in total first.
+
+        Returns:
+        List[str]: The frame times followed by one line per function.
+        """
+        frames = self.frame_time
+        lines = [f'frames {frames.calls}: mean {frames.total / frames.calls * 1e3 if frames.calls else 0.0:.1f} ms, '
+                 f'max {frames.maximum * 1e3:.1f} ms']
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total)[:functions]:
+            lines.append(f'{name} x{stats.calls}: {stats.total * 1e3:.0f} ms, max {stats.maximum * 1e3:.1f} ms')
+        return lines
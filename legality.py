@@ -0,0 +1,273 @@
+"""
+Legal move filtering with attack maps and pin rays.
+
+The check_*_move rules of Position produce pseudo-legal moves: a king may step into check
+and a pinned piece may leave the line it shields. Instead of playing every move and asking
+whether the own king is attacked afterwards, an AttackMap looks at the position once: the
+squares the opponent attacks (with the own king taken off the board, so it cannot retreat
+along a checking ray), the pieces giving check and the pinned pieces with their pin rays.
+Every pseudo-legal move is then kept or dropped with a couple of bit operations:
+
+    king            the target must not be attacked
+    double check    only the king may move
+    single check    the target must capture the checking piece or block its ray
+    pinned piece    the target must stay on the pin ray
+
+An en-passant capture removes a pawn from another square than its target, which can uncover
+a rank with two pieces on it; these captures are rare and are checked by playing them.
+
+Usage:
+    python -m package.chess_game_module.legality
+"""
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from package.chess_game_module.attack_tables import (KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, bishop_attacks,
+                                                     rook_attacks)
+from package.chess_game_module.bitboard import FULL_BOARD, Bitboards, _indexes, attacked_squares, random_positions
+from package.chess_game_module.position import KING_DIRECTIONS, PROMOTION_PIECES, Move, Position, opponent
+
+
+def _between_table() -> List[List[int]]:
+    """
+    Builds the squares strictly between every two squares on a common line.
+
+    Returns:
+    List[List[int]]: between[a][b] is the set of squares between the bit indexes a and b, 0 when
+    they are neighbours or not on a line.
+    """
+    between = [[0] * 64 for _ in range(64)]
+    for start in range(64):
+        for dx, dy in KING_DIRECTIONS:
+            x, y, ray = (start & 7) + dx, (start >> 3) + dy, 0
+            while 0 <= x < 8 and 0 <= y < 8:
+                between[start][y * 8 + x] = ray
+                ray |= 1 << (y * 8 + x)
+                x, y = x + dx, y + dy
+    return between
+
+
+BETWEEN = _between_table()
+
+
+class AttackMap:
+    """
+    Attacks, checks and pins seen by the side to move, computed once per position.
+
+    Attributes:
+    color (str): The side whose moves are filtered.
+    attacked (int): Squares attacked by the opponent, with the king of color off the board.
+    checkers (int): Squares of the opponent's pieces giving check.
+    check_mask (int): Targets that answer the check: every square when not in check, the
+    checking piece and the squares between it and the king in single check, none in double check.
+    pins (Dict[int, int]): Bit index of every pinned piece -> the squares it may still move to.
+    """
+
+    def __init__(self, position: Position, color: Optional[str] = None) -> None:
+        """
+        Args:
+        position (Position): The position.
+        color (Optional[str]): The side whose moves are filtered, the side to move by default.
+        """
+        self.position = position
+        self.color = color or position.turn
+        enemy_color = opponent(self.color)
+        boards = Bitboards(position)
+        own, enemy = boards.pieces[self.color], boards.pieces[enemy_color]
+        occupied = boards.occupied
+        self.enemy_occupancy = boards.occupancy[enemy_color]
+        self.king = own['king'].bit_length() - 1 if own['king'] else None
+
+        # With the king lifted off the board, the squares behind it on a checking ray count as attacked
+        boards.occupied = occupied & ~own['king']
+        self.attacked = attacked_squares(boards, enemy_color)
+        boards.occupied = occupied
+
+        self.checkers = 0
+        self.check_mask = FULL_BOARD
+        self.pins: Dict[int, int] = {}
+        if self.king is None:
+            return
+        king = self.king
+        straight, diagonal = enemy['rook'] | enemy['queen'], enemy['bishop'] | enemy['queen']
+        # The enemy king counts too, as in Position.is_attacked, for boards where the kings stand side by side
+        self.checkers = PAWN_ATTACKS[self.color][king] & enemy['pawn'] | KNIGHT_ATTACKS[king] & enemy['knight'] | \
+            KING_ATTACKS[king] & enemy['king'] | rook_attacks(king, occupied) & straight | \
+            bishop_attacks(king, occupied) & diagonal
+        if self.checkers:
+            if self.checkers & (self.checkers - 1):
+                self.check_mask = 0
+            else:
+                self.check_mask = self.checkers | BETWEEN[king][self.checkers.bit_length() - 1]
+
+        # Sliders that see the king through the own pieces pin it when exactly one stands in between
+        snipers = rook_attacks(king, self.enemy_occupancy) & straight | \
+            bishop_attacks(king, self.enemy_occupancy) & diagonal
+        for square in _indexes(snipers):
+            between = BETWEEN[king][square] & occupied
+            if between and not between & (between - 1):
+                self.pins[between.bit_length() - 1] = BETWEEN[king][square] | 1 << square
+
+    def filter(self, index: int, targets: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Keeps the pseudo-legal moves of a piece that do not leave its king in check.
+
+        Args:
+        index (int): Index of the piece in the piece list of color.
+        targets (List[Tuple[int, int]]): Its pseudo-legal moves, as from check_piece_move.
+
+        Returns:
+        List[Tuple[int, int]]: The legal ones, in the same order.
+        """
+        if self.king is None:
+            return []
+        pieces, locations = self.position.pieces(self.color)
+        piece, (x, y) = pieces[index], locations[index]
+        if piece == 'king':
+            attacked = self.attacked
+            return [target for target in targets if not attacked >> (target[1] * 8 + target[0]) & 1]
+        mask = self.check_mask & self.pins.get(y * 8 + x, FULL_BOARD)
+        if mask == FULL_BOARD and piece != 'pawn':
+            return list(targets)
+        legal = []
+        for target in targets:
+            bit = 1 << (target[1] * 8 + target[0])
+            if piece == 'pawn' and target[0] != x and not self.enemy_occupancy & bit:
+                if self._en_passant_is_legal(index, target):
+                    legal.append(target)
+            elif bit & mask:
+                legal.append(target)
+        return legal
+
+    def _en_passant_is_legal(self, index: int, target: Tuple[int, int]) -> bool:
+        """
+        Plays an en-passant capture to see whether it leaves the king in check.
+
+        Args:
+        index (int): Index of the capturing pawn.
+        target (Tuple[int, int]): The square it moves to.
+
+        Returns:
+        bool: True if the capture is legal.
+        """
+        undo = self.position.make_move((index, target, None))
+        legal = not self.position.in_check(self.color)
+        self.position.unmake_move(undo)
+        return legal
+
+
+def legal_moves(position: Position) -> List[Move]:
+    """
+    Calculates the legal moves of the side to move.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    List[Move]: Moves as (piece index, target square, promotion piece or None), in the order of
+    check_all_moves; a pawn reaching the last row gives one move for each promotion piece.
+    """
+    color = position.turn
+    if color != 'white' and color != 'black':
+        return []
+    attack_map = AttackMap(position)
+    pieces = position.pieces(color)[0]
+    if attack_map.check_mask == 0:
+        # In double check only the king can move
+        king = pieces.index('king')
+        all_moves = [[] for _ in pieces]
+        all_moves[king] = position.check_piece_move(king, color)
+    else:
+        all_moves = position.check_all_moves(color)
+    moves = []
+    for i, targets in enumerate(all_moves):
+        if not targets:
+            continue
+        promoting = pieces[i] == 'pawn'
+        for target in attack_map.filter(i, targets):
+            if promoting and (target[1] == 0 or target[1] == 7):
+                moves.extend((i, target, promotion) for promotion in PROMOTION_PIECES)
+            else:
+                moves.append((i, target, None))
+    return moves
+
+
+def legal_moves_by_playing(position: Position) -> List[Move]:
+    """
+    Calculates the legal moves by playing every pseudo-legal move and taking it back.
+
+    This is the straightforward method the attack map replaces, kept as a reference for
+    tests and benchmarks.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    List[Move]: The same moves as legal_moves.
+    """
+    color = position.turn
+    if color != 'white' and color != 'black':
+        return []
+    pieces = position.pieces(color)[0]
+    legal = []
+    for i, piece_moves in enumerate(position.check_all_moves(color)):
+        for target in piece_moves:
+            promotions = PROMOTION_PIECES if pieces[i] == 'pawn' and target[1] in (0, 7) else [None]
+            for promotion in promotions:
+                undo = position.make_move((i, target, promotion))
+                if not position.in_check(color):
+                    legal.append((i, target, promotion))
+                position.unmake_move(undo)
+    return legal
+
+
+def game_status(position: Position) -> str:
+    """
+    Tells whether the side to move is checkmated or stalemated.
+
+    The search stops at the first legal move found, so an ongoing game costs only a few pieces.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    str: 'checkmate', 'stalemate' or 'ongoing'.
+    """
+    color = position.turn
+    attack_map = AttackMap(position)
+    pieces = position.pieces(color)[0]
+    # The king first: it is the only piece that can move in double check
+    order = sorted(range(len(pieces)), key=lambda i: pieces[i] != 'king')
+    for i in order:
+        if attack_map.filter(i, position.check_piece_move(i, color)):
+            return 'ongoing'
+    return 'checkmate' if attack_map.checkers else 'stalemate'
+
+
+def benchmark(positions: List[Position], repeat: int = 3) -> Dict[str, float]:
+    """
+    Compares filtering with the attack map against playing every move.
+
+    Args:
+    positions (List[Position]): The positions to generate the legal moves of.
+    repeat (int): How many times every position is generated.
+
+    Returns:
+    Dict[str, float]: Positions per second for the 'attack_map' and 'playing' methods.
+    """
+    results = {}
+    for name, method in [('attack_map', legal_moves), ('playing', legal_moves_by_playing)]:
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            for position in positions:
+                method(position)
+        results[name] = len(positions) * repeat / (time.perf_counter() - begin)
+    return results
+
+
+if __name__ == '__main__':
+    result = benchmark(random_positions(int(sys.argv[1]) if len(sys.argv) > 1 else 300))
+    print(f"attack map: {result['attack_map']:9.0f} positions/s")
+    print(f"playing:    {result['playing']:9.0f} positions/s")
+    print(f"speedup:    {result['attack_map'] / result['playing']:9.2f}x")
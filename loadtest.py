@@ -0,0 +1,212 @@
+"""
+Load test of the game server.
+
+Starts a GameServer in this process and plays many games at once through it over TCP: pairs
+of clients, one playing white and one black, each pair running its share of the games with
+all of their moves of a ply sent together. The moves come from random games played
+beforehand. The test reports the time the server spent validating and playing a move (p50
+and p99), the round trip a client saw from sending a move to receiving its delta, and the
+memory an idle game holds, measured with tracemalloc on games without players.
+
+Usage:
+    python -m package.chess_game_module.loadtest --games 2000 --pairs 20 --plies 40
+"""
+import argparse
+import asyncio
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from package.chess_game_module.position import Position, move_name
+from package.chess_game_module.server import GameClient, GameServer
+
+
+def random_scripts(count: int, plies: int, seed: int = 0) -> List[List[str]]:
+    """
+    Plays random games to take the moves of the load test from.
+
+    Args:
+    count (int): Number of games.
+    plies (int): Maximal length of every game.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    List[List[str]]: The moves of every game in coordinate notation.
+    """
+    rng = random.Random(seed)
+    scripts = []
+    for _ in range(count):
+        position, script = Position(), []
+        for _ in range(plies):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            i, target, promotion = rng.choice(moves)
+            script.append(move_name(position.pieces(position.turn)[1][i], target, promotion))
+            position.make_move((i, target, promotion))
+        scripts.append(script)
+    return scripts
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Args:
+    values (List[float]): The values, in any order.
+    fraction (float): Which percentile, 0.5 for the median.
+
+    Returns:
+    float: The value below which the fraction of the values lies, 0.0 without values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def idle_game_memory(games: int = 10000) -> float:
+    """
+    Measures the memory held by games that were created and never played.
+
+    Args:
+    games (int): Number of games to create.
+
+    Returns:
+    float: Bytes per game.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    server = GameServer()
+    for _ in range(games):
+        server.create_game()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / games
+
+
+async def _expect(client: GameClient, kind: str) -> List[str]:
+    """
+    Reads the next line of a client and checks its kind.
+
+    Raises:
+    RuntimeError: If the server sent something else, an error for example.
+    """
+    words = await client.receive()
+    if not words or words[0] != kind:
+        raise RuntimeError(f"expected {kind}, got {' '.join(words) or 'end of connection'}")
+    return words
+
+
+async def _play_pair(port: int, scripts: List[List[str]], round_trips: List[float]) -> int:
+    """
+    Plays games through one pair of clients, all of them in step.
+
+    Args:
+    port (int): Port of the server.
+    scripts (List[List[str]]): The moves of every game of the pair.
+    round_trips (List[float]): Seconds from sending a move to receiving its delta are appended here.
+
+    Returns:
+    int: The number of moves played.
+    """
+    white = await GameClient.connect('127.0.0.1', port)
+    black = await GameClient.connect('127.0.0.1', port)
+    for _ in scripts:
+        white.send('NEW white')
+    game_ids = []
+    for _ in scripts:
+        game_ids.append((await _expect(white, 'GAME'))[1])
+        await _expect(white, 'STATE')
+    for game_id in game_ids:
+        black.send(f'JOIN {game_id} black')
+    for _ in game_ids:
+        await _expect(black, 'GAME')
+        await _expect(black, 'STATE')
+        await _expect(white, 'JOINED')
+
+    moves = 0
+    for ply in range(max(map(len, scripts), default=0)):
+        mover, other = (white, black) if ply % 2 == 0 else (black, white)
+        playing = [game_id for game_id, script in zip(game_ids, scripts) if ply < len(script)]
+        begin = time.perf_counter()
+        for game_id, script in zip(game_ids, scripts):
+            if ply < len(script):
+                mover.send(f'MOVE {game_id} {script[ply]}')
+        for _ in playing:
+            await _expect(mover, 'MOVED')
+            round_trips.append(time.perf_counter() - begin)
+        for _ in playing:
+            await _expect(other, 'MOVED')
+        moves += len(playing)
+    await white.close()
+    await black.close()
+    return moves
+
+
+async def run_load(games: int, pairs: int, plies: int, seed: int = 0) -> Dict[str, float]:
+    """
+    Plays games through a server started in this process.
+
+    Args:
+    games (int): Number of games played at the same time.
+    pairs (int): Number of client pairs the games are spread over.
+    plies (int): Maximal length of every game.
+    seed (int): Seed of the random games the moves are taken from.
+
+    Returns:
+    Dict[str, float]: 'games', 'moves', 'seconds', 'moves_per_second', the 'validation_p50' and
+    'validation_p99' and the 'round_trip_p50' and 'round_trip_p99', in seconds.
+    """
+    scripts = random_scripts(min(games, 200), plies, seed)
+    server = GameServer()
+    server.validation_times = []
+    listener = await server.serve('127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    round_trips: List[float] = []
+    begin = time.perf_counter()
+    async with listener:
+        played = await asyncio.gather(*(
+            _play_pair(port, [scripts[game % len(scripts)] for game in range(pair, games, pairs)], round_trips)
+            for pair in range(pairs)))
+    seconds = time.perf_counter() - begin
+    return {'games': float(games), 'moves': float(sum(played)), 'seconds': seconds,
+            'moves_per_second': sum(played) / seconds,
+            'validation_p50': percentile(server.validation_times, 0.5),
+            'validation_p99': percentile(server.validation_times, 0.99),
+            'round_trip_p50': percentile(round_trips, 0.5), 'round_trip_p99': percentile(round_trips, 0.99)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Load test the game server.')
+    parser.add_argument('--games', type=int, default=2000, help='games played at the same time')
+    parser.add_argument('--pairs', type=int, default=20, help='client pairs the games are spread over')
+    parser.add_argument('--plies', type=int, default=40, help='maximal length of every game')
+    parser.add_argument('--idle-games', type=int, default=10000, help='games created to measure memory')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random games')
+    args = parser.parse_args(argv)
+    if not 0 < args.pairs <= args.games:
+        parser.error('--pairs must be between 1 and --games')
+
+    print(f'idle game: {idle_game_memory(args.idle_games):.0f} bytes')
+    result = asyncio.run(run_load(args.games, args.pairs, args.plies, args.seed))
+    print(f"{result['games']:.0f} games, {result['moves']:.0f} moves in {result['seconds']:.2f}s: "
+          f"{result['moves_per_second']:.0f} moves/s")
+    print(f"move validation: p50 {result['validation_p50'] * 1e6:.0f} us, p99 {result['validation_p99'] * 1e6:.0f} us")
+    print(f"round trip:      p50 {result['round_trip_p50'] * 1e3:.1f} ms, p99 {result['round_trip_p99'] * 1e3:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
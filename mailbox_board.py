@@ -0,0 +1,223 @@
+"""
+Compact array-backed boards for keeping many positions in memory.
+
+A Position is built for playing: parallel lists of piece types and locations, cached valid
+moves and a Zobrist key, about 1.6 kB per position. For analysis that keeps positions around
+by the million this is far too much, and asking what stands on a square means searching the
+location lists. A Mailbox holds the same position as 64 one-byte piece codes in a bytearray,
+indexed y * 8 + x like the bitboards, so the piece on a square is a single array read; and
+PositionStore packs positions into one bytearray at PACKED_SIZE bytes each, two squares per
+byte, with no Python object per position at all until one is read back.
+
+Piece codes are those of Position.board (see position.PIECE_CODES): 0 for an empty square,
+1 + zobrist.PIECE_INDEX[piece] for a white piece and 9 + PIECE_INDEX[piece] for a black one,
+so bit 3 tells the color and every code fits 4 bits.
+
+Packed layout (PACKED_SIZE bytes):
+    32 bytes  squares, square 2 * i in the low and square 2 * i + 1 in the high 4 bits of byte i
+    1 byte    bit 0 black to move, bits 1-4 castling rights as in zobrist.castling_rights
+    1 byte    en-passant column + 1, 0 when no pawn can be taken en passant
+
+Usage:
+    python -m package.chess_game_module.mailbox_board 100000
+"""
+import sys
+import time
+import tracemalloc
+from typing import Iterator, List, Optional, Tuple, Union
+
+from package.chess_game_module.fen import LETTERS, from_fen
+# The piece codes are those of Position.board and are re-exported from here
+from package.chess_game_module.position import BLACK, CODE_PIECES, PIECE_CODES, Position, square_name
+from package.chess_game_module.zobrist import PIECE_INDEX, castling_rights, en_passant_column
+
+PIECE_TYPES = sorted(PIECE_INDEX, key=PIECE_INDEX.get)
+PACKED_SIZE = 34
+
+
+class Mailbox:
+    """
+    A position as an array of 64 piece codes.
+
+    Attributes:
+    squares (bytearray): Piece code of every square, indexed y * 8 + x.
+    black_to_move (bool): Whether black is to move.
+    castling (int): Castling rights, bit 0 white short, bit 1 white long, bit 2 black short, bit 3 black long.
+    en_passant (Optional[int]): Column of a pawn that can be taken en passant.
+    """
+    __slots__ = ('squares', 'black_to_move', 'castling', 'en_passant')
+
+    def __init__(self, squares: Optional[bytearray] = None, black_to_move: bool = False, castling: int = 0,
+                 en_passant: Optional[int] = None) -> None:
+        self.squares = squares if squares is not None else bytearray(64)
+        self.black_to_move = black_to_move
+        self.castling = castling
+        self.en_passant = en_passant
+
+    @classmethod
+    def from_position(cls, position: Position) -> 'Mailbox':
+        """
+        Args:
+        position (Position): The position. After a king capture the loser is to move, as in to_fen.
+
+        Returns:
+        Mailbox: The same position as a mailbox.
+        """
+        return cls(position.board[:], position.turn == 'black' or position.turn == 'white_won',
+                   castling_rights(position), en_passant_column(position))
+
+    def to_position(self) -> Position:
+        """
+        Returns:
+        Position: A new position with the pieces, side to move, castling rights and en-passant
+        state of the mailbox. Pieces are listed row by row from the top, as from_fen does.
+        """
+        return from_fen(self.fen())
+
+    def piece_at(self, square: Tuple[int, int]) -> Optional[Tuple[str, str]]:
+        """
+        Args:
+        square (Tuple[int, int]): The square as (x, y).
+
+        Returns:
+        Optional[Tuple[str, str]]: The color and type of the piece on the square, None when it is empty.
+        """
+        return CODE_PIECES[self.squares[square[1] * 8 + square[0]]]
+
+    def pieces(self) -> Iterator[Tuple[Tuple[int, int], Tuple[str, str]]]:
+        """
+        Returns:
+        Iterator[Tuple[Tuple[int, int], Tuple[str, str]]]: Every occupied square as (x, y) with the
+        color and type of its piece, row by row from the top.
+        """
+        squares = self.squares
+        for index in range(64):
+            if squares[index]:
+                yield (index & 7, index >> 3), CODE_PIECES[squares[index]]
+
+    def fen(self) -> str:
+        """
+        Returns:
+        str: The position in Forsyth-Edwards Notation, as fen.to_fen writes it.
+        """
+        ranks = []
+        for y in range(8):
+            rank, empty = '', 0
+            # Files go from 'a' (x = 7) to 'h' (x = 0)
+            for x in range(7, -1, -1):
+                piece = CODE_PIECES[self.squares[y * 8 + x]]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank, empty = rank + str(empty), 0
+                rank += LETTERS[piece[1]].upper() if piece[0] == 'white' else LETTERS[piece[1]]
+            ranks.append(rank + (str(empty) if empty else ''))
+        castling = ''.join(letter for bit, letter in enumerate('KQkq') if self.castling >> bit & 1) or '-'
+        en_passant = '-' if self.en_passant is None else square_name((self.en_passant, 5 if self.black_to_move else 2))
+        return f"{'/'.join(ranks)} {'b' if self.black_to_move else 'w'} {castling} {en_passant} 0 1"
+
+    def pack(self) -> bytes:
+        """
+        Returns:
+        bytes: The mailbox in PACKED_SIZE bytes, see the module documentation.
+        """
+        squares = self.squares
+        return bytes(squares[i] | squares[i + 1] << 4 for i in range(0, 64, 2)) + \
+            bytes((self.black_to_move | self.castling << 1, 0 if self.en_passant is None else self.en_passant + 1))
+
+    @classmethod
+    def unpack(cls, data: Union[bytes, bytearray, memoryview]) -> 'Mailbox':
+        """
+        Args:
+        data (Union[bytes, bytearray, memoryview]): A mailbox packed by pack.
+
+        Returns:
+        Mailbox: The unpacked mailbox.
+        """
+        squares = bytearray(64)
+        squares[0::2] = bytes(byte & 15 for byte in data[:32])
+        squares[1::2] = bytes(byte >> 4 for byte in data[:32])
+        flags, en_passant = data[32], data[33]
+        return cls(squares, bool(flags & 1), flags >> 1 & 15, en_passant - 1 if en_passant else None)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Mailbox) and self.squares == other.squares and \
+            (self.black_to_move, self.castling, self.en_passant) == \
+            (other.black_to_move, other.castling, other.en_passant)
+
+
+class PositionStore:
+    """
+    Positions packed one after another in a single bytearray, PACKED_SIZE bytes each.
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def append(self, position: Union[Position, Mailbox]) -> int:
+        """
+        Args:
+        position (Union[Position, Mailbox]): The position to keep.
+
+        Returns:
+        int: Its number in the store.
+        """
+        if isinstance(position, Position):
+            position = Mailbox.from_position(position)
+        self.data += position.pack()
+        return len(self) - 1
+
+    def __len__(self) -> int:
+        return len(self.data) // PACKED_SIZE
+
+    def __getitem__(self, index: int) -> Mailbox:
+        if not -len(self) <= index < len(self):
+            raise IndexError('position index out of range')
+        offset = index % len(self) * PACKED_SIZE
+        return Mailbox.unpack(memoryview(self.data)[offset:offset + PACKED_SIZE])
+
+
+def measure_memory(positions: List[Position]) -> dict:
+    """
+    Compares the memory taken by the same positions as Position objects, mailboxes and a store.
+
+    The positions are copied, so the numbers do not depend on what the given ones have cached.
+
+    Args:
+    positions (List[Position]): The positions.
+
+    Returns:
+    dict: Bytes per position for 'position', 'mailbox' and 'store', and the microseconds
+    'pack_us' and 'unpack_us' taken to store and read back one position.
+    """
+    results = {}
+    for name, build in [('position', lambda: [position.copy() for position in positions]),
+                        ('mailbox', lambda: [Mailbox.from_position(position) for position in positions])]:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        results[name] = (tracemalloc.get_traced_memory()[0] - before) / len(positions)
+        tracemalloc.stop()
+        del kept
+
+    store = PositionStore()
+    begin = time.perf_counter()
+    for position in positions:
+        store.append(position)
+    results['pack_us'] = (time.perf_counter() - begin) / len(positions) * 1e6
+    results['store'] = len(store.data) / len(store)
+    begin = time.perf_counter()
+    for index in range(len(store)):
+        store[index]
+    results['unpack_us'] = (time.perf_counter() - begin) / len(store) * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    from package.chess_game_module.bitboard import random_positions
+
+    result = measure_memory(random_positions(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
+    print(f"Position {result['position']:7.0f} bytes, Mailbox {result['mailbox']:5.0f} bytes, "
+          f"PositionStore {result['store']:3.0f} bytes per position")
+    print(f"store {result['pack_us']:.1f} us, read back {result['unpack_us']:.1f} us per position")
@@ -0,0 +1,308 @@
+"""
+Parallel search over several cores.
+
+A ParallelSearch keeps worker processes, each with its own Engine, that all search the same
+root position at the same time (lazy SMP). What one worker learns reaches the others through
+the transposition table, which lives in shared memory (multiprocessing.shared_memory) instead
+of in every engine: a SharedTable packs each entry into two 64-bit words and is read and
+written through the same indexing as the engine's own list. Worker 0 searches exactly like a
+single engine and its result is the one returned; the helpers start the root moves after the
+table move at different places in the list, so they fill the table with the other root moves
+while worker 0 is still busy with the first ones. Once worker 0 is done the helpers are
+stopped.
+
+Entries are written without locks. The key is stored XORed with the data word, so an entry
+whose two words come from different writes no longer matches the key of its position and is
+ignored like an entry of another position.
+
+With one worker nothing else writes the table, so a search to a fixed depth on a cleared
+table gives the same move, score, line and node count every time.
+
+Usage:
+    python -m package.chess_game_module.parallel --depth 5 --workers 8
+    python -m package.chess_game_module.parallel --depth 5 --scaling 1 2 4 8 16
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional
+
+from package.chess_game_module.engine import Engine
+from package.chess_game_module.position import Move, Position
+
+SLOT_WORDS = 2  # key XOR data, data
+PROMOTIONS = [None, 'queen', 'rook', 'bishop', 'knight']
+SCORE_OFFSET = 1 << 23
+VALID = 1 << 63
+# Seconds a search to a fixed depth may take, so only the depth ends it
+UNLIMITED_TIME = 1e9
+
+
+class SharedTable:
+    """
+    Transposition table slots in a shared buffer, read and written like a list of entries.
+
+    An entry is the engine's (key, depth, score, flag, (start, target, promotion), age) tuple.
+    Its data word holds, from the lowest bit: depth (8 bits), score + SCORE_OFFSET (24), flag (2),
+    start and target square (6 each, y * 8 + x), promotion (3, index in PROMOTIONS), age (8)
+    and VALID, so an empty slot is zero.
+    """
+
+    def __init__(self, buffer: memoryview) -> None:
+        """
+        Args:
+        buffer (memoryview): Memory of the slots, 16 bytes each, zero for empty slots.
+        """
+        self.buffer = buffer
+        self.words = buffer.cast('Q')
+
+    def __len__(self) -> int:
+        return len(self.words) // SLOT_WORDS
+
+    def __getitem__(self, index: int) -> Optional[tuple]:
+        data = self.words[index * SLOT_WORDS + 1]
+        if not data:
+            return None
+        key = self.words[index * SLOT_WORDS] ^ data
+        start, target = (data >> 34) & 63, (data >> 40) & 63
+        return (key, data & 0xFF, ((data >> 8) & 0xFFFFFF) - SCORE_OFFSET, (data >> 32) & 3,
+                ((start & 7, start >> 3), (target & 7, target >> 3), PROMOTIONS[(data >> 46) & 7]),
+                (data >> 49) & 0xFF)
+
+    def __setitem__(self, index: int, entry: tuple) -> None:
+        key, depth, score, flag, (start, target, promotion), age = entry
+        data = (VALID | min(depth, 0xFF) | (score + SCORE_OFFSET) << 8 | flag << 32 | (start[1] * 8 + start[0]) << 34
+                | (target[1] * 8 + target[0]) << 40 | PROMOTIONS.index(promotion) << 46 | age << 49)
+        self.words[index * SLOT_WORDS] = key ^ data
+        self.words[index * SLOT_WORDS + 1] = data
+
+    def clear(self) -> None:
+        """
+        Empties every slot.
+        """
+        self.buffer[:] = bytes(len(self.buffer))
+
+    def release(self) -> None:
+        """
+        Lets go of the buffer, which has to happen before the shared memory is closed.
+        """
+        self.words.release()
+
+
+class HelperEngine(Engine):
+    """
+    Engine of a helper worker: searches the root moves after the table move starting at another place.
+    """
+
+    def __init__(self, rotation: int) -> None:
+        """
+        Args:
+        rotation (int): How many root moves to skip before starting, then wrapping around.
+        """
+        super().__init__(1)
+        self.rotation = rotation
+
+    def _ordered_moves(self, position: Position, table_move: Optional[tuple], ply: int,
+                       captures_only: bool) -> List[Move]:
+        moves = super()._ordered_moves(position, table_move, ply, captures_only)
+        if ply == 0 and len(moves) > 2:
+            shift = self.rotation % (len(moves) - 1)
+            moves[1:] = moves[1 + shift:] + moves[1:1 + shift]
+        return moves
+
+
+def _search_worker(index: int, memory_name: str, requests: multiprocessing.Queue, results: multiprocessing.Queue,
+                   latest) -> None:
+    """
+    Worker process: searches the requested positions with the shared table until it receives None.
+
+    Args:
+    index (int): Number of the worker, 0 for the one whose result counts.
+    memory_name (str): Name of the shared memory holding the table.
+    requests (multiprocessing.Queue): (generation, position, time_limit, max_depth, history) tuples.
+    results (multiprocessing.Queue): (generation, index, result) tuples are put here.
+    latest: Shared integer with the generation being searched; any other value stops the search.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    table = SharedTable(memory.buf)
+    engine = Engine(1) if index == 0 else HelperEngine(index)
+    engine.table, engine.table_mask = table, len(table) - 1
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            generation, position, time_limit, max_depth, history = request
+            result = engine.search(position, time_limit, max_depth, history,
+                                   stop=lambda: latest.value != generation)
+            results.put((generation, index, result))
+    finally:
+        engine.table = None
+        table.release()
+        memory.close()
+
+
+class ParallelSearch:
+    """
+    Worker processes searching one position together through a shared transposition table.
+    """
+
+    def __init__(self, workers: Optional[int] = None, table_size: int = 1 << 18) -> None:
+        """
+        Creates the shared table and starts the workers.
+
+        Args:
+        workers (Optional[int]): Number of worker processes, the number of cores by default.
+        table_size (int): Number of transposition table slots, rounded down to a power of two.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        size = 1 << (table_size.bit_length() - 1)
+        self.memory = shared_memory.SharedMemory(create=True, size=size * SLOT_WORDS * 8)
+        self.table = SharedTable(self.memory.buf)
+        self.table.clear()
+        context = multiprocessing.get_context('spawn')
+        self.latest = context.Value('q', 0, lock=False)
+        self.generation = 0
+        self.results = context.Queue()
+        self.requests = [context.Queue() for _ in range(self.workers)]
+        self.processes = [context.Process(target=_search_worker, daemon=True,
+                                          args=(index, self.memory.name, requests, self.results, self.latest))
+                          for index, requests in enumerate(self.requests)]
+        for process in self.processes:
+            process.start()
+
+    def search(self, position: Position, time_limit: float = 1.0, max_depth: int = 64,
+               history: Optional[List[int]] = None) -> Dict[str, object]:
+        """
+        Finds the best move of the side to move with all workers, like Engine.search.
+
+        Args:
+        position (Position): The position to search, not changed.
+        time_limit (float): Seconds the search may take; depth 1 is always finished.
+        max_depth (int): Deepest iteration to search.
+        history (Optional[List[int]]): Zobrist keys of the earlier positions of the game.
+
+        Returns:
+        Dict[str, object]: The result of worker 0 ('move', 'score', 'depth', 'line'), with 'nodes'
+        of all workers together, 'seconds' until every worker stopped, 'nodes_per_second' and
+        'workers'. 'depth_seconds' is the time worker 0 took to reach its depth.
+        """
+        self.generation += 1
+        self.latest.value = self.generation
+        request = (self.generation, position.copy(), time_limit, max_depth, list(history or []))
+        begin = time.perf_counter()
+        for requests in self.requests:
+            requests.put(request)
+        result, nodes, finished = None, 0, 0
+        while finished < self.workers:
+            generation, index, worker_result = self.results.get()
+            if generation != self.generation:
+                continue
+            finished += 1
+            nodes += worker_result['nodes']
+            if index == 0:
+                # The answer is known, the helpers only have to stop
+                result = worker_result
+                self.latest.value = 0
+        seconds = time.perf_counter() - begin
+        return dict(result, nodes=nodes, seconds=seconds, nodes_per_second=nodes / seconds if seconds else 0.0,
+                    workers=self.workers, depth_seconds=result['seconds'])
+
+    def clear(self) -> None:
+        """
+        Forgets everything stored in the shared table.
+        """
+        self.table.clear()
+
+    def close(self) -> None:
+        """
+        Stops the workers and frees the shared table.
+        """
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.table.release()
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self) -> 'ParallelSearch':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def measure_scaling(position: Position, depth: int, worker_counts: Iterable[int],
+                    table_size: int = 1 << 18) -> List[Dict[str, float]]:
+    """
+    Searches one position to a fixed depth with different numbers of workers, on a cleared table.
+
+    Args:
+    position (Position): The position.
+    depth (int): Depth every search goes to.
+    worker_counts (Iterable[int]): Numbers of workers to compare, the first one is the baseline.
+    table_size (int): Number of transposition table slots.
+
+    Returns:
+    List[Dict[str, float]]: Per worker count the 'workers', 'seconds' to reach the depth,
+    'nodes', 'nodes_per_second', and the 'time_speedup' and 'nps_speedup' over the first count.
+    """
+    results = []
+    for workers in worker_counts:
+        with ParallelSearch(workers, table_size) as search:
+            # The first search waits for the workers to import, it is not measured
+            search.search(position, max_depth=1)
+            search.clear()
+            result = search.search(position, UNLIMITED_TIME, depth)
+        results.append({'workers': float(workers), 'seconds': result['depth_seconds'],
+                        'nodes': float(result['nodes']), 'nodes_per_second': result['nodes_per_second']})
+    for result in results:
+        result['time_speedup'] = results[0]['seconds'] / result['seconds']
+        result['nps_speedup'] = result['nodes_per_second'] / results[0]['nodes_per_second']
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    from package.chess_game_module.fen import STARTING_FEN, from_fen
+
+    parser = argparse.ArgumentParser(description='Search a position with several worker processes.')
+    parser.add_argument('--fen', default=STARTING_FEN, help='position in Forsyth-Edwards Notation')
+    parser.add_argument('--depth', type=int, default=5, help='depth to search to')
+    parser.add_argument('--workers', type=int, default=None, help='processes, the number of cores by default')
+    parser.add_argument('--scaling', type=int, nargs='*', default=None,
+                        help='compare these numbers of workers, 1 2 4 8 16 when none are given')
+    args = parser.parse_args(argv)
+
+    position = from_fen(args.fen)
+    if args.scaling is not None:
+        print(f'{os.cpu_count()} cores')
+        for result in measure_scaling(position, args.depth, args.scaling or [1, 2, 4, 8, 16]):
+            print(f"{result['workers']:3.0f} workers  depth {args.depth} in {result['seconds']:7.2f}s  "
+                  f"{result['nodes_per_second']:8.0f} nodes/s  time-to-depth x{result['time_speedup']:.2f}  "
+                  f"nodes/s x{result['nps_speedup']:.2f}")
+        return 0
+
+    with ParallelSearch(args.workers) as search:
+        result = search.search(position, UNLIMITED_TIME, args.depth)
+    print(f"{result['workers']} workers  score {result['score']}  depth {result['depth']}  nodes {result['nodes']}  "
+          f"{result['nodes_per_second']:.0f} nodes/s  line {' '.join(result['line'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Perft: move generation test and benchmark.
+
+perft(n) counts the leaf nodes of the tree of legal moves n plies deep. The counts for a
+set of standard test positions are published, so any difference points to a bug in the
+move rules (castling, en-passant, promotion, pins), and the time the count takes gives a
+single throughput number to track between versions.
+
+Usage:
+    python -m package.chess_game_module.perft --depth 3
+    python -m package.chess_game_module.perft --position kiwipete --depth 2 --divide
+    python -m package.chess_game_module.perft --fen "8/8/8/8/8/8/8/K6k w - - 0 1" --depth 4
+    python -m package.chess_game_module.perft --suite --depth 2 --backend bitboard
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Optional
+
+from package.chess_game_module.fen import STARTING_FEN, from_fen
+from package.chess_game_module.position import Position, move_name
+
+# name: (FEN, published node counts for depth 1, 2, 3, ...)
+REFERENCE_POSITIONS = {
+    'start': (STARTING_FEN, [20, 400, 8902, 197281, 4865609, 119060324]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 [48, 2039, 97862, 4085603, 193690690]),
+    'endgame': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                [14, 191, 2812, 43238, 674624, 11030083]),
+    'promotion': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333, 15833292]),
+    'talkchess': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                  [44, 1486, 62379, 2103487, 89941194]),
+    'middlegame': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                   [46, 2079, 89890, 3894594, 164075551]),
+}
+
+
+def perft(position: Position, depth: int) -> int:
+    """
+    Counts the leaf nodes of the legal move tree of the given depth.
+
+    Args:
+    position (Position): The root position.
+    depth (int): Number of plies to look ahead.
+
+    Returns:
+    int: The number of leaf nodes.
+    """
+    if depth == 0:
+        return 1
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        undo = position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move(undo)
+    return nodes
+
+
+def divide(position: Position, depth: int) -> Dict[str, int]:
+    """
+    Counts the leaf nodes separately below every legal root move.
+
+    Comparing this breakdown with another move generator shows which root move
+    contains the bug when the totals differ.
+
+    Args:
+    position (Position): The root position.
+    depth (int): Number of plies to look ahead, at least 1.
+
+    Returns:
+    Dict[str, int]: Node counts keyed by the root move in coordinate notation, e.g. 'e2e4'.
+    """
+    counts = {}
+    for move in position.legal_moves():
+        i, target, promotion = move
+        start = position.pieces(position.turn)[1][i]
+        undo = position.make_move(move)
+        counts[move_name(start, target, promotion)] = perft(position, depth - 1)
+        position.unmake_move(undo)
+    return counts
+
+
+def run(fen: str, depth: int, backend: str = 'lists', show_divide: bool = False,
+        expected: Optional[int] = None) -> Dict[str, object]:
+    """
+    Runs perft on one position and measures its speed.
+
+    Args:
+    fen (str): The root position in Forsyth-Edwards Notation.
+    depth (int): Number of plies to look ahead.
+    backend (str): Move generator to use, 'lists' or 'bitboard'.
+    show_divide (bool): Whether to count every root move separately.
+    expected (Optional[int]): The published node count, if known.
+
+    Returns:
+    Dict[str, object]: 'nodes', 'seconds', 'nodes_per_second', 'expected', 'correct'
+    and, when requested, 'divide' with the per root move counts.
+    """
+    position = from_fen(fen)
+    position.backend = backend
+
+    begin = time.perf_counter()
+    if show_divide:
+        counts = divide(position, depth)
+        nodes = sum(counts.values())
+    else:
+        counts = None
+        nodes = perft(position, depth)
+    seconds = time.perf_counter() - begin
+
+    result = {'nodes': nodes, 'seconds': seconds, 'nodes_per_second': nodes / seconds if seconds else 0.0,
+              'expected': expected, 'correct': expected is None or nodes == expected}
+    if counts is not None:
+        result['divide'] = counts
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point. Prints the results and returns a non-zero exit code
+    when any node count differs from the published one.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Count leaf nodes of the legal move tree.')
+    parser.add_argument('--depth', type=int, default=3, help='number of plies to look ahead')
+    parser.add_argument('--position', choices=sorted(REFERENCE_POSITIONS), default='start',
+                        help='one of the standard test positions')
+    parser.add_argument('--fen', help='any other position in Forsyth-Edwards Notation')
+    parser.add_argument('--suite', action='store_true', help='run all standard test positions')
+    parser.add_argument('--divide', action='store_true', help='show node counts of every root move')
+    parser.add_argument('--backend', choices=['lists', 'bitboard'], default='lists', help='move generator')
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [('fen', args.fen, None)]
+    else:
+        names = sorted(REFERENCE_POSITIONS) if args.suite else [args.position]
+        jobs = []
+        for name in names:
+            fen, counts = REFERENCE_POSITIONS[name]
+            jobs.append((name, fen, counts[args.depth - 1] if args.depth <= len(counts) else None))
+
+    all_correct = True
+    total_nodes, total_seconds = 0, 0.0
+    for name, fen, expected in jobs:
+        result = run(fen, args.depth, args.backend, args.divide, expected)
+        for move, nodes in sorted(result.get('divide', {}).items()):
+            print(f'  {move}: {nodes}')
+        status = 'unknown' if expected is None else ('OK' if result['correct'] else f'FAILED, expected {expected}')
+        print(f"{name:<12} depth {args.depth}  nodes {result['nodes']:>10}  time {result['seconds']:8.2f} s  "
+              f"{result['nodes_per_second']:10.0f} nodes/s  {status}")
+        all_correct = all_correct and result['correct']
+        total_nodes += result['nodes']
+        total_seconds += result['seconds']
+
+    if len(jobs) > 1:
+        print(f'total        depth {args.depth}  nodes {total_nodes:>10}  time {total_seconds:8.2f} s  '
+              f'{total_nodes / total_seconds if total_seconds else 0:10.0f} nodes/s')
+    return 0 if all_correct else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Portable Game Notation (PGN) reader and replayer.
+
+read_games streams a PGN file one game at a time, so an archive of any size is read with
+constant memory: only the tags and moves of the current game are kept. replay_game plays
+the moves of a game through the move rules and reports the first move our move generator
+does not accept: a move that matches no legal move, one that matches several, or a check
+or mate marker the rules disagree with. check_archive does this for a whole archive,
+optionally over a process pool.
+
+Usage:
+    python -m package.chess_game_module.pgn games.pgn
+    python -m package.chess_game_module.pgn games.pgn --workers 4 --limit 100000
+"""
+import argparse
+import functools
+import itertools
+import multiprocessing
+import re
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+from package.chess_game_module.fen import from_fen, to_fen
+from package.chess_game_module.position import Move, Position, parse_square
+
+RESULTS = {'1-0', '0-1', '1/2-1/2', '*'}
+SAN_PIECES = {'N': 'knight', 'B': 'bishop', 'R': 'rook', 'Q': 'queen', 'K': 'king'}
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# Movetext tokens: comments, variations, annotation glyphs, move numbers, results and moves
+TOKEN_PATTERN = re.compile(r'\{|;|\(|\)|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{};()$.]+')
+SAN_PATTERN = re.compile(r'([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?')
+BATCH_SIZE = 256  # games handed to the pool at a time, which bounds the memory of a parallel run
+
+
+class MoveError(ValueError):
+    """
+    Raised when a move in Standard Algebraic Notation cannot be played.
+
+    The kind is 'unparsable', 'illegal' (no legal move matches) or 'ambiguous' (more than one does).
+    """
+
+    def __init__(self, kind: str, san: str) -> None:
+        super().__init__(f'{kind} move {san!r}')
+        self.kind = kind
+        self.san = san
+
+
+def read_games(path: str) -> Iterator[Dict[str, object]]:
+    """
+    Reads the games of a PGN file one at a time.
+
+    Comments, variations, annotation glyphs and move numbers are skipped.
+
+    Args:
+    path (str): Path of the file.
+
+    Returns:
+    Iterator[Dict[str, object]]: For every game its 'index' in the file, the 'line' it
+    starts on, its 'headers' (tag name to value), its 'moves' in Standard Algebraic
+    Notation and the 'result' written after the moves.
+    """
+    index = 0
+    game = None
+    in_comment = False
+    depth = 0  # nesting depth of variations
+    with open(path, buffering=1 << 20, encoding='utf-8', errors='replace') as file:
+        for number, line in enumerate(file, 1):
+            position = 0
+            if in_comment:
+                position = line.find('}')
+                if position < 0:
+                    continue
+                in_comment = False
+                position += 1
+            elif line.startswith('%'):
+                continue
+            elif line.startswith('[') and depth == 0:
+                tag = TAG_PATTERN.match(line)
+                if tag:
+                    # Tags after moves begin the next game, even when the result token is missing
+                    if game is not None and game['moves']:
+                        yield game
+                        index += 1
+                        game = None
+                    if game is None:
+                        game = {'index': index, 'line': number, 'headers': {}, 'moves': [], 'result': '*'}
+                    game['headers'][tag.group(1)] = tag.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                    continue
+
+            while True:
+                token = TOKEN_PATTERN.search(line, position)
+                if token is None:
+                    break
+                text, position = token.group(), token.end()
+                if text == '{':
+                    end = line.find('}', position)
+                    if end < 0:
+                        in_comment = True
+                        break
+                    position = end + 1
+                elif text == ';':
+                    break
+                elif text == '(':
+                    depth += 1
+                elif text == ')':
+                    depth = max(0, depth - 1)
+                elif depth or text[0] == '$' or text[0].isdigit() and text.endswith('.'):
+                    continue
+                elif text in RESULTS:
+                    if game is not None:
+                        game['result'] = text
+                        yield game
+                        index += 1
+                    game = None
+                else:
+                    if game is None:
+                        game = {'index': index, 'line': number, 'headers': {}, 'moves': [], 'result': '*'}
+                    game['moves'].append(text)
+        if game is not None and game['moves']:
+            yield game
+
+
+def parse_san(position: Position, san: str) -> Move:
+    """
+    Finds the legal move written in Standard Algebraic Notation.
+
+    Only the pieces of the named type are asked for their moves, and only the moves that
+    match are tested for leaving the king in check.
+
+    Args:
+    position (Position): The position the move is played in.
+    san (str): The move, for example 'e4', 'Nbd7', 'exd8=Q+' or 'O-O'.
+
+    Returns:
+    Move: The matching move.
+
+    Raises:
+    MoveError: If the text is not a move, or does not match exactly one legal move.
+    """
+    color = position.turn
+    pieces, locations = position.pieces(color)
+    text = san.rstrip('+#!?')
+    row = 7 if color == 'white' else 0
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        # The king goes two squares towards the rook: x 3 -> 1 on the short side, 3 -> 5 on the long side
+        piece, target, promotion = 'king', (1 if len(text) == 3 else 5, row), None
+        start_x, start_y, capture = 3, row, None
+    else:
+        match = SAN_PATTERN.fullmatch(text)
+        if match is None:
+            raise MoveError('unparsable', san)
+        letter, start_file, start_rank, capture, square, promotion_letter = match.groups()
+        piece = SAN_PIECES[letter] if letter else 'pawn'
+        target = parse_square(square)
+        promotion = SAN_PIECES[promotion_letter] if promotion_letter else None
+        start_x = parse_square(start_file + '1')[0] if start_file else None
+        start_y = parse_square('a' + start_rank)[1] if start_rank else None
+        if piece == 'pawn':
+            # A pawn capture names the file it comes from, any other pawn move stays on its file
+            if capture and start_file is None:
+                raise MoveError('unparsable', san)
+            if not capture:
+                start_x = target[0]
+        if (promotion is not None) != (piece == 'pawn' and target[1] == 7 - row):
+            raise MoveError('illegal', san)
+
+    matches = []
+    for i, (kind, (x, y)) in enumerate(zip(pieces, locations)):
+        if kind != piece or start_x is not None and x != start_x or start_y is not None and y != start_y:
+            continue
+        # The 'x' has to agree with the move, a pawn changing file captures even on an empty square
+        if bool(capture) != bool(position.board[target[1] * 8 + target[0]] or kind == 'pawn' and x != target[0]):
+            continue
+        if target in position.check_piece_move(i, color):
+            move = (i, target, promotion)
+            undo = position.make_move(move)
+            legal = not position.in_check(color)
+            position.unmake_move(undo)
+            if legal:
+                matches.append(move)
+    if not matches:
+        raise MoveError('illegal', san)
+    if len(matches) > 1:
+        raise MoveError('ambiguous', san)
+    return matches[0]
+
+
+def replay_game(game: Dict[str, object], check_markers: bool = True) -> Dict[str, object]:
+    """
+    Plays the moves of a game and reports the first one the rules disagree with.
+
+    Args:
+    game (Dict[str, object]): A game as returned by read_games.
+    check_markers (bool): Whether '+' and '#' after a move have to agree with the rules,
+    which catches errors in the attack detection; off for files written without them.
+
+    Returns:
+    Dict[str, object]: The 'index' and 'line' of the game, the number of 'plies' played and
+    the 'error', None when every move was accepted. An error gives its 'kind' ('unparsable',
+    'illegal', 'ambiguous', 'check_mismatch', 'mate_mismatch', 'bad_fen' or 'unsupported'),
+    the 'ply' and 'san' of the move and the 'fen' of the position it was played in.
+    """
+    headers = game['headers']
+    report = {'index': game['index'], 'line': game['line'], 'plies': 0, 'error': None}
+    if headers.get('Variant', 'Standard').lower() not in ('standard', 'chess'):
+        report['error'] = {'kind': 'unsupported', 'ply': 0, 'san': '', 'fen': headers.get('FEN', '')}
+        return report
+    try:
+        position = from_fen(headers['FEN']) if 'FEN' in headers else Position()
+    except ValueError:
+        report['error'] = {'kind': 'bad_fen', 'ply': 0, 'san': '', 'fen': headers['FEN']}
+        return report
+
+    for ply, san in enumerate(game['moves']):
+        try:
+            undo = position.make_move(parse_san(position, san))
+        except MoveError as error:
+            report['error'] = {'kind': error.kind, 'ply': ply, 'san': san, 'fen': to_fen(position)}
+            return report
+        if check_markers:
+            kind = None
+            in_check = position.in_check(position.turn)
+            # Annotations such as '!' or '?!' follow the check marker
+            marker = san.rstrip('!?')
+            if marker.endswith('#'):
+                if not in_check or position.legal_moves():
+                    kind = 'mate_mismatch'
+            elif marker.endswith('+') != in_check:
+                kind = 'check_mismatch'
+            if kind is not None:
+                position.unmake_move(undo)
+                report['error'] = {'kind': kind, 'ply': ply, 'san': san, 'fen': to_fen(position)}
+                return report
+        report['plies'] = ply + 1
+    return report
+
+
+def check_archive(path: str, workers: int = 1, limit: Optional[int] = None,
+                  check_markers: bool = True) -> Iterator[Dict[str, object]]:
+    """
+    Replays every game of a PGN archive.
+
+    With more than one worker the games are replayed by a process pool, BATCH_SIZE games
+    per worker at a time, so memory stays bounded however large the archive is.
+
+    Args:
+    path (str): Path of the archive.
+    workers (int): Number of processes; 1 replays in this process.
+    limit (Optional[int]): Number of games to replay, all by default.
+    check_markers (bool): Whether check and mate markers are verified, see replay_game.
+
+    Returns:
+    Iterator[Dict[str, object]]: The replay_game report of every game, in the order of the file.
+    """
+    games = itertools.islice(read_games(path), limit)
+    replay = functools.partial(replay_game, check_markers=check_markers)
+    if workers <= 1:
+        yield from map(replay, games)
+        return
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        while True:
+            batch = list(itertools.islice(games, BATCH_SIZE * workers))
+            if not batch:
+                break
+            yield from pool.imap(replay, batch, chunksize=16)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: replays an archive and lists the moves the rules disagree with.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code, 1 when some game could not be replayed.
+    """
+    parser = argparse.ArgumentParser(description='Replay a PGN archive through the move rules.')
+    parser.add_argument('path', help='PGN file')
+    parser.add_argument('--workers', type=int, default=1, help='processes replaying games')
+    parser.add_argument('--limit', type=int, default=None, help='number of games to replay')
+    parser.add_argument('--ignore-check-markers', action='store_true',
+                        help="do not verify '+' and '#', for files written without them")
+    args = parser.parse_args(argv)
+
+    begin = time.perf_counter()
+    games, plies, errors = 0, 0, 0
+    for report in check_archive(args.path, args.workers, args.limit, not args.ignore_check_markers):
+        games += 1
+        plies += report['plies']
+        error = report['error']
+        if error is not None:
+            errors += 1
+            print(f"game {report['index']} (line {report['line']}) ply {error['ply']}: "
+                  f"{error['kind']} {error['san']!r} in {error['fen']}")
+    seconds = time.perf_counter() - begin
+    print(f'{games} games, {plies} plies, {errors} with errors in {seconds:.2f}s: '
+          f'{games / seconds if seconds else 0.0:.1f} games/s, {plies / seconds if seconds else 0.0:.0f} plies/s')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,762 @@
+"""
+Headless chess rules.
+
+This module keeps the whole state of one chess game in a Position object and exposes
+the move checking rules as its methods. It does not import pygame, so analysis tools
+can import it without opening a window and a single process can hold many
+independent games.
+"""
+from typing import List, Optional, Set, Tuple
+
+# The piece directions live with the attack tables and are re-exported from here
+from package.chess_game_module.attack_tables import (BISHOP_DIRECTIONS, KING_ATTACKS, KING_DIRECTIONS,
+                                                     KNIGHT_ATTACKS, KNIGHT_DIRECTIONS, ROOK_DIRECTIONS,
+                                                     bishop_attacks, bit_locations, rook_attacks)
+from package.chess_game_module.zobrist import (BLACK_TO_MOVE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS, PIECE_INDEX,
+                                               PIECE_KEYS, castling_rights, compute_key, en_passant_column)
+
+# list of all starting pieces and their locations
+STARTING_PIECES = ['rook', 'knight', 'bishop', 'king', 'queen', 'bishop', 'knight', 'rook',
+                   'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn', 'pawn']
+WHITE_STARTING_LOCATIONS = [(0, 7), (1, 7), (2, 7), (3, 7), (4, 7), (5, 7), (6, 7), (7, 7),
+                            (0, 6), (1, 6), (2, 6), (3, 6), (4, 6), (5, 6), (6, 6), (7, 6)]
+BLACK_STARTING_LOCATIONS = [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0),
+                            (0, 1), (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1)]
+
+# a move is (index of the moving piece, target square, promotion piece or None)
+Move = Tuple[int, Tuple[int, int], Optional[str]]
+# undo information returned by Position.make_move, see its docstring
+Undo = tuple
+PROMOTION_PIECES = ['queen', 'rook', 'bishop', 'knight']
+# starting squares of the rooks: (color index, 0 for the rook next to the king or 1 for the far one)
+ROOK_CORNERS = {(0, 7): (0, 0), (7, 7): (0, 1), (0, 0): (1, 0), (7, 0): (1, 1)}
+# Codes of the pieces on Position.board: 0 for an empty square, 1 + PIECE_INDEX[piece] for a white
+# piece and 9 + PIECE_INDEX[piece] for a black one, so bit 3 tells the color and every code fits 4 bits
+BLACK = 8  # added to the code of a white piece for the black one
+PIECE_CODES = {('white', piece): 1 + index for piece, index in PIECE_INDEX.items()}
+PIECE_CODES.update({('black', piece): 1 + BLACK + index for piece, index in PIECE_INDEX.items()})
+CODE_PIECES: List[Optional[Tuple[str, str]]] = [None] * 16  # code -> (color, piece type)
+for _piece, _code in PIECE_CODES.items():
+    CODE_PIECES[_code] = _piece
+
+
+def opponent(color: str) -> str:
+    """
+    Returns the color of the opponent of the given side.
+
+    Args:
+    color (str): Color of the side ('white' or 'black').
+
+    Returns:
+    str: 'black' for 'white' and 'white' for 'black'.
+    """
+    return 'black' if color == 'white' else 'white'
+
+
+def square_name(location: Tuple[int, int]) -> str:
+    """
+    Returns the algebraic name of a square, e.g. 'e2'.
+
+    White's king starts on (3, 7), so the columns are lettered from 'h' on the left
+    to 'a' on the right and the rows are numbered from 8 at the top to 1 at the bottom.
+
+    Args:
+    location (Tuple[int, int]): The square as (x, y).
+
+    Returns:
+    str: The name of the square.
+    """
+    return 'hgfedcba'[location[0]] + str(8 - location[1])
+
+
+def parse_square(name: str) -> Tuple[int, int]:
+    """
+    Converts the algebraic name of a square to its (x, y) location.
+
+    Args:
+    name (str): The name of the square, e.g. 'e2'.
+
+    Returns:
+    Tuple[int, int]: The square as (x, y).
+    """
+    return 'hgfedcba'.index(name[0]), 8 - int(name[1])
+
+
+def move_name(start: Tuple[int, int], target: Tuple[int, int], promotion: Optional[str] = None) -> str:
+    """
+    Returns the coordinate notation of a move, e.g. 'e2e4' or 'a7a8n'.
+
+    Args:
+    start (Tuple[int, int]): The square the piece leaves.
+    target (Tuple[int, int]): The square the piece moves to.
+    promotion (Optional[str]): The piece a pawn is promoted to, if any.
+
+    Returns:
+    str: The move in coordinate notation.
+    """
+    suffix = '' if promotion is None else ('n' if promotion == 'knight' else promotion[0])
+    return square_name(start) + square_name(target) + suffix
+
+
+class Position:
+    """
+    State of a single chess game.
+
+    The pieces of each color are stored in two parallel lists: one with the piece types
+    and one with their (x, y) locations, where (0, 0) is the top left square of the board
+    and white starts on rows 6 and 7. Pieces are addressed by their index in these lists,
+    exactly as the pygame client does when a piece is selected.
+
+    Next to the lists, the squares taken by each color are kept as occupancy bitboards (bit
+    y * 8 + x for the square (x, y)), so the knight, king, rook, bishop and queen moves come
+    from the precomputed tables of attack_tables with one lookup, and as a mailbox: board holds
+    the code of the piece on every square (see PIECE_CODES), so what stands on a square is one
+    array read, and indices holds the index of that piece in the lists of its side. Every move
+    generator and attack test asks these, never the lists, whether a square is taken. make_move
+    and unmake_move keep them up to date; code that edits the lists by hand has to call
+    sync_board afterwards.
+    """
+
+    def __init__(self) -> None:
+        self.white_pieces: List[str] = []
+        self.white_pieces_locations: List[Tuple[int, int]] = []
+        self.black_pieces: List[str] = []
+        self.black_pieces_locations: List[Tuple[int, int]] = []
+        self.turn = 'white'  # 'white', 'black', 'white_won', 'black_won' or 'draw'
+        self.white_pre_last_move: Optional[int] = None  # for checking en-passant, only the row the piece left
+        self.white_last_move: Optional[int] = None  # index of the last moved white piece
+        self.black_pre_last_move: Optional[int] = None
+        self.black_last_move: Optional[int] = None
+        self.king_moved = [0, 0]  # [white, black]
+        self.rook_moved = [[0, 0], [0, 0]]  # [white, black] x [rook next to the king, far rook]
+        self.white_valid_moves: List[List[Tuple[int, int]]] = []  # list of all white valid moves
+        self.black_valid_moves: List[List[Tuple[int, int]]] = []  # list of all black valid moves
+        self.backend = 'lists'  # move generator used by check_all_moves: 'lists' or 'bitboard'
+        self.key = 0  # Zobrist key, see zobrist.py
+        self.occupancy = [0, 0]  # [white, black] squares taken, as bitboards
+        self.board = bytearray(64)  # piece code of every square, indexed y * 8 + x
+        self.indices = bytearray(64)  # list index of the piece on every square, 0 for an empty one
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Puts all pieces back on their starting squares and clears the move history.
+
+        The lists are refilled in place, so references held by a client stay valid.
+        """
+        self.white_pieces[:] = STARTING_PIECES
+        self.white_pieces_locations[:] = WHITE_STARTING_LOCATIONS
+        self.black_pieces[:] = STARTING_PIECES
+        self.black_pieces_locations[:] = BLACK_STARTING_LOCATIONS
+        self.turn = 'white'
+        self.white_pre_last_move = None
+        self.white_last_move = None
+        self.black_pre_last_move = None
+        self.black_last_move = None
+        self.king_moved[:] = [0, 0]
+        self.rook_moved[:] = [[0, 0], [0, 0]]
+        self.white_valid_moves = []
+        self.black_valid_moves = []
+        self.key = compute_key(self)
+        self.sync_board()
+
+    def sync_board(self) -> None:
+        """
+        Recalculates the occupancy bitboards, the board and the indices from the piece lists.
+        """
+        board, indices = self.board, self.indices
+        board[:] = indices[:] = bytes(64)
+        for side, (color, pieces, locations) in enumerate([
+                ('white', self.white_pieces, self.white_pieces_locations),
+                ('black', self.black_pieces, self.black_pieces_locations)]):
+            occupancy = 0
+            for i, (piece, (x, y)) in enumerate(zip(pieces, locations)):
+                occupancy |= 1 << (y * 8 + x)
+                board[y * 8 + x] = PIECE_CODES[color, piece]
+                indices[y * 8 + x] = i
+            self.occupancy[side] = occupancy
+
+    def copy(self) -> 'Position':
+        """
+        Creates an independent copy of the position.
+
+        Returns:
+        Position: A new position with the same pieces and move history.
+        """
+        other = Position.__new__(Position)
+        other.white_pieces = self.white_pieces[:]
+        other.white_pieces_locations = self.white_pieces_locations[:]
+        other.black_pieces = self.black_pieces[:]
+        other.black_pieces_locations = self.black_pieces_locations[:]
+        other.turn = self.turn
+        other.white_pre_last_move = self.white_pre_last_move
+        other.white_last_move = self.white_last_move
+        other.black_pre_last_move = self.black_pre_last_move
+        other.black_last_move = self.black_last_move
+        other.king_moved = self.king_moved[:]
+        other.rook_moved = [self.rook_moved[0][:], self.rook_moved[1][:]]
+        other.white_valid_moves = [moves[:] for moves in self.white_valid_moves]
+        other.black_valid_moves = [moves[:] for moves in self.black_valid_moves]
+        other.backend = self.backend
+        other.key = self.key
+        other.occupancy = self.occupancy[:]
+        other.board = self.board[:]
+        other.indices = self.indices[:]
+        return other
+
+    def pieces(self, color: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Returns the piece types and the piece locations of one side.
+
+        Args:
+        color (str): Color of the pieces ('white' or 'black').
+
+        Returns:
+        Tuple[List[str], List[Tuple[int, int]]]: The parallel piece and location lists.
+        """
+        if color == 'white':
+            return self.white_pieces, self.white_pieces_locations
+        return self.black_pieces, self.black_pieces_locations
+
+    def piece_at(self, square: Tuple[int, int]) -> Optional[Tuple[str, str]]:
+        """
+        Tells what stands on a square.
+
+        Args:
+        square (Tuple[int, int]): The square as (x, y).
+
+        Returns:
+        Optional[Tuple[str, str]]: The color and type of the piece, None when the square is empty.
+        """
+        return CODE_PIECES[self.board[square[1] * 8 + square[0]]]
+
+    def piece_index(self, square: Tuple[int, int], color: str) -> Optional[int]:
+        """
+        Finds the index of a piece of one side by its square.
+
+        The board tells with one read whether such a piece is there, and indices where it is
+        in the lists.
+
+        Args:
+        square (Tuple[int, int]): The square as (x, y).
+        color (str): Color of the piece ('white' or 'black').
+
+        Returns:
+        Optional[int]: Index of the piece in the lists of its side, None when no piece of that
+        color stands on the square.
+        """
+        code = self.board[square[1] * 8 + square[0]]
+        if not code or (code & BLACK) != (0 if color == 'white' else BLACK):
+            return None
+        return self.indices[square[1] * 8 + square[0]]
+
+    # CHECKING MOVES:
+    def check_pawn_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a pawn at a given position.
+
+        This function considers normal pawn moves (single and double steps),
+        capturing moves, and special moves like en-passant.
+
+        Args:
+        i (int): Index of the pawn in the piece list.
+        color (str): Color of the pawn ('white' or 'black').
+
+        Returns:
+        list: A list of tuples representing valid moves for the pawn.
+        """
+        piece_move_list = []
+
+        if color == 'white':
+            own_locations, opponent_locations = self.white_pieces_locations, self.black_pieces_locations
+            opponent_pieces, last_move, pre_last_move = \
+                self.black_pieces, self.black_last_move, self.black_pre_last_move
+            step, start_row, en_passant_row, opponent_start_row = -1, 6, 3, 1
+        else:
+            own_locations, opponent_locations = self.black_pieces_locations, self.white_pieces_locations
+            opponent_pieces, last_move, pre_last_move = \
+                self.white_pieces, self.white_last_move, self.white_pre_last_move
+            step, start_row, en_passant_row, opponent_start_row = 1, 1, 4, 6
+        x, y = own_locations[i]
+        board, opponents = self.board, self.occupancy[1 if color == 'white' else 0]
+        ahead = (y + step) * 8 + x
+
+        # Check normal pawn moves and double step from starting position
+        if not board[ahead]:
+            piece_move_list.append((x, y + step))
+            if y == start_row and not board[ahead + 8 * step]:
+                piece_move_list.append((x, y + 2 * step))
+        # Check capturing moves
+        if x > 0 and opponents >> (ahead - 1) & 1:
+            piece_move_list.append((x - 1, y + step))
+        if x < 7 and opponents >> (ahead + 1) & 1:
+            piece_move_list.append((x + 1, y + step))
+        # en-passant mechanics
+        if last_move is not None and y == en_passant_row and opponent_pieces[last_move] == 'pawn' and \
+                pre_last_move == opponent_start_row and opponent_locations[last_move][1] == en_passant_row:
+            if opponent_locations[last_move][0] == x - 1:
+                piece_move_list.append((x - 1, y + step))
+            if opponent_locations[last_move][0] == x + 1:
+                piece_move_list.append((x + 1, y + step))
+
+        return piece_move_list
+
+    def check_rook_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a rook at a given position.
+
+        This function considers all possible straight-line moves for the rook,
+        stopping at the first piece encountered in each direction. It includes
+        moves where the rook captures an opponent's piece.
+
+        Args:
+        i (int): Index of the rook in the piece list.
+        color (str): Color of the rook ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the rook.
+        """
+        side = 0 if color == 'white' else 1
+        x, y = self.pieces(color)[1][i]
+        occupancy = self.occupancy
+        return bit_locations(rook_attacks(y * 8 + x, occupancy[0] | occupancy[1]) & ~occupancy[side])
+
+    def check_knight_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a knight at a given position.
+
+        This function considers all possible L-shaped moves for the knight,
+        ensuring that it does not move onto a square occupied by a piece of the same color.
+
+        Args:
+        i (int): Index of the knight in the piece list.
+        color (str): Color of the knight ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the knight.
+        """
+        side = 0 if color == 'white' else 1
+        x, y = self.pieces(color)[1][i]
+        return bit_locations(KNIGHT_ATTACKS[y * 8 + x] & ~self.occupancy[side])
+
+    def check_bishop_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a bishop at a given position.
+
+        This function considers all possible diagonal moves for the bishop,
+        stopping at the first piece encountered in each direction. It includes
+        moves where the bishop captures an opponent's piece.
+
+        Args:
+        i (int): Index of the bishop in the piece list.
+        color (str): Color of the bishop ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the bishop.
+        """
+        side = 0 if color == 'white' else 1
+        x, y = self.pieces(color)[1][i]
+        occupancy = self.occupancy
+        return bit_locations(bishop_attacks(y * 8 + x, occupancy[0] | occupancy[1]) & ~occupancy[side])
+
+    def check_queen_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a queen at a given position.
+
+        This function combines the moves of a rook and a bishop, as the queen's movement
+        is a combination of both these pieces.
+
+        Args:
+        i (int): Index of the queen in the piece list.
+        color (str): Color of the queen ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the queen.
+        """
+        side = 0 if color == 'white' else 1
+        x, y = self.pieces(color)[1][i]
+        occupancy = self.occupancy
+        occupied = occupancy[0] | occupancy[1]
+        return bit_locations((rook_attacks(y * 8 + x, occupied) | bishop_attacks(y * 8 + x, occupied))
+                             & ~occupancy[side])
+
+    def check_king_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a king at a given position.
+
+        This function considers all possible one-square moves around the king in all directions.
+        It also includes castling moves if the conditions are met (king and rook have not moved,
+        there are no pieces between them and none of the castling squares is attacked by the opponent).
+
+        Args:
+        i (int): Index of the king in the piece list.
+        color (str): Color of the king ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the king.
+        """
+        side = 0 if color == 'white' else 1
+        moved, rooks_moved, row = self.king_moved[side], self.rook_moved[side], 7 - 7 * side
+        x, y = self.pieces(color)[1][i]
+        occupancy = self.occupancy
+
+        moves = bit_locations(KING_ATTACKS[y * 8 + x] & ~occupancy[side])
+
+        # Castling logic here
+        if moved == 0 and (x, y) == (3, row) and (rooks_moved[0] == 0 or rooks_moved[1] == 0):
+            attacker = opponent(color)
+            occupied = (occupancy[0] | occupancy[1]) >> (row * 8)
+            rook = PIECE_CODES[color, 'rook']
+            # Short castling: the king goes to (1, row) and the rook from (0, row) to (2, row)
+            short = rooks_moved[0] == 0 and self.board[row * 8] == rook and not occupied & 0b110
+            # Long castling: the king goes to (5, row) and the rook from (7, row) to (4, row)
+            long = rooks_moved[1] == 0 and self.board[row * 8 + 7] == rook and not occupied & 0b1110000
+            if (short or long) and not self.is_attacked((3, row), attacker):
+                if short and not self.is_attacked((2, row), attacker) and not self.is_attacked((1, row), attacker):
+                    moves.append((1, row))
+                if long and not self.is_attacked((4, row), attacker) and not self.is_attacked((5, row), attacker):
+                    moves.append((5, row))
+
+        return moves
+
+    def attacked_squares(self, color: str) -> Set[Tuple[int, int]]:
+        """
+        Calculates all squares attacked by the pieces of the specified color.
+
+        Unlike check_all_moves, pawns attack only diagonally and the king attacks only
+        the squares around it, so this tells which squares are unsafe for the opponent's king.
+
+        Args:
+        color (str): Color of the attacking pieces ('white' or 'black').
+
+        Returns:
+        Set[Tuple[int, int]]: A set of attacked squares.
+        """
+        pieces, locations = self.pieces(color)
+        step = -1 if color == 'white' else 1
+        attacked = set()
+
+        for i in range(len(pieces)):
+            x, y = locations[i]
+            if pieces[i] == 'pawn':
+                attacked.update(square for square in [(x - 1, y + step), (x + 1, y + step)]
+                                if 0 <= square[0] < 8 and 0 <= square[1] < 8)
+            elif pieces[i] == 'king':
+                attacked.update(bit_locations(KING_ATTACKS[y * 8 + x]))
+            elif pieces[i] == 'rook':
+                attacked.update(self.check_rook_move(i, color))
+            elif pieces[i] == 'knight':
+                attacked.update(self.check_knight_move(i, color))
+            elif pieces[i] == 'bishop':
+                attacked.update(self.check_bishop_move(i, color))
+            elif pieces[i] == 'queen':
+                attacked.update(self.check_queen_move(i, color))
+
+        return attacked
+
+    def is_attacked(self, square: Tuple[int, int], color: str) -> bool:
+        """
+        Checks whether a square is attacked by any piece of the specified color.
+
+        Args:
+        square (Tuple[int, int]): The square to check.
+        color (str): Color of the attacking pieces ('white' or 'black').
+
+        Returns:
+        bool: True if at least one piece attacks the square.
+        """
+        pieces, locations = self.pieces(color)
+        board = self.board
+        x, y = square
+        pawn_row = y + 1 if color == 'white' else y - 1  # row from which a pawn attacks the square
+
+        for piece, (piece_x, piece_y) in zip(pieces, locations):
+            dx, dy = piece_x - x, piece_y - y
+            if piece == 'pawn':
+                if piece_y == pawn_row and (dx == 1 or dx == -1):
+                    return True
+            elif piece == 'knight':
+                if dx * dx + dy * dy == 5:
+                    return True
+            elif piece == 'king':
+                if -1 <= dx <= 1 and -1 <= dy <= 1:
+                    return True
+            elif ((dx == 0 or dy == 0) and piece != 'bishop') or (dx * dx == dy * dy and piece != 'rook'):
+                # Walk from the square towards the sliding piece and look for a blocker
+                step_x, step_y = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+                between = (x + step_x, y + step_y)
+                while between != (piece_x, piece_y) and not board[between[1] * 8 + between[0]]:
+                    between = (between[0] + step_x, between[1] + step_y)
+                if between == (piece_x, piece_y):
+                    return True
+        return False
+
+    def in_check(self, color: str) -> bool:
+        """
+        Checks whether the king of the specified color is attacked.
+
+        Args:
+        color (str): Color of the king ('white' or 'black').
+
+        Returns:
+        bool: True if the king is in check.
+        """
+        pieces, locations = self.pieces(color)
+        return 'king' in pieces and self.is_attacked(locations[pieces.index('king')], opponent(color))
+
+    def legal_moves(self) -> List[Move]:
+        """
+        Calculates the moves of the side to move that do not leave its own king in check.
+
+        The pseudo-legal moves of check_all_moves are filtered with the attacks, checks and pins
+        of the position, see legality.py. A pawn reaching the last row gives one move for each
+        piece it can be promoted to. A finished game has no moves.
+
+        Returns:
+        List[Move]: Moves as (piece index, target square, promotion piece or None).
+        """
+        from package.chess_game_module.legality import legal_moves
+        return legal_moves(self)
+
+    def check_all_moves(self, color: str) -> List[List[Tuple[int, int]]]:
+        """
+        Calculates all valid moves for all pieces of the specified color.
+
+        This function iterates through each piece of the given color and
+        accumulates a list of valid moves for each piece, considering the type
+        of each piece (pawn, rook, knight, bishop, king, queen). When the backend of the
+        position is 'bitboard', the same moves are calculated by the bitboard generator.
+
+        Args:
+        color (str): Color of the pieces ('white' or 'black').
+
+        Returns:
+        List[List[Tuple[int, int]]]: A list containing lists of tuples, where each inner list
+        represents valid moves for a single piece and each tuple represents a move's coordinates.
+        """
+        if self.backend == 'bitboard':
+            from package.chess_game_module.bitboard import generate_all_moves
+            return generate_all_moves(self, color)
+
+        pieces = self.white_pieces if color == 'white' else self.black_pieces
+
+        # Iterate through each piece and accumulate their valid moves
+        return [self.check_piece_move(i, color) for i in range(len(pieces))]
+
+    def check_piece_move(self, i: int, color: str) -> List[Tuple[int, int]]:
+        """
+        Calculates valid moves for a single piece, considering its type.
+
+        Args:
+        i (int): Index of the piece in the piece list.
+        color (str): Color of the piece ('white' or 'black').
+
+        Returns:
+        List[Tuple[int, int]]: A list of tuples representing valid moves for the piece.
+        """
+        piece = self.white_pieces[i] if color == 'white' else self.black_pieces[i]
+        if piece == 'pawn':
+            return self.check_pawn_move(i, color)
+        elif piece == 'rook':
+            return self.check_rook_move(i, color)
+        elif piece == 'knight':
+            return self.check_knight_move(i, color)
+        elif piece == 'bishop':
+            return self.check_bishop_move(i, color)
+        elif piece == 'king':
+            return self.check_king_move(i, color)
+        return self.check_queen_move(i, color)
+
+    def update_valid_moves(self, undo: Optional[Undo] = None) -> int:
+        """
+        Recalculates the valid moves of both sides and stores them in the position.
+
+        When the undo information of the move just made is given and the stored moves
+        were up to date before that move, only the pieces affected by the move are
+        recalculated; see incremental.update_valid_moves.
+
+        Args:
+        undo (Optional[Undo]): The value returned by make_move for the last move.
+
+        Returns:
+        int: The number of pieces whose moves were calculated.
+        """
+        if undo is not None:
+            from package.chess_game_module.incremental import update_valid_moves
+            return update_valid_moves(self, undo)
+        self.black_valid_moves = self.check_all_moves('black')
+        self.white_valid_moves = self.check_all_moves('white')
+        return len(self.black_valid_moves) + len(self.white_valid_moves)
+
+    # MAKING MOVES:
+    def make_move(self, move: Move) -> Undo:
+        """
+        Plays a move of the side to move in place and passes the turn to the opponent.
+
+        This function handles captures, en-passant, castling and promotion.
+        When the opponent's king is captured the turn becomes 'white_won' or 'black_won'.
+        The move is not validated, callers should pick it from the valid moves.
+
+        Args:
+        move (Move): The move as (piece index, target square, promotion piece). A pawn reaching
+        the last row with no promotion piece given becomes a queen.
+
+        Returns:
+        Undo: Everything unmake_move needs to restore the position: the moved piece, the captured
+        piece with its index, the castling rook, the previous en-passant and castling state and
+        the previous Zobrist key. The key itself is updated incrementally.
+        """
+        i, target, promotion = move
+        color = self.turn
+        pieces, own_locations = self.pieces(color)
+        opponent_pieces, opponent_locations = self.pieces(opponent(color))
+        start, piece = own_locations[i], pieces[i]
+        row, promotion_row = (7, 0) if color == 'white' else (0, 7)
+        side = 0 if color == 'white' else 1
+        state = (self.turn, self.white_last_move, self.white_pre_last_move, self.black_last_move,
+                 self.black_pre_last_move, self.king_moved[side], self.rook_moved[0][0], self.rook_moved[0][1],
+                 self.rook_moved[1][0], self.rook_moved[1][1], self.key)
+
+        # The key loses the side to move, the castling rights, the en-passant column and the moving piece
+        piece_keys = PIECE_KEYS[side]
+        key = self.key ^ BLACK_TO_MOVE_KEY ^ CASTLING_KEYS[castling_rights(self)] ^ \
+            piece_keys[PIECE_INDEX[piece]][start[1] * 8 + start[0]]
+        column = en_passant_column(self)
+        if column is not None:
+            key ^= EN_PASSANT_KEYS[column]
+
+        # Capturing piece handling, including en-passant where the captured pawn stands beside the target
+        board, indices = self.board, self.indices
+        captured = None
+        if board[target[1] * 8 + target[0]]:
+            captured = indices[target[1] * 8 + target[0]]
+        elif piece == 'pawn' and target[0] != start[0]:
+            captured = indices[start[1] * 8 + target[0]]
+        if captured is not None:
+            captured = (captured, opponent_pieces.pop(captured), opponent_locations.pop(captured))
+            self._forget_captured_piece(opponent(color), captured[0])
+            self.occupancy[1 - side] ^= 1 << (captured[2][1] * 8 + captured[2][0])
+            board[captured[2][1] * 8 + captured[2][0]] = indices[captured[2][1] * 8 + captured[2][0]] = 0
+            key ^= PIECE_KEYS[1 - side][PIECE_INDEX[captured[1]]][captured[2][1] * 8 + captured[2][0]]
+            self._reindex(opponent_locations, captured[0])
+
+        own_locations[i] = target
+        self.occupancy[side] ^= 1 << (start[1] * 8 + start[0]) | 1 << (target[1] * 8 + target[0])
+        if color == 'white':
+            self.white_last_move, self.white_pre_last_move = i, start[1]
+        else:
+            self.black_last_move, self.black_pre_last_move = i, start[1]
+
+        # Promoting
+        if piece == 'pawn' and target[1] == promotion_row:
+            pieces[i] = promotion or 'queen'
+        board[start[1] * 8 + start[0]] = indices[start[1] * 8 + start[0]] = 0
+        board[target[1] * 8 + target[0]] = PIECE_CODES[color, pieces[i]]
+        indices[target[1] * 8 + target[0]] = i
+        # Castle handling
+        rook = None
+        if piece == 'king' and self.king_moved[side] == 0 and start == (3, row):
+            if target == (1, row):
+                rook = (indices[row * 8], (0, row))
+                own_locations[rook[0]] = (2, row)
+                key ^= piece_keys[1][row * 8] ^ piece_keys[1][row * 8 + 2]
+                self.occupancy[side] ^= 0b101 << (row * 8)
+                board[row * 8], board[row * 8 + 2] = 0, PIECE_CODES[color, 'rook']
+                indices[row * 8], indices[row * 8 + 2] = 0, rook[0]
+            if target == (5, row):
+                rook = (indices[row * 8 + 7], (7, row))
+                own_locations[rook[0]] = (4, row)
+                key ^= piece_keys[1][row * 8 + 7] ^ piece_keys[1][row * 8 + 4]
+                self.occupancy[side] ^= 0b10010000 << (row * 8)
+                board[row * 8 + 7], board[row * 8 + 4] = 0, PIECE_CODES[color, 'rook']
+                indices[row * 8 + 7], indices[row * 8 + 4] = 0, rook[0]
+        if piece == 'king':
+            self.king_moved[side] = 1
+        # A rook leaving its corner or being captured there loses its castling right
+        for square in [start, target]:
+            if square in ROOK_CORNERS:
+                color_index, corner = ROOK_CORNERS[square]
+                self.rook_moved[color_index][corner] = 1
+
+        if 'king' not in opponent_pieces:
+            self.turn = color + '_won'
+        else:
+            self.turn = opponent(color)
+
+        # The key gets the piece on its new square and the new castling rights and en-passant column
+        key ^= piece_keys[PIECE_INDEX[pieces[i]]][target[1] * 8 + target[0]] ^ CASTLING_KEYS[castling_rights(self)]
+        column = en_passant_column(self)
+        if column is not None:
+            key ^= EN_PASSANT_KEYS[column]
+        self.key = key
+
+        return i, start, piece, captured, rook, state
+
+    def unmake_move(self, undo: Undo) -> None:
+        """
+        Takes back a move played by make_move, restoring the exact previous state.
+
+        Moves must be taken back in the reverse order they were made in. Nothing is copied:
+        the moved piece, the castling rook and the captured piece are put back in place.
+
+        Args:
+        undo (Undo): The value returned by make_move for the move.
+        """
+        i, start, piece, captured, rook, state = undo
+        color = state[0]
+        side = 0 if color == 'white' else 1
+        pieces, own_locations = self.pieces(color)
+        target, occupancy, board, indices = own_locations[i], self.occupancy, self.board, self.indices
+
+        own_locations[i] = start
+        pieces[i] = piece
+        occupancy[side] ^= 1 << (start[1] * 8 + start[0]) | 1 << (target[1] * 8 + target[0])
+        board[target[1] * 8 + target[0]] = indices[target[1] * 8 + target[0]] = 0
+        board[start[1] * 8 + start[0]] = PIECE_CODES[color, piece]
+        indices[start[1] * 8 + start[0]] = i
+        if rook is not None:
+            (x, y), (rook_x, rook_y) = own_locations[rook[0]], rook[1]
+            own_locations[rook[0]] = rook[1]
+            occupancy[side] ^= 1 << (y * 8 + x) | 1 << (rook_y * 8 + rook_x)
+            board[y * 8 + x], board[rook_y * 8 + rook_x] = 0, PIECE_CODES[color, 'rook']
+            indices[y * 8 + x], indices[rook_y * 8 + rook_x] = 0, rook[0]
+        if captured is not None:
+            opponent_pieces, opponent_locations = self.pieces(opponent(color))
+            opponent_pieces.insert(captured[0], captured[1])
+            opponent_locations.insert(captured[0], captured[2])
+            occupancy[1 - side] |= 1 << (captured[2][1] * 8 + captured[2][0])
+            board[captured[2][1] * 8 + captured[2][0]] = PIECE_CODES[opponent(color), captured[1]]
+            self._reindex(opponent_locations, captured[0])
+
+        (self.turn, self.white_last_move, self.white_pre_last_move, self.black_last_move, self.black_pre_last_move,
+         self.king_moved[side], self.rook_moved[0][0], self.rook_moved[0][1], self.rook_moved[1][0],
+         self.rook_moved[1][1], self.key) = state
+
+    def _reindex(self, locations: List[Tuple[int, int]], first: int) -> None:
+        """
+        Writes the indices of the pieces that moved up or down the lists after a capture.
+
+        Args:
+        locations (List[Tuple[int, int]]): Location list of the side that lost or got back a piece.
+        first (int): Index of that piece; the pieces from there on are written.
+        """
+        indices = self.indices
+        for i in range(first, len(locations)):
+            x, y = locations[i]
+            indices[y * 8 + x] = i
+
+    def _forget_captured_piece(self, color: str, index: int) -> None:
+        """
+        Keeps the last move index of a side valid after one of its pieces was removed.
+
+        Args:
+        color (str): Color of the captured piece ('white' or 'black').
+        index (int): Index the captured piece had in its piece list.
+        """
+        last_move = self.white_last_move if color == 'white' else self.black_last_move
+        if last_move is not None:
+            last_move = None if last_move == index else last_move - (last_move > index)
+        if color == 'white':
+            self.white_last_move = last_move
+        else:
+            self.black_last_move = last_move
@@ -0,0 +1,434 @@
+"""
+Compact binary game records.
+
+A record file holds finished games one after another, each as a 4 byte header followed by
+2 bytes per move, so a game of 80 plies takes 164 bytes instead of the kilobytes of a JSON
+line. Beside it an index file (the record file's name with '.idx' appended) holds the byte
+offset of every game as an 8 byte integer. Both files are memory-mapped by GameRecords, so
+any game, or any ply of a game, is found in constant time without reading the games before
+it, and the moves of a game are handed out as a memoryview of the mapped file, not a copy.
+
+Layout, all numbers little-endian:
+    record file: MAGIC, then per game: plies (uint16), result (uint8), termination (uint8),
+                 and one uint16 per ply
+    move:        bits 0-5 start square, bits 6-11 target square (y * 8 + x),
+                 bits 12-14 promotion (0 none, then queen, rook, bishop, knight)
+    index file:  the offset of every game in the record file (uint64)
+
+Usage:
+    python -m package.chess_game_module.records games.cgr
+    python -m package.chess_game_module.records games.cgr --game 12345
+"""
+import argparse
+import functools
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from package.chess_game_module.position import PROMOTION_PIECES, Move, Position, move_name, parse_square, square_name
+
+MAGIC = b'CGR\x01'  # file signature with the version of the format
+RECORD_HEADER = struct.Struct('<HBB')  # plies, result, termination
+OFFSET = struct.Struct('<Q')
+RESULTS = ['*', '1-0', '0-1', '1/2-1/2']
+TERMINATIONS = ['unknown', 'checkmate', 'stalemate', 'repetition', 'move_limit', 'end_of_script',
+                'king_capture', 'resignation', 'abandoned', 'illegal_move']
+MAX_PLIES = 0xFFFF
+PROMOTION_LETTERS = 'qrbn'  # letters of PROMOTION_PIECES in coordinate notation
+
+
+@functools.lru_cache(maxsize=None)  # there are only a few thousand distinct moves
+def encode_move(text: str) -> int:
+    """
+    Packs a move in coordinate notation into 16 bits.
+
+    Args:
+    text (str): The move, for example 'e2e4' or 'a7a8n'.
+
+    Returns:
+    int: The packed move.
+    """
+    start_x, start_y = parse_square(text[:2])
+    target_x, target_y = parse_square(text[2:4])
+    promotion = 0
+    if len(text) > 4:
+        promotion = 1 + PROMOTION_LETTERS.index(text[4])
+    return start_y * 8 + start_x | (target_y * 8 + target_x) << 6 | promotion << 12
+
+
+def decode_move(code: int) -> Tuple[Tuple[int, int], Tuple[int, int], Optional[str]]:
+    """
+    Unpacks a move packed by encode_move.
+
+    Args:
+    code (int): The packed move.
+
+    Returns:
+    Tuple[Tuple[int, int], Tuple[int, int], Optional[str]]: The start and target squares as (x, y)
+    and the promotion piece, if any.
+    """
+    promotion = code >> 12 & 7
+    return (code & 7, code >> 3 & 7), (code >> 6 & 7, code >> 9 & 7), \
+        PROMOTION_PIECES[promotion - 1] if promotion else None
+
+
+def pack_move(position: Position, move: Move) -> int:
+    """
+    Packs a move of the side to move as encode_move does, without going through its name.
+
+    Args:
+    position (Position): The position the move is played in.
+    move (Move): The move as (piece index, target square, promotion piece or None).
+
+    Returns:
+    int: The packed move.
+    """
+    i, (target_x, target_y), promotion = move
+    start_x, start_y = position.pieces(position.turn)[1][i]
+    code = start_y * 8 + start_x | (target_y * 8 + target_x) << 6
+    return code | (1 + PROMOTION_PIECES.index(promotion)) << 12 if promotion else code
+
+
+def unpack_move(position: Position, code: int) -> Move:
+    """
+    Turns a packed move back into a move of the side to move.
+
+    Args:
+    position (Position): The position the move is played in.
+    code (int): The packed move.
+
+    Returns:
+    Move: The move as (piece index, target square, promotion piece or None).
+
+    Raises:
+    ValueError: If the side to move has no piece on the start square.
+    """
+    start, target, promotion = decode_move(code)
+    index = position.piece_index(start, position.turn)
+    if index is None:
+        raise ValueError(f'no {position.turn} piece on {square_name(start)}')
+    return index, target, promotion
+
+
+class RecordWriter:
+    """
+    Appends games to a record file and its index.
+
+    Every game is flushed as soon as it is written, so a reader opened later sees it and a
+    crash loses at most the game being written.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens a record file for appending, creating it and its index when they do not exist.
+
+        An index that does not end where the record file ends is rebuilt first, and a game cut
+        short by a crash is cut off, so the new games follow the last complete one.
+
+        Args:
+        path (str): Path of the record file.
+
+        Raises:
+        ValueError: If the file exists but is not a record file.
+        """
+        self.path = path
+        existing = os.path.exists(path) and os.path.getsize(path) > 0
+        if existing:
+            size = os.path.getsize(path)
+            if _indexed_end(path) != size:
+                build_index(path)
+                end = _indexed_end(path)
+                if end != size:
+                    os.truncate(path, end)
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        # The index of a new record file starts empty, whatever was left under its name
+        self.index = open(path + '.idx', 'ab' if existing else 'wb')
+
+    def write(self, moves: Sequence[str], result: str = '*', termination: str = 'unknown') -> int:
+        """
+        Appends one game.
+
+        Args:
+        moves (Sequence[str]): The moves from the starting position in coordinate notation.
+        result (str): '1-0', '0-1', '1/2-1/2' or '*'.
+        termination (str): How the game ended, one of TERMINATIONS.
+
+        Returns:
+        int: The number of the game in the file.
+
+        Raises:
+        ValueError: If the game is longer than MAX_PLIES or the result or termination is unknown.
+        """
+        if len(moves) > MAX_PLIES:
+            raise ValueError(f'a record holds at most {MAX_PLIES} plies, not {len(moves)}')
+        offset = self.file.tell()
+        data = array('H', map(encode_move, moves))
+        if sys.byteorder == 'big':
+            data.byteswap()
+        self.file.write(RECORD_HEADER.pack(len(moves), RESULTS.index(result), TERMINATIONS.index(termination)) +
+                        data.tobytes())
+        self.file.flush()
+        # The offset goes to the index only once the game is complete
+        self.index.write(OFFSET.pack(offset))
+        self.index.flush()
+        return self.index.tell() // OFFSET.size - 1
+
+    def close(self) -> None:
+        """
+        Closes the files.
+        """
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self) -> 'RecordWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def build_index(path: str) -> int:
+    """
+    Writes the index of a record file again by walking the game headers.
+
+    Only the 4 header bytes of every game are read. Used when the index is missing or does
+    not match the record file, for example when a crash left a game without its index entry.
+
+    Args:
+    path (str): Path of the record file.
+
+    Returns:
+    int: The number of games.
+
+    Raises:
+    ValueError: If the file is not a record file.
+    """
+    offsets = array('Q')
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a game record file')
+        size = os.fstat(file.fileno()).st_size
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            file.seek(offset)
+            plies = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))[0]
+            end = offset + RECORD_HEADER.size + 2 * plies
+            if end > size:
+                break  # a game cut short while it was written
+            offsets.append(offset)
+            offset = end
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    with open(path + '.idx', 'wb') as index:
+        index.write(offsets.tobytes())
+    return len(offsets)
+
+
+def _indexed_end(path: str) -> Optional[int]:
+    """
+    Finds where the last game of the index ends in the record file.
+
+    Args:
+    path (str): Path of the record file.
+
+    Returns:
+    Optional[int]: The offset just past the last indexed game, the length of MAGIC for an empty
+    index, or None when the index is missing, ends in a partial entry or points past the end of
+    the record file. Unless it equals the size of the record file the index has to be rebuilt.
+    """
+    try:
+        index_size = os.path.getsize(path + '.idx')
+    except OSError:
+        return None
+    if index_size % OFFSET.size:
+        return None
+    if index_size == 0:
+        return len(MAGIC)
+    with open(path + '.idx', 'rb') as index:
+        index.seek(index_size - OFFSET.size)
+        offset = OFFSET.unpack(index.read(OFFSET.size))[0]
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        header = file.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    return offset + RECORD_HEADER.size + 2 * RECORD_HEADER.unpack(header)[0]
+
+
+def _map(path: str) -> Tuple[Optional[mmap.mmap], memoryview]:
+    """
+    Maps a file read-only.
+
+    Args:
+    path (str): Path of the file.
+
+    Returns:
+    Tuple[Optional[mmap.mmap], memoryview]: The map, None for an empty file, and a view of its bytes.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None, memoryview(b'')
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, memoryview(data)
+
+
+class GameRecords:
+    """
+    Read-only, memory-mapped access to a record file.
+
+    The moves handed out are views of the mapped file, which stay valid until close is called;
+    release them (or let them go out of scope) before closing.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Maps a record file and its index, rebuilding the index when it is missing or does not end
+        where the record file ends.
+
+        Args:
+        path (str): Path of the record file.
+
+        Raises:
+        ValueError: If the file is not a record file.
+        """
+        if _indexed_end(path) != os.path.getsize(path):
+            build_index(path)
+        self._data, self._bytes = _map(path)
+        if self._bytes[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a game record file')
+        self._index_map, index = _map(path + '.idx')
+        # Whole entries only: a crash may leave a partly written offset behind
+        index = index[:len(index) - len(index) % OFFSET.size]
+        if sys.byteorder == 'little':
+            self._offsets = index.cast('Q')
+            self._words = self._bytes[:len(self._bytes) - len(self._bytes) % 2].cast('H')
+        else:
+            # memoryview.cast only reads native byte order, so big-endian machines pay for a swapped copy
+            self._offsets = array('Q', index.tobytes())
+            self._offsets.byteswap()
+            self._words = array('H', self._bytes[:len(self._bytes) - len(self._bytes) % 2].tobytes())
+            self._words.byteswap()
+            index.release()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def header(self, game: int) -> Dict[str, object]:
+        """
+        Reads the header of a game.
+
+        Args:
+        game (int): Number of the game in the file.
+
+        Returns:
+        Dict[str, object]: The number of 'plies', the 'result' and the 'termination'.
+        """
+        plies, result, termination = RECORD_HEADER.unpack_from(self._bytes, self._offsets[game])
+        return {'plies': plies, 'result': RESULTS[result], 'termination': TERMINATIONS[termination]}
+
+    def moves(self, game: int) -> memoryview:
+        """
+        Returns the packed moves of a game without copying them.
+
+        Args:
+        game (int): Number of the game in the file.
+
+        Returns:
+        memoryview: One 16 bit move per ply, see decode_move.
+        """
+        offset = self._offsets[game]
+        plies = RECORD_HEADER.unpack_from(self._bytes, offset)[0]
+        # Games start at even offsets, so their moves are whole 16 bit words of the file
+        first = (offset + RECORD_HEADER.size) // 2
+        return self._words[first:first + plies]
+
+    def move(self, game: int, ply: int) -> str:
+        """
+        Reads one move of a game.
+
+        Args:
+        game (int): Number of the game in the file.
+        ply (int): Number of the move in the game, from 0.
+
+        Returns:
+        str: The move in coordinate notation.
+        """
+        return move_name(*decode_move(self.moves(game)[ply]))
+
+    def replay(self, game: int, plies: Optional[int] = None, position: Optional[Position] = None) -> Position:
+        """
+        Plays the moves of a game.
+
+        Args:
+        game (int): Number of the game in the file.
+        plies (Optional[int]): Number of moves to play, all by default.
+        position (Optional[Position]): Position the game is played into, for example the one shown
+        in the window. It is reset first; a new position by default.
+
+        Returns:
+        Position: The position after the moves.
+        """
+        if position is None:
+            position = Position()
+        else:
+            position.reset()
+        for code in self.moves(game)[:plies]:
+            position.make_move(unpack_move(position, code))
+        return position
+
+    def close(self) -> None:
+        """
+        Unmaps the files.
+        """
+        for view in ('_words', '_offsets', '_bytes'):
+            if isinstance(getattr(self, view, None), memoryview):
+                getattr(self, view).release()
+        for data in (getattr(self, '_data', None), getattr(self, '_index_map', None)):
+            if data is not None:
+                data.close()
+
+    def __enter__(self) -> 'GameRecords':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: summarises a record file or prints one of its games.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Read a binary game record file.')
+    parser.add_argument('path', help='record file')
+    parser.add_argument('--game', type=int, default=None, help='number of a game to print')
+    args = parser.parse_args(argv)
+
+    with GameRecords(args.path) as records:
+        if args.game is not None:
+            header = records.header(args.game)
+            print(f"{header['result']} ({header['termination']}, {header['plies']} plies)")
+            print(' '.join(move_name(*decode_move(code)) for code in records.moves(args.game)))
+            return 0
+        begin = time.perf_counter()
+        plies = sum(len(records.moves(game)) for game in range(len(records)))
+        seconds = time.perf_counter() - begin
+        print(f'{len(records)} games, {plies} plies, {os.path.getsize(args.path)} bytes; '
+              f'moves of every game reached in {seconds:.3f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
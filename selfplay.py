@@ -0,0 +1,275 @@
+"""
+Headless batch game simulator.
+
+Plays many games without a window, spread over a multiprocessing pool with one worker per
+core. Every game is played on its own Position created inside the worker, so nothing is
+shared between games, and every finished game is written to a JSON lines file at once,
+so a long run can be followed (or interrupted) while it is going.
+
+Games are played by one of three modes:
+    random:   both sides play uniformly random legal moves
+    engine:   both sides are played by the engine with a fixed depth and time per move
+    scripted: the moves of every game are read from a file, one game per line in
+              coordinate notation ("e2e4 e7e5 g1f3")
+
+Usage:
+    python -m package.chess_game_module.selfplay --games 200 --output games.jsonl
+    python -m package.chess_game_module.selfplay --mode engine --games 20 --depth 2 --book book.bin
+    python -m package.chess_game_module.selfplay --mode scripted --script openings.txt
+    python -m package.chess_game_module.selfplay --games 200 --scaling
+    python -m package.chess_game_module.selfplay --games 100000 --records games.cgr
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+from package.chess_game_module.book import OpeningBook
+from package.chess_game_module.engine import Engine
+from package.chess_game_module.position import Move, Position, move_name
+from package.chess_game_module.records import RecordWriter
+from package.chess_game_module.tablebase import Tablebase
+
+
+def parse_move(position: Position, text: str) -> Move:
+    """
+    Finds the legal move written in coordinate notation.
+
+    Args:
+    position (Position): The position the move is played in.
+    text (str): The move, for example 'e2e4' or 'a7a8n'.
+
+    Returns:
+    Move: The matching legal move.
+
+    Raises:
+    ValueError: If no legal move has this name.
+    """
+    # A missing promotion letter means a queen, as in make_move
+    names = (text, text + 'q') if len(text) == 4 else (text,)
+    locations = position.pieces(position.turn)[1]
+    for name in names:
+        for move in position.legal_moves():
+            if move_name(locations[move[0]], move[1], move[2]) == name:
+                return move
+    raise ValueError(f'illegal move {text!r}')
+
+
+def play_game(spec: Dict[str, object]) -> Dict[str, object]:
+    """
+    Plays one game from start to end.
+
+    Args:
+    spec (Dict[str, object]): 'index' of the game, 'mode' ('random', 'engine' or 'scripted'),
+    'seed' for random games, 'moves' for scripted games, 'depth' and 'time' of the engine,
+    the 'book' and the 'tablebases' directory the engine plays from and 'max_plies' after which
+    the game is drawn.
+
+    Returns:
+    Dict[str, object]: The 'index' and 'mode' of the game, the 'moves' played in coordinate
+    notation, the 'result' ('1-0', '0-1', '1/2-1/2' or '*' for an unfinished script), how it
+    ended ('termination': checkmate, stalemate, repetition, move_limit, end_of_script or
+    illegal_move) and the 'seconds' it took. A script stopped by an illegal move also has the
+    'error', naming the move as it was written.
+    """
+    begin = time.perf_counter()
+    mode = spec['mode']
+    rng = random.Random(spec.get('seed', spec['index']))
+    engine = Engine(1 << 16) if mode == 'engine' else None
+    # Every worker maps the same book, so its pages are shared through the operating system's cache
+    book = OpeningBook(spec['book']) if mode == 'engine' and spec.get('book') else None
+    tablebase = Tablebase(spec['tablebases']) if mode == 'engine' and spec.get('tablebases') else None
+    script = list(spec.get('moves', []))
+    max_plies = int(spec.get('max_plies', 300))
+
+    position = Position()
+    history = [position.key]
+    moves: List[str] = []
+    result, termination, error = '1/2-1/2', 'move_limit', None
+    while len(moves) < max_plies:
+        legal = position.legal_moves()
+        if not legal:
+            if position.in_check(position.turn):
+                result, termination = ('0-1' if position.turn == 'white' else '1-0'), 'checkmate'
+            else:
+                termination = 'stalemate'
+            break
+        if history.count(position.key) >= 3:
+            termination = 'repetition'
+            break
+
+        if mode == 'random':
+            move = rng.choice(legal)
+        elif mode == 'engine':
+            move = book.choose(position, rng) if book else None
+            if move is None and tablebase:
+                move = tablebase.best_move(position)
+            if move is None:
+                move = engine.search(position, float(spec.get('time', 1.0)), int(spec.get('depth', 2)),
+                                     history=history[:-1])['move']
+        else:
+            if len(moves) == len(script):
+                result, termination = '*', 'end_of_script'
+                break
+            try:
+                move = parse_move(position, script[len(moves)])
+            except ValueError as exception:
+                # One bad line of a script must not stop the other games of the batch
+                result, termination, error = '*', 'illegal_move', str(exception)
+                break
+
+        moves.append(move_name(position.pieces(position.turn)[1][move[0]], move[1], move[2]))
+        position.make_move(move)
+        history.append(position.key)
+
+    if book:
+        book.close()
+    if tablebase:
+        tablebase.close()
+    record = {'index': spec['index'], 'mode': mode, 'moves': moves, 'result': result,
+              'termination': termination, 'seconds': time.perf_counter() - begin}
+    if error:
+        record['error'] = error
+    return record
+
+
+def game_specs(mode: str, games: int, seed: int = 0, depth: int = 2, think_time: float = 1.0,
+               max_plies: int = 300, script: Optional[str] = None,
+               book: Optional[str] = None, tablebases: Optional[str] = None) -> List[Dict[str, object]]:
+    """
+    Describes the games of a batch.
+
+    Args:
+    mode (str): 'random', 'engine' or 'scripted'.
+    games (int): Number of games; scripted batches play every line of the script instead.
+    seed (int): Seed of the first random game, the others use the following numbers.
+    depth (int): Search depth of the engine.
+    think_time (float): Seconds the engine may think about every move.
+    max_plies (int): Length after which a game is drawn.
+    script (Optional[str]): Path of the file with the moves of scripted games.
+    book (Optional[str]): Path of the opening book of engine games.
+    tablebases (Optional[str]): Directory of the endgame tables of engine games.
+
+    Returns:
+    List[Dict[str, object]]: One spec for play_game per game.
+    """
+    if mode == 'scripted':
+        with open(script) as file:
+            lines = [line.split() for line in file if line.strip()]
+        return [{'index': index, 'mode': mode, 'moves': moves, 'max_plies': max_plies}
+                for index, moves in enumerate(lines)]
+    return [{'index': index, 'mode': mode, 'seed': seed + index, 'depth': depth, 'time': think_time,
+             'max_plies': max_plies, 'book': book, 'tablebases': tablebases} for index in range(games)]
+
+
+def run_batch(specs: List[Dict[str, object]], workers: Optional[int] = None,
+              output: Optional[str] = None, records: Optional[str] = None) -> Dict[str, float]:
+    """
+    Plays a batch of games over a pool of processes.
+
+    Args:
+    specs (List[Dict[str, object]]): The games, as returned by game_specs.
+    workers (Optional[int]): Number of processes, the number of cores by default.
+    output (Optional[str]): JSON lines file every finished game is appended to, in the order
+    the games finish.
+    records (Optional[str]): Binary record file (see records.py) every finished game is appended to.
+
+    Returns:
+    Dict[str, float]: 'games' played, 'workers' used, wall-clock 'seconds' and 'games_per_second'.
+    """
+    workers = workers or os.cpu_count() or 1
+    file = open(output, 'a') if output else None
+    writer = RecordWriter(records) if records else None
+    begin = time.perf_counter()
+    try:
+        # Fresh interpreters instead of forks, so a caller with pygame running does not pass its SDL state on
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            for record in pool.imap_unordered(play_game, specs):
+                if file:
+                    file.write(json.dumps(record) + '\n')
+                    file.flush()
+                if writer:
+                    writer.write(record['moves'], record['result'], record['termination'])
+    finally:
+        if file:
+            file.close()
+        if writer:
+            writer.close()
+    seconds = time.perf_counter() - begin
+    return {'games': float(len(specs)), 'workers': float(workers), 'seconds': seconds,
+            'games_per_second': len(specs) / seconds}
+
+
+def measure_scaling(specs: List[Dict[str, object]], worker_counts: Iterable[int]) -> List[Dict[str, float]]:
+    """
+    Plays the same batch with different numbers of processes.
+
+    The scaling efficiency of n workers is their throughput divided by n times the
+    throughput of one worker; 1.0 means every added core is fully used.
+
+    Args:
+    specs (List[Dict[str, object]]): The games, as returned by game_specs.
+    worker_counts (Iterable[int]): Numbers of processes to try, the first one should be 1.
+
+    Returns:
+    List[Dict[str, float]]: The run_batch results with an added 'efficiency'.
+    """
+    results = []
+    for workers in worker_counts:
+        result = run_batch(specs, workers)
+        base = results[0] if results else result
+        result['efficiency'] = result['games_per_second'] / (workers / base['workers'] * base['games_per_second'])
+        results.append(result)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Play games without a window over all cores.')
+    parser.add_argument('--mode', choices=['random', 'engine', 'scripted'], default='random')
+    parser.add_argument('--games', type=int, default=100, help='number of games to play')
+    parser.add_argument('--workers', type=int, default=None, help='processes, the number of cores by default')
+    parser.add_argument('--output', default=None, help='JSON lines file the games are appended to')
+    parser.add_argument('--records', default=None, help='binary record file the games are appended to')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first random game')
+    parser.add_argument('--depth', type=int, default=2, help='search depth of the engine')
+    parser.add_argument('--time', type=float, default=1.0, help='seconds the engine thinks per move')
+    parser.add_argument('--max-plies', type=int, default=300, help='length after which a game is drawn')
+    parser.add_argument('--script', default=None, help='file with the moves of scripted games')
+    parser.add_argument('--book', default=None, help='opening book of engine games')
+    parser.add_argument('--tablebases', default=None, help='directory of endgame tables of engine games')
+    parser.add_argument('--scaling', action='store_true', help='compare 1, 2, 4, ... workers up to --workers')
+    args = parser.parse_args(argv)
+    if args.mode == 'scripted' and not args.script:
+        parser.error('--mode scripted needs --script')
+
+    specs = game_specs(args.mode, args.games, args.seed, args.depth, args.time, args.max_plies, args.script,
+                       args.book, args.tablebases)
+    workers = args.workers or os.cpu_count() or 1
+    if args.scaling:
+        counts = sorted({1, workers} | {2 ** power for power in range(workers.bit_length()) if 2 ** power < workers})
+        for result in measure_scaling(specs, counts):
+            print(f"{result['workers']:3.0f} workers  {result['games_per_second']:8.2f} games/s  "
+                  f"efficiency {100 * result['efficiency']:5.1f}%")
+        return 0
+
+    result = run_batch(specs, workers, args.output, args.records)
+    print(f"{result['games']:.0f} games in {result['seconds']:.2f}s with {workers} workers: "
+          f"{result['games_per_second']:.2f} games/s, {result['games_per_second'] / workers:.2f} games/s per core")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
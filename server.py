@@ -0,0 +1,418 @@
+"""
+Asyncio server hosting many networked games in one process.
+
+Every game is a GameSession with its own Position, so any number of games run side by side
+without the module globals of game.py. Clients talk to the server over TCP with one command
+per line; a connection may play or watch any number of games, which is why every command
+names its game. A move is validated with the rules of Position and the attack map of
+legality.py for the moved piece only, and every accepted move is pushed as a one-line delta
+to both players and all spectators of the game.
+
+Protocol, client to server:
+    NEW [white|black]             start a game, playing white by default
+    JOIN <game> [white|black]     take a seat in a game, the free one by default
+    WATCH <game>                  follow a game as a spectator
+    MOVE <game> <move>            play a move in coordinate notation, e.g. e2e4 or a7a8n
+    LEAVE <game>                  give up the seat or stop watching
+    QUIT                          close the connection
+
+Server to client:
+    GAME <game> <white|black|spectator>   answer to NEW, JOIN and WATCH, followed by
+    STATE <game> <fen>                    the current position of the game
+    JOINED <game> <white|black>           a player took a seat in a game you are in
+    LEFT <game> <white|black>             a player left a game you are in
+    MOVED <game> <ply> <move> <status>    a move was played; status is ongoing, checkmate or stalemate
+    ERROR <message>                       the command was rejected
+
+Usage:
+    python -m package.chess_game_module.server --port 8765
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from package.chess_game_module.fen import to_fen
+from package.chess_game_module.legality import AttackMap, game_status
+from package.chess_game_module.position import PROMOTION_PIECES, Position, move_name, parse_square
+from package.chess_game_module.records import PROMOTION_LETTERS
+
+MAX_LINE = 256  # longest command accepted, in bytes
+MAX_WRITE_BUFFER = 1 << 20  # bytes waiting for a client that does not read before it is dropped
+COLORS = ('white', 'black')
+FILES, RANKS = 'abcdefgh', '12345678'
+
+
+class Connection:
+    """
+    One connected client and the games it plays or watches.
+    """
+    __slots__ = ('writer', 'games')
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.games: Dict[int, str] = {}  # game -> 'white', 'black' or 'spectator'
+
+    def send(self, line: str) -> None:
+        """
+        Queues a line for the client without waiting for it to be sent.
+
+        A client that stops reading is disconnected once MAX_WRITE_BUFFER bytes wait for it,
+        so a stalled spectator cannot make the server keep every move of every game it watches.
+
+        Args:
+        line (str): The line, without its newline.
+        """
+        if self.writer.is_closing():
+            return
+        self.writer.write(line.encode() + b'\n')
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.writer.close()
+
+
+class GameSession:
+    """
+    State of one networked game: its position, moves, players and spectators.
+    """
+    __slots__ = ('game_id', 'position', 'moves', 'players', 'spectators', 'status')
+
+    def __init__(self, game_id: int) -> None:
+        self.game_id = game_id
+        self.position = Position()
+        self.moves: List[str] = []  # in coordinate notation
+        self.players: Dict[str, Connection] = {}  # color -> connection
+        self.spectators: List[Connection] = []
+        self.status = 'ongoing'  # 'ongoing', 'checkmate' or 'stalemate'
+
+    def subscribers(self) -> List[Connection]:
+        """
+        Returns:
+        List[Connection]: The players and spectators of the game.
+        """
+        return [*self.players.values(), *self.spectators]
+
+    def play(self, text: str) -> str:
+        """
+        Validates and plays a move of the side to move.
+
+        Only the moves of the piece on the start square are generated, and only the target
+        is checked against the attack map, so a move costs far less than listing all legal moves.
+
+        Args:
+        text (str): The move in coordinate notation. A pawn reaching the last row without a
+        promotion letter becomes a queen.
+
+        Returns:
+        str: The status of the game after the move: 'ongoing', 'checkmate' or 'stalemate'.
+
+        Raises:
+        ValueError: If the game is over or the move is not legal.
+        """
+        if self.status != 'ongoing':
+            raise ValueError('the game is over')
+        start, target, letter = _parse_move(text)
+        position = self.position
+        color = position.turn
+        pieces = position.pieces(color)[0]
+        index = position.piece_index(start, color)
+        if index is None:
+            raise ValueError(f'no {color} piece on {text[:2]}')
+        if target not in position.check_piece_move(index, color) or not AttackMap(position).filter(index, [target]):
+            raise ValueError(f'illegal move {text}')
+        promotion = None
+        if pieces[index] == 'pawn' and (target[1] == 0 or target[1] == 7):
+            promotion = PROMOTION_PIECES[PROMOTION_LETTERS.index(letter)] if letter else 'queen'
+        elif letter:
+            raise ValueError(f'illegal move {text}')
+        position.make_move((index, target, promotion))
+        self.moves.append(move_name(start, target, promotion))
+        self.status = game_status(position)
+        return self.status
+
+
+def _parse_move(text: str) -> Tuple[Tuple[int, int], Tuple[int, int], Optional[str]]:
+    """
+    Reads the squares of a move in coordinate notation without looking at a position.
+
+    Args:
+    text (str): The move, for example 'e2e4' or 'a7a8n'.
+
+    Returns:
+    Tuple[Tuple[int, int], Tuple[int, int], Optional[str]]: The start and target squares as (x, y)
+    and the promotion letter, if any.
+
+    Raises:
+    ValueError: If the text is not a move.
+    """
+    if len(text) not in (4, 5) or text[0] not in FILES or text[2] not in FILES or text[1] not in RANKS or \
+            text[3] not in RANKS or text[4:] not in ('', *PROMOTION_LETTERS):
+        raise ValueError(f'invalid move {text!r}')
+    return parse_square(text[:2]), parse_square(text[2:4]), text[4:] or None
+
+
+class GameServer:
+    """
+    Hosts any number of games for the clients connected over TCP.
+
+    Attributes:
+    games (Dict[int, GameSession]): The games, by number. A game is forgotten when its last
+    player or spectator leaves.
+    validation_times (Optional[List[float]]): When set to a list, the seconds spent validating
+    and playing every MOVE are appended to it, for the load test.
+    """
+
+    def __init__(self) -> None:
+        self.games: Dict[int, GameSession] = {}
+        self._game_ids = itertools.count(1)
+        self.validation_times: Optional[List[float]] = None
+        self._commands = {'NEW': self._new, 'JOIN': self._join, 'WATCH': self._watch, 'MOVE': self._move,
+                          'LEAVE': self._leave}
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765) -> asyncio.AbstractServer:
+        """
+        Starts accepting clients.
+
+        Args:
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 for any free port.
+
+        Returns:
+        asyncio.AbstractServer: The listening server; its sockets tell the port.
+        """
+        return await asyncio.start_server(self._handle_client, host, port, limit=MAX_LINE)
+
+    def create_game(self) -> GameSession:
+        """
+        Returns:
+        GameSession: A new game at the starting position, without players.
+        """
+        game = GameSession(next(self._game_ids))
+        self.games[game.game_id] = game
+        return game
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Runs the commands of one client until it quits or disconnects.
+        """
+        connection = Connection(writer)
+        try:
+            while not writer.is_closing():
+                line = await reader.readline()
+                if not line or not self.execute(connection, line.decode(errors='replace')):
+                    break
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # reset by the client, or a line longer than MAX_LINE
+        finally:
+            for game_id in list(connection.games):
+                self._remove(connection, game_id)
+            writer.close()
+
+    def execute(self, connection: Connection, line: str) -> bool:
+        """
+        Runs one command of a client; the answers are queued on its connection.
+
+        Args:
+        connection (Connection): The client.
+        line (str): The command.
+
+        Returns:
+        bool: False when the client asked to close the connection.
+        """
+        words = line.split()
+        if not words:
+            return True
+        if words[0] == 'QUIT':
+            return False
+        command = self._commands.get(words[0])
+        try:
+            if command is None:
+                raise ValueError(f'unknown command {words[0]}')
+            command(connection, words[1:])
+        except ValueError as error:
+            connection.send(f'ERROR {error}')
+        return True
+
+    def _game(self, words: List[str]) -> GameSession:
+        """
+        Finds the game named by the first argument of a command.
+
+        Raises:
+        ValueError: If there is no such game.
+        """
+        if not words or not words[0].isdigit() or int(words[0]) not in self.games:
+            raise ValueError(f"no game {words[0] if words else ''}".rstrip())
+        return self.games[int(words[0])]
+
+    def _enter(self, connection: Connection, game: GameSession, role: str) -> None:
+        """
+        Seats a client in a game, or makes it a spectator, and tells everyone in the game.
+        """
+        if game.game_id in connection.games:
+            raise ValueError(f'already in game {game.game_id}')
+        if role == 'spectator':
+            game.spectators.append(connection)
+        else:
+            for other in game.subscribers():
+                other.send(f'JOINED {game.game_id} {role}')
+            game.players[role] = connection
+        connection.games[game.game_id] = role
+        connection.send(f'GAME {game.game_id} {role}')
+        connection.send(f'STATE {game.game_id} {to_fen(game.position)}')
+
+    def _remove(self, connection: Connection, game_id: int) -> None:
+        """
+        Takes a client out of a game, forgetting the game when nobody is left in it.
+        """
+        role = connection.games.pop(game_id)
+        game = self.games[game_id]
+        if role == 'spectator':
+            game.spectators.remove(connection)
+        else:
+            del game.players[role]
+            for other in game.subscribers():
+                other.send(f'LEFT {game_id} {role}')
+        if not game.players and not game.spectators:
+            del self.games[game_id]
+
+    def _new(self, connection: Connection, words: List[str]) -> None:
+        """
+        Starts a game: NEW [white|black].
+        """
+        color = words[0] if words else 'white'
+        if color not in COLORS:
+            raise ValueError(f'unknown color {color}')
+        self._enter(connection, self.create_game(), color)
+
+    def _join(self, connection: Connection, words: List[str]) -> None:
+        """
+        Takes a seat in a game: JOIN <game> [white|black].
+        """
+        game = self._game(words)
+        free = [color for color in COLORS if color not in game.players]
+        color = words[1] if len(words) > 1 else (free[0] if free else 'white')
+        if color not in COLORS:
+            raise ValueError(f'unknown color {color}')
+        if color not in free:
+            raise ValueError(f'{color} is taken in game {game.game_id}')
+        self._enter(connection, game, color)
+
+    def _watch(self, connection: Connection, words: List[str]) -> None:
+        """
+        Follows a game: WATCH <game>.
+        """
+        self._enter(connection, self._game(words), 'spectator')
+
+    def _move(self, connection: Connection, words: List[str]) -> None:
+        """
+        Plays a move and pushes it to everyone in the game: MOVE <game> <move>.
+        """
+        game = self._game(words)
+        if len(words) != 2:
+            raise ValueError('MOVE needs a game and a move')
+        role = connection.games.get(game.game_id)
+        if role not in COLORS:
+            raise ValueError(f'not a player of game {game.game_id}')
+        if role != game.position.turn:
+            raise ValueError(f'not your turn in game {game.game_id}')
+        begin = time.perf_counter()
+        status = game.play(words[1])
+        if self.validation_times is not None:
+            self.validation_times.append(time.perf_counter() - begin)
+        delta = f'MOVED {game.game_id} {len(game.moves)} {game.moves[-1]} {status}'
+        for subscriber in game.subscribers():
+            subscriber.send(delta)
+
+    def _leave(self, connection: Connection, words: List[str]) -> None:
+        """
+        Gives up a seat or stops watching: LEAVE <game>.
+        """
+        game = self._game(words)
+        if game.game_id not in connection.games:
+            raise ValueError(f'not in game {game.game_id}')
+        self._remove(connection, game.game_id)
+
+
+class GameClient:
+    """
+    Minimal client of the line protocol, used by the tests and the load test.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> 'GameClient':
+        """
+        Args:
+        host (str): Address of the server.
+        port (int): Port of the server.
+
+        Returns:
+        GameClient: The connected client.
+        """
+        return cls(*await asyncio.open_connection(host, port))
+
+    def send(self, line: str) -> None:
+        """
+        Queues a command; it is sent when the client next waits for an answer.
+
+        Args:
+        line (str): The command, without its newline.
+        """
+        self.writer.write(line.encode() + b'\n')
+
+    async def receive(self) -> List[str]:
+        """
+        Waits for the next line from the server.
+
+        Returns:
+        List[str]: The words of the line, empty when the server closed the connection.
+        """
+        await self.writer.drain()
+        return (await self.reader.readline()).decode().split()
+
+    async def close(self) -> None:
+        """
+        Closes the connection.
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def _serve_forever(host: str, port: int) -> None:
+    """
+    Runs a game server until the task is cancelled.
+    """
+    server = await GameServer().serve(host, port)
+    print(f"serving games on {', '.join(str(socket.getsockname()) for socket in server.sockets)}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: runs the server until it is interrupted.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Host chess games over TCP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,601 @@
+"""
+Endgame tablebases for a king and one piece against a lone king.
+
+generate_table enumerates every placement of the three pieces of a material signature
+(KQK, KRK or KPK) and solves them all by retrograde analysis: starting from the checkmates,
+it walks the moves backwards, so a position is won in n + 1 plies when a move leads to a
+position lost in n, and lost when every move leads to a won one. The moves are taken from
+the precomputed attack tables of attack_tables.py, the same ones the bitboard backend uses.
+KPK positions where the pawn promotes are looked up in the KQK and KRK tables.
+
+The distance to mate of every position is stored as one byte. Only one position out of
+every group of mirror images is written: tables without pawns keep the positions with the
+strong king in the 10 squares of the triangle a1-d1-d4 (8 board symmetries), KPK those with
+the pawn on files a-d (the left-right mirror). The strong side is white in the files;
+positions where black has the extra piece are probed with the board flipped.
+
+Layout of a table file: TABLE_HEADER, the values of all positions with the strong side to
+move, then of all positions with the lone king to move. A value is 0 for a draw, INVALID for
+an impossible placement and otherwise the number of plies to mate plus one.
+
+Castling rights are not part of a position here; the tables assume they are gone.
+
+Usage:
+    python -m package.chess_game_module.tablebase --directory tables
+    python -m package.chess_game_module.tablebase --directory tables --probe "8/8/8/4k3/8/8/8/KQ6 w - -"
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from package.chess_game_module.attack_tables import KING_ATTACKS, PAWN_ATTACKS, queen_attacks, rook_attacks
+from package.chess_game_module.engine import MATE_SCORE
+from package.chess_game_module.fen import from_fen
+from package.chess_game_module.position import Move, Position, move_name
+
+SIGNATURES = {'KQK': 'queen', 'KRK': 'rook', 'KPK': 'pawn'}  # extra piece of the strong side
+DEPENDENCIES = {'KPK': ['KQK', 'KRK']}  # tables a pawn promotes into
+DRAWN_PIECES = {'bishop', 'knight'}  # a king and one of these cannot mate a lone king
+TABLE_HEADER = struct.Struct('<4s4s')  # file tag, material signature
+TABLE_TAG = b'CTB\x01'
+INVALID = 255
+ESCAPE = 64  # moves left of a position where the lone king can take the piece, so it is never lost
+SPLIT_SIZE = 2048  # smallest frontier a pass is split between the workers for
+
+
+def _square(x: int, y: int) -> int:
+    return y * 8 + x
+
+
+def _symmetry(square: int) -> List[int]:
+    """
+    Finds the board symmetry that brings a square into the triangle a1-d1-d4.
+
+    Args:
+    square (int): Bit index y * 8 + x of the square of the strong king.
+
+    Returns:
+    List[int]: The image of every square under the symmetry.
+    """
+    mirror_x, mirror_y = (square & 7) > 3, (square >> 3) > 3
+    x, y = 7 - (square & 7) if mirror_x else square & 7, 7 - (square >> 3) if mirror_y else square >> 3
+    transpose = y > x
+    images = []
+    for index in range(64):
+        x, y = index & 7, index >> 3
+        x, y = 7 - x if mirror_x else x, 7 - y if mirror_y else y
+        images.append(_square(y, x) if transpose else _square(x, y))
+    return images
+
+
+SYMMETRIES = [_symmetry(square) for square in range(64)]
+TRIANGLE = [_square(x, y) for x in range(4) for y in range(x + 1)]  # a1-d1-d4 in our coordinates
+TRIANGLE_INDEX = {square: i for i, square in enumerate(TRIANGLE)}
+PAWN_SQUARES = [_square(x, y) for x in range(4) for y in range(1, 7)]  # files a-d, ranks 2-7
+PAWN_INDEX = {square: i for i, square in enumerate(PAWN_SQUARES)}
+MIRROR = [_square(7 - (index & 7), index >> 3) for index in range(64)]
+
+
+def section_size(signature: str) -> int:
+    """
+    Returns the number of positions stored for each side to move.
+
+    Args:
+    signature (str): Material signature, for example 'KQK'.
+
+    Returns:
+    int: The size of a section of the table file in bytes.
+    """
+    return (len(PAWN_SQUARES) if SIGNATURES[signature] == 'pawn' else len(TRIANGLE)) * 64 * 64
+
+
+def table_index(signature: str, king: int, lone_king: int, piece: int) -> int:
+    """
+    Finds where a position is stored in its section of a table file.
+
+    Args:
+    signature (str): Material signature.
+    king (int): Bit index of the strong king, with the strong side playing white.
+    lone_king (int): Bit index of the lone king.
+    piece (int): Bit index of the extra piece.
+
+    Returns:
+    int: Offset of the position in its section.
+    """
+    if SIGNATURES[signature] == 'pawn':
+        if piece & 7 > 3:
+            king, lone_king, piece = MIRROR[king], MIRROR[lone_king], MIRROR[piece]
+        return (PAWN_INDEX[piece] * 64 + king) * 64 + lone_king
+    images = SYMMETRIES[king]
+    return (TRIANGLE_INDEX[images[king]] * 64 + images[lone_king]) * 64 + images[piece]
+
+
+def _table_path(directory: str, signature: str) -> str:
+    return os.path.join(directory, signature + '.tb')
+
+
+def _read_black_section(directory: str, signature: str) -> bytes:
+    """
+    Reads the values of the positions with the lone king to move.
+
+    Args:
+    directory (str): Directory of the tables.
+    signature (str): Material signature.
+
+    Returns:
+    bytes: The section, indexed by table_index.
+    """
+    with open(_table_path(directory, signature), 'rb') as file:
+        file.seek(TABLE_HEADER.size + section_size(signature))
+        return file.read(section_size(signature))
+
+
+def _mark(signature: str, kings: Iterable[int], white, black, moves_left) -> List[int]:
+    """
+    Marks the impossible placements, counts the moves of the lone king and finds the checkmates.
+
+    Args:
+    signature (str): Material signature.
+    kings (Iterable[int]): Squares of the strong king to do; only their positions are written.
+    white, black, moves_left: The values and move counters of generate_table.
+
+    Returns:
+    List[int]: The checkmates, lost in 0 plies.
+    """
+    piece = SIGNATURES[signature]
+    pawn = piece == 'pawn'
+    attacks_of = rook_attacks if piece == 'rook' else queen_attacks
+    frontier = []
+    for king in kings:
+        king_zone = KING_ATTACKS[king] | 1 << king
+        for square in range(64):
+            base = king << 12 | square
+            if square == king or pawn and not 8 <= square < 56:
+                for lone_king in range(64):
+                    white[base | lone_king << 6] = black[base | lone_king << 6] = INVALID
+                continue
+            # Attacks with the lone king off the board, so it cannot hide behind itself
+            attacks = PAWN_ATTACKS['white'][square] if pawn else attacks_of(square, 1 << king)
+            guarded = king_zone | attacks
+            piece_bit = 1 << square
+            for lone_king in range(64):
+                i = base | lone_king << 6
+                lone_bit = 1 << lone_king
+                if lone_bit & (king_zone | piece_bit):
+                    white[i] = black[i] = INVALID
+                    continue
+                in_check = attacks & lone_bit
+                if in_check:
+                    white[i] = INVALID  # the lone king cannot be in check with the strong side to move
+                targets = KING_ATTACKS[lone_king] & ~guarded
+                if targets & piece_bit:
+                    moves_left[i] = ESCAPE
+                    continue
+                moves_left[i] = count = bin(targets).count('1')
+                if count == 0 and in_check:
+                    black[i] = 1
+                    frontier.append(i)
+    return frontier
+
+
+def _strong_moves(signature: str, frontier: Iterable[int], value: int, white) -> List[int]:
+    """
+    Marks every strong-side move into a lost position as won.
+
+    The lone king does not move, so frontier positions split by its square write disjoint
+    parts of white.
+
+    Args:
+    signature (str): Material signature.
+    frontier (Iterable[int]): Positions lost with the lone king to move.
+    value (int): The value of the positions won by a move into them.
+    white: The values of the positions with the strong side to move.
+
+    Returns:
+    List[int]: The positions newly won.
+    """
+    piece = SIGNATURES[signature]
+    pawn = piece == 'pawn'
+    attacks_of = rook_attacks if piece == 'rook' else queen_attacks
+    reached = []
+    for i in frontier:
+        king, lone_king, square = i >> 12, i >> 6 & 63, i & 63
+        occupied = 1 << king | 1 << lone_king | 1 << square
+        rest = lone_king << 6 | square
+        sources = KING_ATTACKS[king] & ~occupied
+        while sources:
+            bit = sources & -sources
+            sources ^= bit
+            j = (bit.bit_length() - 1) << 12 | rest
+            if white[j] == 0:
+                white[j] = value
+                reached.append(j)
+        rest = king << 12 | lone_king << 6
+        if pawn:
+            sources = 0
+            if square < 48 and not occupied >> (square + 8) & 1:
+                sources = 1 << (square + 8)
+                if square >> 3 == 4 and not occupied >> (square + 16) & 1:
+                    sources |= 1 << (square + 16)
+        else:
+            sources = attacks_of(square, occupied) & ~occupied
+        while sources:
+            bit = sources & -sources
+            sources ^= bit
+            j = rest | bit.bit_length() - 1
+            if white[j] == 0:
+                white[j] = value
+                reached.append(j)
+    return reached
+
+
+def _lone_moves(frontier: Iterable[int], value: int, black, moves_left) -> List[int]:
+    """
+    Marks a lone king position as lost once its last move leads into a won position.
+
+    The strong king does not move, so frontier positions split by its square write disjoint
+    parts of black and moves_left.
+
+    Args:
+    frontier (Iterable[int]): Positions won with the strong side to move.
+    value (int): The value of the positions lost.
+    black, moves_left: The values and move counters of the positions with the lone king to move.
+
+    Returns:
+    List[int]: The positions newly lost.
+    """
+    reached = []
+    for i in frontier:
+        king, lone_king, square = i >> 12, i >> 6 & 63, i & 63
+        rest = king << 12 | square
+        sources = KING_ATTACKS[lone_king] & ~(KING_ATTACKS[king] | 1 << king | 1 << square)
+        while sources:
+            bit = sources & -sources
+            sources ^= bit
+            j = rest | (bit.bit_length() - 1) << 6
+            if black[j] == 0:
+                moves_left[j] -= 1
+                if moves_left[j] == 0:
+                    black[j] = value
+                    reached.append(j)
+    return reached
+
+
+_arrays: List[memoryview] = []  # white, black and moves_left of the table being solved, in a worker process
+
+
+def _attach(*arrays) -> None:
+    """
+    Pool initializer: maps the shared arrays of generate_table into a worker.
+    """
+    _arrays[:] = [memoryview(array).cast('B') for array in arrays]
+
+
+def _solve(step: str, signature: str, items: List[int], value: int, white, black, moves_left) -> List[int]:
+    """
+    Runs one pass of generate_table, or a slice of it.
+
+    Args:
+    step (str): 'mark', 'strong' or 'lone'.
+    signature (str): Material signature.
+    items (List[int]): The strong king squares to mark, or the frontier positions to move back from.
+    value (int): The value written to the positions reached.
+    white, black, moves_left: The values and move counters of generate_table.
+
+    Returns:
+    List[int]: The positions reached, as returned by the pass.
+    """
+    if step == 'mark':
+        return _mark(signature, items, white, black, moves_left)
+    if step == 'strong':
+        return _strong_moves(signature, items, value, white)
+    return _lone_moves(items, value, black, moves_left)
+
+
+def _solve_slice(task: Tuple[str, str, List[int], int]) -> List[int]:
+    """
+    Runs a slice of a pass in a worker, on the arrays mapped by _attach.
+
+    Args:
+    task (Tuple[str, str, List[int], int]): The step, signature, items and value of _solve.
+
+    Returns:
+    List[int]: The positions reached.
+    """
+    return _solve(*task, *_arrays)
+
+
+def generate_table(signature: str, directory: str, workers: int = 1) -> Dict[str, object]:
+    """
+    Solves every position of a material signature and writes its table file.
+
+    The positions are solved on the whole board, indexed by king << 12 | lone_king << 6 | piece,
+    and only the positions of table_index are written. KPK needs the KQK and KRK tables in
+    the same directory. With several workers every pass is split between them by king square:
+    the strong-side moves by the square of the lone king, the lone king moves by the square of
+    the strong king, so each worker writes its own part of the shared arrays.
+
+    Args:
+    signature (str): 'KQK', 'KRK' or 'KPK'.
+    directory (str): Directory the table is written to.
+    workers (int): Number of processes; 1 solves in this process.
+
+    Returns:
+    Dict[str, object]: The 'signature', 'seconds' taken, 'bytes' of the file, number of
+    legal 'positions' and 'wins' among them, and the longest mate in 'max_plies'.
+    """
+    begin = time.perf_counter()
+    pawn = SIGNATURES[signature] == 'pawn'
+    pool = None
+    if workers > 1:
+        context = multiprocessing.get_context('spawn')
+        shared = [context.RawArray('B', 1 << 18) for _ in range(3)]
+        pool = context.Pool(workers, initializer=_attach, initargs=shared)
+        white, black, moves_left = [memoryview(array).cast('B') for array in shared]
+    else:
+        white = bytearray(1 << 18)  # values of the positions with the strong side to move
+        black = bytearray(1 << 18)  # values of the positions with the lone king to move
+        moves_left = bytearray(1 << 18)  # moves of the lone king not yet known to lose
+
+    def run(step: str, items: List[int], value: int, slice_of: Callable[[int], int]) -> List[int]:
+        # Passes with a small frontier are not worth sending to the pool
+        if pool is None or step != 'mark' and len(items) < SPLIT_SIZE:
+            return _solve(step, signature, items, value, white, black, moves_left)
+        slices: List[List[int]] = [[] for _ in range(workers)]
+        for item in items:
+            slices[slice_of(item) % workers].append(item)
+        tasks = [(step, signature, part, value) for part in slices if part]
+        return [i for reached in pool.map(_solve_slice, tasks) for i in reached]
+
+    try:
+        frontier = run('mark', list(range(64)), 0, lambda king: king)
+
+        # Promotions lead into other tables: plies to mate -> positions won by promoting
+        promotions: Dict[int, List[int]] = {}
+        if pawn:
+            tables = [(other, _read_black_section(directory, other)) for other in DEPENDENCIES[signature]]
+            for king in range(64):
+                for square in range(8, 16):
+                    target = square - 8
+                    for lone_king in range(64):
+                        i = king << 12 | lone_king << 6 | square
+                        if white[i] == INVALID or target == king or target == lone_king:
+                            continue
+                        values = [table[table_index(other, king, lone_king, target)] for other, table in tables]
+                        values = [value for value in values if 0 < value < INVALID]
+                        if values:
+                            promotions.setdefault(min(values), []).append(i)
+
+        # Retrograde analysis, one ply at a time
+        plies = 0
+        last_promotion = max(promotions, default=0)
+        while frontier or plies < last_promotion:
+            value = plies + 2
+            if value >= INVALID:
+                raise ValueError(f'{signature} has mates longer than a byte can hold')
+            if plies % 2 == 0:
+                reached = run('strong', frontier, value, lambda i: i >> 6 & 63)
+                for j in promotions.get(plies + 1, ()):
+                    if white[j] == 0:
+                        white[j] = value
+                        reached.append(j)
+            else:
+                reached = run('lone', frontier, value, lambda i: i >> 12)
+            frontier = reached
+            plies += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if pawn:
+        order = [king << 12 | lone_king << 6 | square for square in PAWN_SQUARES
+                 for king in range(64) for lone_king in range(64)]
+    else:
+        order = [king << 12 | lone_king << 6 | square for king in TRIANGLE
+                 for lone_king in range(64) for square in range(64)]
+    os.makedirs(directory, exist_ok=True)
+    path = _table_path(directory, signature)
+    with open(path, 'wb') as file:
+        file.write(TABLE_HEADER.pack(TABLE_TAG, signature.encode()))
+        file.write(bytes(map(white.__getitem__, order)))
+        file.write(bytes(map(black.__getitem__, order)))
+    values = bytes(white) + bytes(black)
+    wins = len(values) - values.count(0) - values.count(INVALID)
+    return {'signature': signature, 'seconds': time.perf_counter() - begin, 'bytes': os.path.getsize(path),
+            'positions': len(values) - values.count(INVALID), 'wins': wins,
+            'max_plies': max(value for value in values if value != INVALID) - 1}
+
+
+def generate(signatures: Iterable[str], directory: str, workers: Optional[int] = None) -> List[Dict[str, object]]:
+    """
+    Generates several tables, each one split over a pool of processes.
+
+    A table is started once the tables it promotes into are written. Missing dependencies
+    are added.
+
+    Args:
+    signatures (Iterable[str]): Material signatures to generate.
+    directory (str): Directory the tables are written to.
+    workers (Optional[int]): Number of processes, the number of cores by default; 1 generates
+    in this process.
+
+    Returns:
+    List[Dict[str, object]]: The generate_table report of every table, in the order they finished.
+    """
+    remaining = []
+    for signature in signatures:
+        for dependency in DEPENDENCIES.get(signature, []):
+            if dependency not in remaining and not os.path.exists(_table_path(directory, dependency)):
+                remaining.append(dependency)
+        if signature not in remaining:
+            remaining.append(signature)
+    workers = workers or os.cpu_count() or 1
+    # Dependencies come before the tables that need them
+    return [generate_table(signature, directory, workers) for signature in remaining]
+
+
+class Tablebase:
+    """
+    Probes the tables of a directory, memory-mapping each one the first time it is needed.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+        directory (str): Directory with the table files.
+        """
+        self.directory = directory
+        self._tables: Dict[str, Optional[mmap.mmap]] = {}
+
+    def _table(self, signature: str) -> Optional[mmap.mmap]:
+        """
+        Maps a table file.
+
+        Args:
+        signature (str): Material signature.
+
+        Returns:
+        Optional[mmap.mmap]: The file, None when it has not been generated.
+
+        Raises:
+        ValueError: If the file is not the table of the signature.
+        """
+        if signature not in self._tables:
+            path = _table_path(self.directory, signature)
+            table = None
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if table[:TABLE_HEADER.size] != TABLE_HEADER.pack(TABLE_TAG, signature.encode()) or \
+                        len(table) != TABLE_HEADER.size + 2 * section_size(signature):
+                    table.close()
+                    raise ValueError(f'{path} is not the {signature} table')
+            self._tables[signature] = table
+        return self._tables[signature]
+
+    def probe(self, position: Position) -> Optional[int]:
+        """
+        Looks up the value of a position.
+
+        Args:
+        position (Position): The position, with at most three pieces.
+
+        Returns:
+        Optional[int]: The score for the side to move on the scale of the engine: MATE_SCORE
+        minus the plies to mate when it mates, the negative of that when it is mated and 0 for
+        a draw. None when the material is not covered by a generated table.
+        """
+        if position.turn != 'white' and position.turn != 'black':
+            return None
+        white, black = position.white_pieces, position.black_pieces
+        if len(white) + len(black) > 3:
+            return None
+        if len(white) == 1 and len(black) == 1:
+            return 0
+        strong = 'white' if len(white) == 2 else 'black'
+        pieces, locations = position.pieces(strong)
+        lone_king = position.pieces('black' if strong == 'white' else 'white')[1][0]
+        extra = 1 - pieces.index('king')
+        if pieces[extra] in DRAWN_PIECES:
+            return 0
+        signature = 'K' + {'queen': 'Q', 'rook': 'R', 'pawn': 'P'}[pieces[extra]] + 'K'
+        table = self._table(signature)
+        if table is None:
+            return None
+
+        # The strong side plays white in the tables, so black's pieces are seen with the board flipped
+        squares = [locations[1 - extra], lone_king, locations[extra]]
+        squares = [_square(x, y if strong == 'white' else 7 - y) for x, y in squares]
+        section = 0 if position.turn == strong else section_size(signature)
+        value = table[TABLE_HEADER.size + section + table_index(signature, *squares)]
+        if value == INVALID:
+            return None
+        if value == 0:
+            return 0
+        plies = value - 1
+        return MATE_SCORE - plies if position.turn == strong else plies - MATE_SCORE
+
+    def best_move(self, position: Position) -> Optional[Move]:
+        """
+        Finds the move with the best value in the tables: the fastest mate when winning, the
+        slowest when losing.
+
+        Args:
+        position (Position): The position.
+
+        Returns:
+        Optional[Move]: The move, None when the position or one after a move is not covered.
+        """
+        if self.probe(position) is None:
+            return None
+        best, best_score = None, None
+        for move in position.legal_moves():
+            undo = position.make_move(move)
+            score = self.probe(position)
+            position.unmake_move(undo)
+            if score is None:
+                return None
+            # One ply further from mate than the position the move leads to
+            score = -score - 1 if score < 0 else -score + 1 if score > 0 else 0
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return best
+
+    def close(self) -> None:
+        """
+        Unmaps the tables.
+        """
+        for table in self._tables.values():
+            if table is not None:
+                table.close()
+        self._tables.clear()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: generates tables and reports their size and generation time,
+    or probes a position.
+
+    Args:
+    argv (Optional[List[str]]): Command-line arguments, sys.argv by default.
+
+    Returns:
+    int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Generate or probe endgame tablebases.')
+    parser.add_argument('signatures', nargs='*', default=list(SIGNATURES), help='tables to generate')
+    parser.add_argument('--directory', default='tablebases', help='directory of the table files')
+    parser.add_argument('--workers', type=int, default=None, help='processes, the number of cores by default')
+    parser.add_argument('--probe', default=None, help='FEN of a position to look up instead')
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        position = from_fen(args.probe)
+        tablebase = Tablebase(args.directory)
+        score = tablebase.probe(position)
+        move = tablebase.best_move(position)
+        tablebase.close()
+        if score is None:
+            print('not in the tables')
+            return 1
+        outcome = 'draw' if score == 0 else f'{"win" if score > 0 else "loss"} in {MATE_SCORE - abs(score)} plies'
+        best = '' if move is None else ', best move ' + move_name(position.pieces(position.turn)[1][move[0]], *move[1:])
+        print(outcome + best)
+        return 0
+
+    begin = time.perf_counter()
+    for report in generate(args.signatures, args.directory, args.workers):
+        print(f"{report['signature']}: {report['seconds']:.1f}s, {report['bytes']} bytes, "
+              f"{report['positions']} positions, {report['wins']} won, longest mate {report['max_plies']} plies")
+    print(f'done in {time.perf_counter() - begin:.1f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,37 @@
+import asyncio
+import copy
+import json
+import random
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from package.chess_game_module.game import (check_pawn_move, white_pieces_locations, black_pieces_locations,
-                                            check_all_moves, check_rook_move,
-                                            check_knight_move, check_bishop_move, check_queen_move, check_king_move)
+try:
+    import numpy
+except ImportError:  # the batch generator is optional
+    numpy = None
+from package.chess_game_module.analysis import Analysis, format_analysis
+from package.chess_game_module.attack_tables import (bishop_attacks, build_tables, load_tables, ray_attacks,
+                                                     rook_attacks)
+from package.chess_game_module.bitboard import random_positions, ray_moves
+from package.chess_game_module.book import OpeningBook, build_book
+from package.chess_game_module.engine import MATE_SCORE, Engine
+from package.chess_game_module.fen import from_fen, pack_fen, read_fens, to_fen
+from package.chess_game_module.instrumentation import Instrumentation
+from package.chess_game_module.legality import AttackMap, game_status, legal_moves_by_playing
+from package.chess_game_module.parallel import ParallelSearch, SharedTable
+from package.chess_game_module.pgn import check_archive, read_games
+from package.chess_game_module.perft import REFERENCE_POSITIONS, perft
+from package.chess_game_module.mailbox_board import Mailbox, PositionStore
+from package.chess_game_module.records import GameRecords, RecordWriter, encode_move, pack_move, unpack_move
+from package.chess_game_module.position import (BISHOP_DIRECTIONS, ROOK_DIRECTIONS, Position, move_name, opponent,
+                                                parse_square)
+from package.chess_game_module.selfplay import parse_move, play_game, run_batch
+from package.chess_game_module.server import GameClient, GameServer
+from package.chess_game_module.tablebase import Tablebase, generate
+from package.chess_game_module.zobrist import compute_key
 
 
 class TestChessGame(unittest.TestCase):
@@ -16,24 +46,40 @@ class TestChessGame(unittest.TestCase):
         self.default_black_pieces_locations = [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0),
                                                (0, 1), (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1)]
 
-        white_pieces_locations.clear()
-        black_pieces_locations.clear()
-        white_pieces_locations.extend(self.default_white_pieces_locations)
-        black_pieces_locations.extend(self.default_black_pieces_locations)
+        self.position = Position()
+        self.position.white_pieces_locations.clear()
+        self.position.black_pieces_locations.clear()
+        self.position.white_pieces_locations.extend(self.default_white_pieces_locations)
+        self.position.black_pieces_locations.extend(self.default_black_pieces_locations)
+        # The lists were edited by hand, so the board the move rules read has to follow them
+        self.position.sync_board()
 
     def test_pawn_blocked(self):
         """
         Test that a pawn cannot move forward if blocked.
         """
         # Place a black piece directly in front of a white pawn
-        black_pieces_locations.append((1, 5))  # Assuming black piece is at (1, 5), blocking the white pawn at (1, 6)
+        # Assuming black piece is at (1, 5), blocking the white pawn at (1, 6)
+        self.position.black_pieces.append('pawn')
+        self.position.black_pieces_locations.append((1, 5))
+        self.position.sync_board()
 
-        result = check_pawn_move(9, 'white')  # Index 9 corresponds to the pawn at (1, 6)
+        result = self.position.check_pawn_move(9, 'white')  # Index 9 corresponds to the pawn at (1, 6)
         self.assertNotIn((1, 5), result)  # Pawn should not be able to move to (1, 5)
 
+    def test_hand_edited_lists_reach_every_generator(self):
+        """
+        After editing the lists and calling sync_board, pawns and pieces see the same board.
+        """
+        # Take the white pawn in front of the rook on (0, 7) off the board
+        del self.position.white_pieces[8], self.position.white_pieces_locations[8]
+        self.position.sync_board()
+        self.assertEqual(sorted(self.position.check_rook_move(0, 'white')), [(0, y) for y in range(1, 7)])
+        self.assertTrue(self.position.is_attacked((0, 1), 'white'))
+
     def test_pawn_move_starting_position(self):
         # Assuming white pawn at (1,6), expected to move to (1,5) or (1,4)
-        result = check_pawn_move(9, 'white')  # Assuming 9 is the index of the pawn in white_pieces
+        result = self.position.check_pawn_move(9, 'white')  # Assuming 9 is the index of the pawn in white_pieces
         self.assertIn((1, 5), result)
         self.assertIn((1, 4), result)
 
@@ -42,25 +88,676 @@ class TestChessGame(unittest.TestCase):
         Smoke test to check if the basic move calculation functions run without errors.
         """
         # Test pawn move
-        self.assertIsNotNone(check_pawn_move(9, 'white'))  # Assuming index 9 is a white pawn
+        self.assertIsNotNone(self.position.check_pawn_move(9, 'white'))  # Assuming index 9 is a white pawn
 
         # Test rook move
-        self.assertIsNotNone(check_rook_move(0, 'white'))  # Assuming index 0 is a white rook
+        self.assertIsNotNone(self.position.check_rook_move(0, 'white'))  # Assuming index 0 is a white rook
 
         # Test knight move
-        self.assertIsNotNone(check_knight_move(1, 'white'))  # Assuming index 1 is a white knight
+        self.assertIsNotNone(self.position.check_knight_move(1, 'white'))  # Assuming index 1 is a white knight
 
         # Test bishop move
-        self.assertIsNotNone(check_bishop_move(2, 'white'))  # Assuming index 2 is a white bishop
+        self.assertIsNotNone(self.position.check_bishop_move(2, 'white'))  # Assuming index 2 is a white bishop
 
         # Test queen move
-        self.assertIsNotNone(check_queen_move(3, 'white'))  # Assuming index 3 is a white queen
+        self.assertIsNotNone(self.position.check_queen_move(3, 'white'))  # Assuming index 3 is a white queen
 
         # Test king move
-        self.assertIsNotNone(check_king_move(4, 'white'))  # Assuming index 4 is a white king
+        self.assertIsNotNone(self.position.check_king_move(4, 'white'))  # Assuming index 4 is a white king
 
         # Test all moves
-        self.assertIsNotNone(check_all_moves('white'))
+        self.assertIsNotNone(self.position.check_all_moves('white'))
+
+    def test_positions_are_independent(self):
+        """
+        Moving a piece in one position must not change another one.
+        """
+        other = Position()
+        self.position.make_move((12, (4, 4), None))  # White pawn from (4, 6) to (4, 4)
+
+        self.assertEqual(self.position.white_pieces_locations[12], (4, 4))
+        self.assertEqual(other.white_pieces_locations[12], (4, 6))
+        self.assertEqual(self.position.turn, 'black')
+        self.assertEqual(other.turn, 'white')
+
+    def test_position_imports_without_pygame(self):
+        """
+        The rules core must be importable by analysis workers that have no display.
+        """
+        code = ('import sys; import package.chess_game_module.position; '
+                'sys.exit(1 if "pygame" in sys.modules else 0)')
+        self.assertEqual(subprocess.run([sys.executable, '-c', code]).returncode, 0)
+
+    def test_bitboard_backend_matches_lists(self):
+        """
+        Both move generators and the ray-walking reference must return the same moves for every piece.
+        """
+        for position in random_positions(300, seed=1, max_plies=120):
+            for color in ['white', 'black']:
+                position.backend = 'lists'
+                expected = [sorted(moves) for moves in position.check_all_moves(color)]
+                position.backend = 'bitboard'
+                self.assertEqual([sorted(moves) for moves in position.check_all_moves(color)], expected)
+                self.assertEqual([sorted(moves) for moves in ray_moves(position, color)], expected)
+
+    def test_perft_reference_positions(self):
+        """
+        Node counts of the standard test positions must match the published numbers.
+        """
+        for name, (fen, counts) in REFERENCE_POSITIONS.items():
+            for backend in ['lists', 'bitboard']:
+                position = from_fen(fen)
+                position.backend = backend
+                self.assertEqual(perft(position, 2), counts[1], f'{name} with {backend} backend')
+
+    def test_unmake_move_restores_position(self):
+        """
+        Taking back every legal move must restore the exact state, over whole random games.
+        """
+        rng = random.Random(3)
+        for _ in range(5):
+            position = from_fen(REFERENCE_POSITIONS['kiwipete'][0])
+            for _ in range(60):
+                moves = position.legal_moves()
+                if not moves:
+                    break
+                before = copy.deepcopy(vars(position))
+                for move in moves:
+                    position.unmake_move(position.make_move(move))
+                    self.assertEqual(vars(position), before)
+                position.make_move(rng.choice(moves))
+                # The occupancy, board and indices updated by make_move equal the ones rebuilt from the lists
+                occupancy, board, indices = position.occupancy[:], position.board[:], position.indices[:]
+                position.sync_board()
+                self.assertEqual((position.occupancy, position.board, position.indices), (occupancy, board, indices))
+
+    def test_incremental_update_matches_full(self):
+        """
+        Updating only the affected pieces must give the same moves as a full recalculation.
+        """
+        rng = random.Random(4)
+        for fen in [REFERENCE_POSITIONS['start'][0], REFERENCE_POSITIONS['kiwipete'][0]]:
+            for _ in range(5):
+                position = from_fen(fen)
+                position.update_valid_moves()
+                for _ in range(80):
+                    moves = position.legal_moves()
+                    if not moves:
+                        break
+                    position.update_valid_moves(position.make_move(rng.choice(moves)))
+                    self.assertEqual(position.white_valid_moves, position.check_all_moves('white'))
+                    self.assertEqual(position.black_valid_moves, position.check_all_moves('black'))
+
+    def test_magic_lookups_match_ray_walks(self):
+        """
+        Sliding attacks from the magic tables must equal walking the rays square by square.
+        """
+        rng = random.Random(5)
+        for _ in range(2000):
+            index, occupied = rng.randrange(64), rng.getrandbits(64) & rng.getrandbits(64)
+            self.assertEqual(rook_attacks(index, occupied), ray_attacks(index, occupied, ROOK_DIRECTIONS))
+            self.assertEqual(bishop_attacks(index, occupied), ray_attacks(index, occupied, BISHOP_DIRECTIONS))
+
+    def test_attack_tables_cache_round_trip(self):
+        """
+        Tables loaded from the cache file must equal freshly built ones.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tables.bin')
+            built = load_tables(path)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(load_tables(path), built)
+            self.assertEqual(built, build_tables())
+
+    def test_incremental_zobrist_key_matches_recompute(self):
+        """
+        The key updated move by move must equal the key calculated from scratch, over long random games.
+        """
+        rng = random.Random(6)
+        for fen in [REFERENCE_POSITIONS['start'][0], REFERENCE_POSITIONS['kiwipete'][0],
+                    REFERENCE_POSITIONS['endgame'][0]]:
+            for _ in range(10):
+                position = from_fen(fen)
+                keys = [position.key]
+                undos = []
+                for _ in range(200):
+                    moves = position.legal_moves()
+                    if not moves:
+                        break
+                    undos.append(position.make_move(rng.choice(moves)))
+                    self.assertEqual(position.key, compute_key(position))
+                    keys.append(position.key)
+                # Taking the moves back restores every earlier key
+                while undos:
+                    keys.pop()
+                    position.unmake_move(undos.pop())
+                    self.assertEqual(position.key, keys[-1])
+
+    def test_zobrist_key_of_transposition(self):
+        """
+        The same position reached by different move orders must have the same key.
+        """
+        def play(moves):
+            position = Position()
+            for start, target in moves:
+                color = position.turn
+                position.make_move((position.pieces(color)[1].index(parse_square(start)), parse_square(target), None))
+            return position
+
+        first = play([('g1', 'f3'), ('g8', 'f6'), ('b1', 'c3'), ('b8', 'c6')])
+        second = play([('b1', 'c3'), ('b8', 'c6'), ('g1', 'f3'), ('g8', 'f6')])
+        self.assertEqual(first.key, second.key)
+        self.assertNotEqual(first.key, Position().key)
+
+    def test_engine_finds_mate_in_one(self):
+        """
+        The engine has to play the back-rank mate and leave the searched position unchanged.
+        """
+        position = from_fen('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+        key, locations = position.key, list(position.white_pieces_locations)
+        result = Engine(1 << 12).search(position, time_limit=5.0, max_depth=3)
+        move = result['move']
+        self.assertEqual(position.white_pieces_locations[move[0]], parse_square('a1'))
+        self.assertEqual(move[1], parse_square('a8'))
+        self.assertEqual(result['score'], MATE_SCORE - 1)
+        self.assertEqual((position.key, position.white_pieces_locations), (key, locations))
+
+    def test_engine_avoids_losing_material(self):
+        """
+        The quiescence search must see that taking a defended pawn with the queen loses her.
+        """
+        position = from_fen('4k3/8/2p5/3p4/8/8/8/3QK3 w - - 0 1')
+        result = Engine(1 << 12).search(position, time_limit=5.0, max_depth=2)
+        self.assertNotEqual(result['move'][1], parse_square('d5'))
+        self.assertGreater(result['score'], 500)
+        self.assertGreater(result['nodes'], 0)
+
+    def test_engine_counts_en_passant_as_capture(self):
+        """
+        An en-passant capture lands on an empty square but must not be kept as a quiet killer move.
+        """
+        position = from_fen('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+        pawn = position.white_pieces_locations.index(parse_square('e5'))
+        self.assertTrue(Engine._is_capture(position, (pawn, parse_square('d6'), None)))
+        self.assertFalse(Engine._is_capture(position, (pawn, parse_square('e6'), None)))
+
+    def test_selfplay_batch_streams_games(self):
+        """
+        A scripted game ends in the right way and a pool run writes one line per game, also for a
+        script with an illegal move.
+        """
+        record = play_game({'index': 0, 'mode': 'scripted',
+                            'moves': ['e2e4', 'e7e5', 'd1h5', 'b8c6', 'f1c4', 'g8f6', 'h5f7']})
+        self.assertEqual((record['result'], record['termination']), ('1-0', 'checkmate'))
+
+        specs = [{'index': index, 'mode': 'random', 'seed': index, 'max_plies': 20} for index in range(4)]
+        specs.append({'index': 4, 'mode': 'scripted', 'moves': ['e2e4', 'e7e5', 'e4e5']})
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'games.jsonl')
+            result = run_batch(specs, workers=2, output=output)
+            with open(output) as file:
+                records = [json.loads(line) for line in file]
+        self.assertEqual(result['games'], 5)
+        self.assertEqual(sorted(record['index'] for record in records), [0, 1, 2, 3, 4])
+        illegal = next(record for record in records if record['index'] == 4)
+        self.assertEqual((illegal['moves'], illegal['termination'], illegal['error']),
+                         (['e2e4', 'e7e5'], 'illegal_move', "illegal move 'e4e5'"))
+        # Games are independent of the worker that plays them
+        self.assertEqual(records[0]['moves'], play_game(specs[records[0]['index']])['moves'])
+
+    def test_dirty_rendering_matches_full_redraw(self):
+        """
+        Redrawing only changed squares must give the same picture as drawing everything.
+        """
+        import pygame
+        from package.chess_game_module import board_drawing
+
+        def frames(selected, valid_moves):
+            position = self.position
+            last_move = position.white_last_move if position.turn == 'black' else position.black_last_move
+            last_moved = None if last_move is None else position.pieces(opponent(position.turn))[1][last_move]
+            arguments = (position.board, position.turn, last_moved, selected)
+            rects = board_drawing.draw_frame(*arguments, valid_moves)
+            dirty = pygame.image.tostring(board_drawing.screen, 'RGB')
+            board_drawing.draw_chess_board(position.turn)
+            board_drawing.draw_pieces(*arguments)
+            board_drawing.draw_valid_moves(valid_moves)
+            self.assertEqual(dirty, pygame.image.tostring(board_drawing.screen, 'RGB'))
+            return rects
+
+        self.position = Position()
+        board_drawing.invalidate()
+        frames(None, [])
+        self.assertEqual(frames(None, []), [])
+        # Selecting a pawn redraws the pawn and its two target squares
+        self.assertEqual(len(frames((4, 6), [(4, 5), (4, 4)])), 3)
+        self.position.make_move((12, (4, 4), None))
+        self.assertEqual(len(frames(None, [])), 4)
+
+    def test_scheduled_redraw_wakes_event_wait(self):
+        """
+        Without input the main loop sleeps only until the next scheduled redraw.
+        """
+        import time
+        from package.chess_game_module import game
+
+        game.pygame.event.get()
+        begin = time.perf_counter()
+        game.schedule_redraw(0.05)
+        self.assertEqual(game.wait_for_events(), [])
+        self.assertGreaterEqual(time.perf_counter() - begin, 0.04)
+        self.assertEqual(game.redraws, [])
+
+    def test_drawn_game_key_matches_compute_key(self):
+        """
+        A stalemate right after a double pawn step leaves no side to move or en-passant column in the key.
+        """
+        from package.chess_game_module import game
+
+        game.position = from_fen('k7/6p1/8/8/8/1q6/8/K7 b - - 0 1')
+        game.position.make_move((1, parse_square('g5'), None))
+        game.end_game_if_over()
+        self.assertEqual(game.position.turn, 'draw')
+        self.assertEqual(game.position.key, compute_key(game.position))
+
+    def test_piece_images_load_lazily_from_any_directory(self):
+        """
+        Piece images come from the atlas next to the module and are scaled once per size.
+        """
+        from package.chess_game_module import board_drawing
+
+        directory = os.getcwd()
+        try:
+            os.chdir(tempfile.gettempdir())
+            small = board_drawing.piece_image('black', 'knight', 40)
+        finally:
+            os.chdir(directory)
+        self.assertEqual(small.get_size(), (40, 40))
+        self.assertIs(board_drawing.piece_image('black', 'knight', 40), small)
+        self.assertEqual(board_drawing.piece_image('black', 'knight').get_size(),
+                         (board_drawing.PIECE_SIZE, board_drawing.PIECE_SIZE))
+
+    def test_text_cache_reuses_surfaces(self):
+        """
+        The same text is rendered once, and the least recently used texts are dropped first.
+        """
+        from package.chess_game_module import board_drawing
+
+        board_drawing.render_text.cache_clear()
+        first = board_drawing.render_text(board_drawing.FONT_SIZE, 'WHITE TO MOVE!', 'black')
+        self.assertIs(board_drawing.render_text(board_drawing.FONT_SIZE, 'WHITE TO MOVE!', 'black'), first)
+        self.assertIsNot(board_drawing.render_text(board_drawing.FONT_SIZE, 'WHITE TO MOVE!', 'red'), first)
+        for number in range(board_drawing.TEXT_CACHE_SIZE):
+            board_drawing.render_text(board_drawing.FONT_SIZE, str(number), 'black')
+        self.assertEqual(board_drawing.render_text.cache_info().currsize, board_drawing.TEXT_CACHE_SIZE)
+        self.assertIsNot(board_drawing.render_text(board_drawing.FONT_SIZE, 'WHITE TO MOVE!', 'black'), first)
+
+    def test_fen_round_trip(self):
+        """
+        Writing a position as FEN and reading it back must give the same state and key.
+        """
+        for fen, _ in REFERENCE_POSITIONS.values():
+            self.assertEqual(to_fen(from_fen(fen)).split()[:4], fen.split()[:4])
+        rng = random.Random(3)
+        position = Position()
+        for _ in range(60):
+            position.make_move(rng.choice(position.legal_moves()))
+            copy = from_fen(to_fen(position))
+            self.assertEqual(to_fen(copy), to_fen(position))
+            self.assertEqual(copy.key, position.key)
+            self.assertEqual(len(copy.legal_moves()), len(position.legal_moves()))
+        # After a double step the en-passant square is written and read back
+        position = from_fen('4k3/8/8/8/3p4/8/4P3/4K3 w - - 0 1')
+        position.make_move((position.white_pieces_locations.index(parse_square('e2')), parse_square('e4'), None))
+        self.assertEqual(to_fen(position), '4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1')
+        self.assertEqual(len(from_fen(to_fen(position)).legal_moves()), len(position.legal_moves()))
+        for invalid in ['8/8/8/8/8/8/8 w - - 0 1', '9/8/8/8/8/8/8/8 w - - 0 1', '8/8/8/8/8/8/8/8 x - - 0 1']:
+            self.assertRaises(ValueError, from_fen, invalid)
+
+    def test_read_fens_streams_file(self):
+        """
+        A FEN file is read line by line, skipping comments, and errors name the line.
+        """
+        # En-passant squares whose pawn can and cannot be taken
+        fens = [fen for fen, _ in REFERENCE_POSITIONS.values()] + \
+            ['4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', '4k3/8/8/3pP3/8/8/8/4K3 b - d6 0 1']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'positions.fen')
+            with open(path, 'w') as file:
+                file.write('# test suite\n\n' + '\n'.join(fens) + '\n')
+            positions = read_fens(path)
+            self.assertEqual(next(positions).key, from_fen(fens[0]).key)
+            self.assertEqual([to_fen(position) for position in positions],
+                             [to_fen(from_fen(fen)) for fen in fens[1:]])
+            # Packed positions are built without a Position but are the same bytes
+            self.assertEqual(list(read_fens(path, packed=True)),
+                             [Mailbox.from_position(from_fen(fen)).pack() for fen in fens])
+            with open(path, 'a') as file:
+                file.write('4k3/8/8/8/8/8/8/4K3 w - z9 0 1\n')
+            for packed in [False, True]:
+                with self.assertRaisesRegex(ValueError, 'positions.fen:11: invalid en-passant square'):
+                    list(read_fens(path, packed))
+        for field in ['e', 'e4', 'e33']:
+            with self.assertRaisesRegex(ValueError, 'invalid en-passant square'):
+                from_fen(f'4k3/8/8/8/8/8/8/4K3 w - {field} 0 1')
+        # A knight in front of the square cannot have made a double step
+        for parse in [from_fen, pack_fen]:
+            with self.assertRaisesRegex(ValueError, 'no pawn in front'):
+                parse('4k3/8/8/3nP3/8/8/8/4K3 w - d6 0 1')
+
+    def test_pgn_replay_reports_rejected_moves(self):
+        """
+        Games with comments and variations replay to the end, bad moves are reported by kind.
+        """
+        text = (
+            '[Event "Paris"]\n[Result "1-0"]\n\n'
+            '1.e4 e5 2.Nf3 d6 3.d4 Bg4 {This is a weak move\nalready.} 4.dxe5 Bxf3 (4...dxe5 5.Qxd8+ Kxd8)\n'
+            '5.Qxf3 dxe5 6.Bc4 Nf6 7.Qb3 Qe7 8.Nc3 c6 9.Bg5 $1 b5 10.Nxb5 cxb5 11.Bxb5+ Nbd7\n'
+            '12.O-O-O Rd8 13.Rxd7 Rxd7 ; comment\n14.Rd1 Qe6 15.Bxd7+ Nxd7 16.Qb8+ Nxb8 17.Rd8# 1-0\n\n'
+            '[Event "ambiguous"]\n\n1. Nf3 Nf6 2. d3 d6 3. Nd2 *\n\n'
+            '[Event "illegal"]\n1. e4 e5 2. Ke3 *\n\n'
+            '[Event "missing check"]\n1. e4 f5 2. Qh5 *\n\n'
+            '[Event "annotated"]\n1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6?? 4. Qxf7#! 1-0\n\n'
+            '[Event "capture without x"]\n1. d4 e5 2. e5 *\n\n'
+            '[Event "en passant without x"]\n1. d4 a6 2. d5 e5 3. e6 *\n\n'
+            '[Event "x without capture"]\n1. Nxf3 *\n'
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.pgn')
+            with open(path, 'w') as file:
+                file.write(text)
+            games = list(read_games(path))
+            reports = list(check_archive(path))
+        self.assertEqual([game['headers']['Event'] for game in games],
+                         ['Paris', 'ambiguous', 'illegal', 'missing check', 'annotated', 'capture without x',
+                          'en passant without x', 'x without capture'])
+        self.assertEqual((games[0]['result'], len(games[0]['moves'])), ('1-0', 33))
+        self.assertEqual((reports[0]['plies'], reports[0]['error']), (33, None))
+        self.assertEqual((reports[4]['plies'], reports[4]['error']), (7, None))
+        self.assertEqual([(report['error']['kind'], report['error']['ply']) for report in reports[1:4] + reports[5:]],
+                         [('ambiguous', 4), ('illegal', 2), ('check_mismatch', 2), ('illegal', 2), ('illegal', 4),
+                          ('illegal', 0)])
+
+    def test_game_records_round_trip(self):
+        """
+        Games written to a record file come back move for move, also after the index is rebuilt.
+        """
+        games = [play_game({'index': index, 'mode': 'random', 'seed': index, 'max_plies': 120}) for index in range(5)]
+        games.append({'moves': ['e2e4', 'd7d5', 'e4d5', 'g8f6'], 'result': '*', 'termination': 'abandoned'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.cgr')
+            with RecordWriter(path) as writer:
+                for game in games:
+                    writer.write(game['moves'], game['result'], game['termination'])
+            self.assertEqual(os.path.getsize(path), 4 + sum(4 + 2 * len(game['moves']) for game in games))
+            os.remove(path + '.idx')
+            with GameRecords(path) as records:
+                self.assertEqual(len(records), len(games))
+                for number, game in enumerate(games):
+                    self.assertEqual(records.header(number), {'plies': len(game['moves']), 'result': game['result'],
+                                                              'termination': game['termination']})
+                    self.assertEqual(records.move(number, len(game['moves']) - 1), game['moves'][-1])
+                position = records.replay(5, plies=3)
+                self.assertEqual(position.white_pieces_locations[11], parse_square('d5'))
+                self.assertEqual(position.key, compute_key(position))
+                expected = Position()
+                for move in games[0]['moves']:
+                    expected.make_move(parse_move(expected, move))
+                self.assertEqual(records.replay(0).key, expected.key)
+            # A crash after the game was flushed but before its index entry, then a game cut short
+            with open(path, 'rb') as file:
+                last_game = file.read()[-12:]
+            with open(path, 'ab') as file:
+                file.write(last_game + last_game[:5])
+            with GameRecords(path) as records:
+                self.assertEqual(len(records), len(games) + 1)
+            os.remove(path + '.idx')
+            with RecordWriter(path) as writer:
+                self.assertEqual(writer.write(games[0]['moves'], games[0]['result'], games[0]['termination']), 7)
+            with GameRecords(path) as records:
+                self.assertEqual(len(records), len(games) + 2)
+                self.assertEqual(records.move(6, 3), 'g8f6')
+                self.assertEqual(records.replay(7).key, expected.key)
+
+    def test_opening_book_lookup(self):
+        """
+        A book built from records counts the moves of every position and only offers legal moves.
+        """
+        games = [(['e2e4', 'e7e5', 'g1f3'], '1-0'), (['e2e4', 'c7c5'], '0-1'), (['d2d4', 'd7d5'], '1/2-1/2'),
+                 (['e2e4', 'e7e5', 'f1c4'], '1-0'), (['a2a3'], '*')]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.cgr')
+            with RecordWriter(path) as writer:
+                for moves, result in games:
+                    writer.write(moves, result)
+            result = build_book([path], os.path.join(directory, 'book.bin'), plies=2)
+            self.assertEqual((result['games'], result['entries']), (4, 5))
+            with OpeningBook(os.path.join(directory, 'book.bin')) as book:
+                start = Position()
+                entries = book.entries(start.key)
+                self.assertEqual([(entry['move'], entry['weight'], entry['count']) for entry in entries],
+                                 [('e2e4', 4, 3), ('d2d4', 1, 1)])
+                start.make_move(book.choose(start, random.Random(0)))
+                self.assertEqual(len(book.entries(start.key)), 2 if start.white_pieces_locations[11] == (3, 4) else 1)
+                self.assertIsNone(book.choose(from_fen('8/8/8/8/8/8/8/K6k w - - 0 1')))
+
+    def test_tablebase_mates_in_the_known_number_of_moves(self):
+        """
+        Generated tables have the published longest mates and their best moves mate on time.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            reports = {report['signature']: report for report in generate(['KPK'], directory, workers=1)}
+            # Mates in 10, 16 and 28 moves, counted with the lone king to move
+            self.assertEqual({signature: report['max_plies'] for signature, report in reports.items()},
+                             {'KQK': 20, 'KRK': 32, 'KPK': 56})
+            tablebase = Tablebase(directory)
+            self.assertEqual(tablebase.probe(from_fen('k7/8/1K6/8/8/8/8/6Q1 w - - 0 1')), MATE_SCORE - 1)
+            self.assertEqual(tablebase.probe(from_fen('8/8/8/8/8/4k3/4p3/4K3 w - - 0 1')), 0)
+            # Black has the rook here, so the board is probed flipped
+            position = from_fen('8/8/3k4/8/8/8/2K5/r7 b - - 0 1')
+            plies = MATE_SCORE - tablebase.probe(position)
+            for _ in range(plies):
+                position.make_move(tablebase.best_move(position))
+            self.assertEqual(position.legal_moves(), [])
+            self.assertTrue(position.in_check('white'))
+            tablebase.close()
+            # Passes split between worker processes solve the same table
+            split = os.path.join(directory, 'split')
+            generate(['KRK'], split, workers=2)
+            with open(os.path.join(directory, 'KRK.tb'), 'rb') as one, open(os.path.join(split, 'KRK.tb'), 'rb') as two:
+                self.assertEqual(one.read(), two.read())
+
+
+    def test_legal_moves_respect_pins_and_checks(self):
+        """
+        The attack map filter keeps the moves found by playing every move, and ends games by mate.
+        """
+        for position in random_positions(300, seed=3):
+            self.assertEqual(position.legal_moves(), legal_moves_by_playing(position))
+
+        def names(position):
+            locations = position.pieces(position.turn)[1]
+            return sorted(move_name(locations[i], target, promotion) for i, target, promotion in position.legal_moves())
+
+        # The rook shields its king and may only move along the file
+        pinned = from_fen('4r2k/8/8/8/8/8/4R3/4K3 w - - 0 1')
+        self.assertEqual(list(AttackMap(pinned).pins), [6 * 8 + 3])
+        self.assertEqual([name for name in names(pinned) if name.startswith('e2')],
+                         ['e2e3', 'e2e4', 'e2e5', 'e2e6', 'e2e7', 'e2e8'])
+        # In double check only the king moves, and not along the rook's rank
+        self.assertEqual(names(from_fen('k7/8/8/8/1b6/8/3N4/r3K3 w - - 0 1')), ['e1e2', 'e1f2'])
+        # Taking en passant would uncover the rook on the rank
+        self.assertNotIn('b5c6', names(from_fen('8/8/8/KPp4r/8/8/8/7k w - c6 0 1')))
+
+        self.assertEqual(game_status(from_fen('rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3')),
+                         'checkmate')
+        self.assertEqual(game_status(from_fen('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1')), 'stalemate')
+        self.assertEqual(game_status(Position()), 'ongoing')
+
+    def test_game_server_pushes_moves_to_players_and_spectators(self):
+        """
+        Two clients play fool's mate over TCP while a third watches; bad moves are rejected.
+        """
+        async def scenario():
+            server = GameServer()
+            listener = await server.serve('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            white, black, spectator = [await GameClient.connect('127.0.0.1', port) for _ in range(3)]
+            white.send('NEW')
+            self.assertEqual(await white.receive(), ['GAME', '1', 'white'])
+            self.assertEqual((await white.receive())[:3], ['STATE', '1', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR'])
+            black.send('JOIN 1')
+            self.assertEqual(await black.receive(), ['GAME', '1', 'black'])
+            await black.receive()
+            self.assertEqual(await white.receive(), ['JOINED', '1', 'black'])
+            spectator.send('WATCH 1')
+            self.assertEqual(await spectator.receive(), ['GAME', '1', 'spectator'])
+            await spectator.receive()
+
+            black.send('MOVE 1 e7e5')
+            self.assertEqual(await black.receive(), ['ERROR', 'not', 'your', 'turn', 'in', 'game', '1'])
+            white.send('MOVE 1 e2e5')
+            self.assertEqual((await white.receive())[:2], ['ERROR', 'illegal'])
+            for ply, (client, move) in enumerate([(white, 'f2f3'), (black, 'e7e5'), (white, 'g2g4'), (black, 'd8h4')]):
+                client.send(f'MOVE 1 {move}')
+                status = 'checkmate' if move == 'd8h4' else 'ongoing'
+                for receiver in (white, black, spectator):
+                    self.assertEqual(await receiver.receive(), ['MOVED', '1', str(ply + 1), move, status])
+            white.send('MOVE 1 e2e4')
+            self.assertEqual(await white.receive(), ['ERROR', 'the', 'game', 'is', 'over'])
+
+            for client in (white, black, spectator):
+                await client.close()
+            listener.close()
+            await listener.wait_closed()
+            # The game is forgotten once everyone left
+            for _ in range(100):
+                if not server.games:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(server.games, {})
+
+        asyncio.run(scenario())
+
+    def test_instrumentation_counts_calls_and_restores_functions(self):
+        """
+        Enabled instrumentation times move generation; disabled, the original methods are back.
+        """
+        original = Position.check_all_moves
+        with Instrumentation().enable(rendering=False) as instruments:
+            self.assertIsNot(Position.check_all_moves, original)
+            self.assertEqual(perft(Position(), 2), 400)
+            for seconds in (0.0005, 0.003, 2.0):
+                instruments.record_frame(seconds)
+        self.assertIs(Position.check_all_moves, original)
+        report = instruments.report()
+        self.assertEqual(report['functions']['legal_moves']['calls'], 21)
+        self.assertEqual(report['functions']['check_all_moves']['calls'], 21)
+        self.assertEqual(report['functions']['check_piece_move']['calls'], 21 * 16)
+        self.assertEqual({bucket: count for bucket, count in report['frames']['histogram'].items() if count},
+                         {'<=1ms': 1, '<=4ms': 1, '>1000ms': 1})
+        with tempfile.TemporaryDirectory() as directory:
+            instruments.dump(os.path.join(directory, 'profile.json'))
+            with open(os.path.join(directory, 'profile.json')) as file:
+                self.assertEqual(json.load(file)['frames']['count'], 3)
+            instruments.dump(os.path.join(directory, 'profile.csv'))
+            with open(os.path.join(directory, 'profile.csv')) as file:
+                self.assertIn('function,make_move,20,', file.read())
+
+    def test_analysis_reports_depths_and_cancels_on_new_position(self):
+        """
+        The engine reports every depth and stops when asked; the analysis worker finds a mate and
+        forgets it as soon as another position is sent.
+        """
+        depths = []
+        result = Engine().search(Position(), 30.0, stop=lambda: True, report=lambda r: depths.append(r['depth']))
+        self.assertLess(result['seconds'], 5.0)
+        self.assertEqual(depths, list(range(1, result['depth'] + 1)))
+
+        analysis = Analysis()
+        try:
+            analysis.analyse(from_fen('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 4 4'))
+            deadline = time.perf_counter() + 60
+            while analysis.running and time.perf_counter() < deadline:
+                analysis.poll()
+                time.sleep(0.01)
+            self.assertFalse(analysis.running)
+            self.assertIn('+M1', format_analysis(analysis.result, 'white'))
+            self.assertEqual(analysis.result['move'][1], parse_square('f7'))
+            analysis.analyse(Position())
+            self.assertIsNone(analysis.result)
+            self.assertTrue(analysis.running)
+        finally:
+            analysis.close()
+        self.assertEqual(analysis.process.exitcode, 0)
+
+    def test_parallel_search_is_deterministic_with_one_worker(self):
+        """
+        Shared table entries read back unchanged; one worker searches exactly like the engine, and
+        more workers reach the same depth.
+        """
+        table = SharedTable(memoryview(bytearray(64)))
+        entry = (2 ** 64 - 5, 7, -MATE_SCORE + 3, 2, ((3, 6), (4, 0), 'knight'), 255)
+        table[1] = entry
+        self.assertEqual((table[0], table[1]), (None, entry))
+
+        position = from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+        expected = Engine().search(position, 1e9, 2)
+        for _ in range(2):
+            with ParallelSearch(1) as search:
+                result = search.search(position, 1e9, 2)
+            self.assertEqual([result[key] for key in ('move', 'score', 'nodes', 'line')],
+                             [expected[key] for key in ('move', 'score', 'nodes', 'line')])
+        with ParallelSearch(3) as search:
+            result = search.search(position, 1e9, 2)
+        self.assertEqual(result['depth'], 2)
+        self.assertIn(result['move'], position.legal_moves())
+
+    def test_mailbox_and_packed_store_round_trip(self):
+        """
+        Mailboxes and packed positions give back the position they were made from, moves too.
+        """
+        store = PositionStore()
+        positions = random_positions(200, seed=4)
+        for position in positions:
+            mailbox = Mailbox.from_position(position)
+            self.assertEqual(store.append(position), len(store) - 1)
+            self.assertEqual(mailbox.fen(), to_fen(position))
+            self.assertEqual(mailbox.to_position().key, position.key)
+            for piece, location in zip(position.white_pieces, position.white_pieces_locations):
+                self.assertEqual(mailbox.piece_at(location), ('white', piece))
+            locations = position.pieces(position.turn)[1]
+            for move in position.legal_moves():
+                code = pack_move(position, move)
+                self.assertEqual(code, encode_move(move_name(locations[move[0]], move[1], move[2])))
+                self.assertEqual(unpack_move(position, code), move)
+        self.assertEqual(len(store.data), 34 * len(positions))
+        self.assertEqual([store[i] for i in (0, 57, -1)],
+                         [Mailbox.from_position(positions[i]) for i in (0, 57, -1)])
+        self.assertIsNone(Mailbox.from_position(Position()).piece_at((3, 4)))
+
+    @unittest.skipUnless(numpy, 'needs numpy')
+    def test_batch_moves_match_check_all_moves(self):
+        """
+        The NumPy batch generator finds the moves and attacks of the scalar rules, castling included.
+        """
+        from package.chess_game_module.batch import BatchBoards, attack_maps, pseudo_legal_moves, scalar_moves
+        from package.chess_game_module.bitboard import PIECE_TYPES, Bitboards, attacked_squares
+
+        positions = random_positions(300, seed=6) + [from_fen(fen) for fen, _ in REFERENCE_POSITIONS.values()]
+        store = PositionStore()
+        for position in positions:
+            store.append(position)
+        for batch in (BatchBoards.from_positions(positions), BatchBoards.from_store(store)):
+            masks, counts = pseudo_legal_moves(batch)
+            attacks = attack_maps(batch)
+            for i, position in enumerate(positions):
+                scalar_masks, count = scalar_moves(position)
+                self.assertEqual(counts[i], count)
+                self.assertEqual({piece: int(masks[piece][i]) for piece in PIECE_TYPES}, scalar_masks)
+                boards = Bitboards(position)
+                self.assertEqual([int(attacks[i, 0]), int(attacks[i, 1])],
+                                 [attacked_squares(boards, 'white'), attacked_squares(boards, 'black')])
 
 
 #if __name__ == '__main__':
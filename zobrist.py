@@ -0,0 +1,100 @@
+"""
+Zobrist hashing of positions.
+
+Every (color, piece type, square) combination, the side to move, every castling right and
+every en-passant column get a fixed random 64-bit number. The key of a position is the XOR
+of the numbers of everything present in it, so a move changes the key by XORing out what
+it removes and XORing in what it adds. Position keeps its key in Position.key and updates
+it this way in make_move; compute_key calculates it from scratch.
+"""
+import random
+from typing import Optional
+
+_generator = random.Random(0x5EED)
+
+PIECE_INDEX = {'pawn': 0, 'rook': 1, 'knight': 2, 'bishop': 3, 'king': 4, 'queen': 5}
+# PIECE_KEYS[color][piece][square], color 0 is white, square is y * 8 + x
+PIECE_KEYS = [[[_generator.getrandbits(64) for _ in range(64)] for _ in range(6)] for _ in range(2)]
+BLACK_TO_MOVE_KEY = _generator.getrandbits(64)
+# one key for every right: white short, white long, black short, black long
+_RIGHT_KEYS = [_generator.getrandbits(64) for _ in range(4)]
+# CASTLING_KEYS[rights] combines the keys of all rights set in the 4-bit rights value
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights >> _bit & 1:
+            CASTLING_KEYS[_rights] ^= _RIGHT_KEYS[_bit]
+EN_PASSANT_KEYS = [_generator.getrandbits(64) for _ in range(8)]
+
+
+def castling_rights(position) -> int:
+    """
+    Packs the castling rights of a position into four bits.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    int: Bit 0 white short, bit 1 white long, bit 2 black short, bit 3 black long castling.
+    """
+    king_moved, rook_moved = position.king_moved, position.rook_moved
+    rights = 0
+    if not king_moved[0]:
+        rights |= (not rook_moved[0][0]) | (not rook_moved[0][1]) << 1
+    if not king_moved[1]:
+        rights |= (not rook_moved[1][0]) << 2 | (not rook_moved[1][1]) << 3
+    return rights
+
+
+def en_passant_column(position) -> Optional[int]:
+    """
+    Finds the column of a pawn that has just made a double step.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    Optional[int]: The x of the pawn that can be captured en-passant, or None, also for a drawn
+    game, which has no side to move.
+    """
+    if position.turn == 'draw':
+        return None
+    # 'black_won' means black made the last move, just like 'white' does
+    if position.turn == 'white' or position.turn == 'black_won':
+        last_move, pre_last_move, pieces, locations = position.black_last_move, position.black_pre_last_move, \
+            position.black_pieces, position.black_pieces_locations
+        start_row, row = 1, 3
+    else:
+        last_move, pre_last_move, pieces, locations = position.white_last_move, position.white_pre_last_move, \
+            position.white_pieces, position.white_pieces_locations
+        start_row, row = 6, 4
+    if last_move is None or pre_last_move != start_row or pieces[last_move] != 'pawn' or \
+            locations[last_move][1] != row:
+        return None
+    return locations[last_move][0]
+
+
+def compute_key(position) -> int:
+    """
+    Calculates the Zobrist key of a position from scratch.
+
+    Args:
+    position (Position): The position.
+
+    Returns:
+    int: The 64-bit key.
+    """
+    key = 0
+    for color_index, pieces, locations in [(0, position.white_pieces, position.white_pieces_locations),
+                                           (1, position.black_pieces, position.black_pieces_locations)]:
+        piece_keys = PIECE_KEYS[color_index]
+        for piece, (x, y) in zip(pieces, locations):
+            key ^= piece_keys[PIECE_INDEX[piece]][y * 8 + x]
+    # After a king capture the winner made the last move, so the loser is the side to move
+    if position.turn == 'black' or position.turn == 'white_won':
+        key ^= BLACK_TO_MOVE_KEY
+    key ^= CASTLING_KEYS[castling_rights(position)]
+    column = en_passant_column(position)
+    if column is not None:
+        key ^= EN_PASSANT_KEYS[column]
+    return key